@@ -1,19 +1,32 @@
 import asyncio
+import cProfile
+import functools
+import io
+import json
 import logging
+import pstats
+import random
 import re
+import secrets
+import shutil
+import sys
+import threading
 import time
 import calendar as pycal
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from datetime import datetime, timedelta, date
-from collections import Counter
-from concurrent.futures import ThreadPoolExecutor
-from threading import RLock
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager, nullcontext
+from threading import Event, Lock, RLock
 from pathlib import Path
 from typing import Optional
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     CallbackQueryHandler,
     ContextTypes,
@@ -29,10 +42,36 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, StaleElementReferenceException, WebDriverException
+from selenium.common.exceptions import (
+    NoSuchWindowException,
+    StaleElementReferenceException,
+    TimeoutException,
+    WebDriverException,
+)
 
 from webdriver_manager.chrome import ChromeDriverManager
 
+try:
+    from playwright.async_api import Error as PlaywrightError, TimeoutError as PlaywrightTimeout, async_playwright
+except ImportError:  # нужен только при BROWSER_BACKEND = "playwright"
+    async_playwright = None
+
+    class PlaywrightError(Exception):
+        pass
+
+    class PlaywrightTimeout(PlaywrightError):
+        pass
+
+try:
+    import psutil
+except ImportError:  # без psutil /stats не покажет Chrome/RSS
+    psutil = None
+
+try:
+    import tornado.web
+except ImportError:  # ставится вместе с python-telegram-bot[webhooks]; нужен только для health-роута
+    tornado = None
+
 
 # ---------------- config ----------------
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
@@ -45,10 +84,65 @@ HEADLESS = True
 ADMIN_CHAT_ID = 125030638  # <-- chat_id для обратной связи (если нужно)
 
 WAIT_POLL = 0.1
-EXECUTOR = ThreadPoolExecutor(max_workers=6)
+# на каждой странице с самого старта отключаются CSS-переходы/анимации, плавная прокрутка и jQuery.fx —
+# тогда паузы «пока доиграет анимация» можно держать короткими (значения справа — как было с анимациями)
+SUPPRESS_ANIMATIONS = True
+SCROLL_SETTLE_SEC = 0.0 if SUPPRESS_ANIMATIONS else 0.03
+CALENDAR_NAV_SETTLE_SEC = 0.03 if SUPPRESS_ANIMATIONS else 0.12
+# эти ожидания не про анимацию и от SUPPRESS_ANIMATIONS не зависят: тишина в #timeBlocks — это ещё не пришедшие
+# XHR и дорисовка слотов скриптами сайта, пауза после «Выйти» — серверный logout и перерисовка страницы
+TIMEBLOCKS_QUIET_SEC = 0.7
+MODAL_SETTLE_SEC = 0.6
+PAGE_LOAD_TIMEOUT = 35
+# плановый перезапуск Chrome между задачами: после стольких навигаций или при RSS дерева процессов выше порога
+# (0 — порог выключен; RSS проверяется не чаще раза в RECYCLE_CHECK_SEC и только при установленном psutil)
+RECYCLE_AFTER_NAVIGATIONS = 300
+RECYCLE_RSS_MB = 1500
+RECYCLE_CHECK_SEC = 30
+# сколько ждём параллельного quit() всех драйверов при остановке; кто не успел — процессы добиваются через psutil
+SHUTDOWN_QUIT_TIMEOUT = 15
+# считать и засекать каждую WebDriver-команду по сценариям и местам вызова (/driverstats у админа)
+DRIVER_INSTRUMENTATION = True
+
+# общий бюджет времени на один сценарий; вложенные ожидания берут время из остатка бюджета
+TIMES_DEADLINE_SEC = 45
+BOOKING_DEADLINE_SEC = 60
+
+# circuit breaker по комнате: после BREAKER_FAIL_THRESHOLD ошибок сервера подряд (от любых пользователей)
+# запросы к комнате не идут BREAKER_BASE_SEC * 2^n секунд (с джиттером, не больше BREAKER_MAX_SEC)
+BREAKER_FAIL_THRESHOLD = 3
+BREAKER_BASE_SEC = 10
+BREAKER_MAX_SEC = 300
+BREAKER_JITTER = 0.3
+# пока breaker открыт, можно показать слоты из кэша не старше этого возраста
+SLOTS_STALE_TTL = 30 * 60
+# перед записью сверяем выбранное время со слотами: из кэша не старше этого возраста, иначе — одна проверка на сайте
+SLOT_PRECHECK_MAX_AGE = 20
+SLOT_ALTERNATIVES = 3
+EXECUTOR_WORKERS = 6
+EXECUTOR = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)
+
+# сколько апдейтов (от разных пользователей) обрабатываем одновременно;
+# апдейты одного пользователя всегда идут строго по очереди
+CONCURRENT_UPDATES = 32
+
+# "polling" — long polling (как раньше); "webhook" — встроенный webhook-сервер PTB:
+# Telegram сам присылает апдейты на WEBHOOK_URL, без задержки long poll
+UPDATE_MODE = "polling"
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "telegram"
+WEBHOOK_URL = "https://example.com:8443"  # <-- публичный адрес (без WEBHOOK_PATH)
+WEBHOOK_SECRET = ""  # пусто — генерируется при старте; Telegram шлёт его в X-Telegram-Bot-Api-Secret-Token
+# сертификат и ключ — если TLS терминирует сам бот (самоподписанный сертификат уйдёт в setWebhook);
+# None — TLS снимает прокси перед ботом
+WEBHOOK_CERT: Optional[str] = None
+WEBHOOK_KEY: Optional[str] = None
+# GET /healthz на этом порту (None — не поднимать)
+HEALTH_LISTEN = "127.0.0.1"
+HEALTH_PORT: Optional[int] = 8080
 
 CHROMEDRIVER_PATH = ChromeDriverManager().install()
-CHROME_SERVICE = Service(CHROMEDRIVER_PATH)
 
 SEL_PICKER_CALENDAR = "div.picker_calendar"
 
@@ -67,14 +161,78 @@ MY_RECORDS_URLS = [
     "https://bumpix.net/en/page/client-appointments",
 ]
 
+# результат проверки сессии ("Мои записи" доступны?) кэшируется на драйвер на это время,
+# пока набор кук bumpix не поменялся
+SESSION_CHECK_TTL = 60
+BUMPIX_COOKIE_DOMAIN = "bumpix.net"
+BUMPIX_ORIGINS = ["https://bumpix.net", "https://www.bumpix.net"]
+
+# "cdp" — выход мгновенно, чисткой кук/хранилища bumpix через DevTools (с откатом на "ui");
+# "ui" — как раньше: ищем и кликаем «Выход» на сайте
+LOGOUT_MODE = "cdp"
+
 MAX_DAYS_AHEAD = 365
 RECORDS_PAGE_SIZE = 5
 
 PAGE_SIZE = 20
 
+# слоты читаем из XHR/fetch-ответа, который заполняет #timeBlocks (performance log Chrome);
+# если ответ не найден или не разобран — как раньше, из DOM с голосованием
+NETWORK_SLOTS = True
+NETWORK_SLOTS_TIMEOUT = 8
+# без голого "time": под него попадают посторонние запросы (server-time, timezone...)
+SLOTS_XHR_URL_HINTS = ("timeblock", "time-block", "slot", "schedule", "interval")
+# подтверждение записи: первый POST XHR к эндпоинту записи bumpix после «Записаться» с понятным ответом
+# или появившийся узел успеха/ошибки (MutationObserver), без опроса текста страницы
+BOOKING_CONFIRM_TIMEOUT = 10
+# по этим подстрокам URL POST считается запросом записи (аналитика, трекеры и прочие POST — нет)
+BOOKING_POST_URL_HINTS = ("appointment", "booking", "record")
+BOOKING_SUCCESS_SELECTORS = ".alert-success, .swal2-success, .toast-success, .notification-success, #appointmentSuccess"
+BOOKING_ERROR_SELECTORS = ".alert-danger, .alert-error, .swal2-error, .toast-error, .notification-error"
+
+# сколько вкладок комнат держим "тёплыми" в одном Chrome (плюс основная вкладка для кабинета); лишние закрываем по LRU
+ROOM_TABS_BUDGET = 3
+
 PROFILES_DIR = Path("./chrome_profiles").resolve()
 PROFILES_DIR.mkdir(parents=True, exist_ok=True)
 
+# "selenium" — синхронные сценарии на WebDriver в пуле потоков EXECUTOR;
+# "playwright" — async-сценарии прямо в event loop бота (pip install playwright), тот же Chrome и те же профили
+BROWSER_BACKEND = "selenium"
+
+# несколько выбранных слотов записываем параллельно: куки пользователя копируются в BOOKING_CONTEXTS
+# отдельных браузеров (Selenium) / контекстов (Playwright), каждый бронирует свой слот.
+# Выключено по умолчанию: в Selenium это до BOOKING_CONTEXTS лишних Chrome поверх пользовательских
+PARALLEL_BOOKING = False
+BOOKING_CONTEXTS = 3
+# свободный Chrome пула параллельной записи закрывается, если простоял дольше этого
+BOOKING_POOL_IDLE_SEC = 120
+
+# "process" — у каждого пользователя свой Chrome со своим --user-data-dir (как раньше);
+# "contexts" — несколько общих Chrome, у пользователя изолированный browser context (как инкогнито),
+# куки сохраняются в COOKIES_DIR и восстанавливаются при пересоздании контекста
+BROWSER_MODE = "process"
+SHARED_CHROMES = 2
+COOKIES_DIR = PROFILES_DIR / "cookies"
+# после закрытия Chrome из профиля удаляются кэши (HTTP, JS, GPU, service worker) — остаются куки, localStorage, настройки
+PROFILE_COMPACT = True
+# общий бюджет на профили u_*; сверх него удаляются неоткрытые профили, начиная с давно не запускавшихся. 0 — без лимита
+PROFILES_BUDGET_MB = 2048
+# подсчёт размера всех профилей (обход каждого файла) дорог: после закрытия Chrome он идёт в фоновом потоке
+# и не чаще раза в PROFILES_BUDGET_CHECK_SEC; при старте/остановке бота — сразу
+PROFILES_BUDGET_CHECK_SEC = 300
+# профили на tmpfs (например Path("/dev/shm/bumpix_profiles")): быстрый старт и никакой записи на диск, но после
+# рестарта они пусты — поэтому куки пользователя после каждой задачи сохраняются в COOKIES_DIR и подкладываются в новый Chrome
+PROFILES_TMPFS_DIR: Optional[Path] = None
+# общий HTTP-кэш статики Bumpix (JS/CSS/шрифты): раз в ASSET_CACHE_TTL_HOURS анонимный Chrome открывает комнаты в отдельном
+# профиле, и его кэш копируется в каждый профиль пользователя, где кэша нет (новый пользователь, после сжатия)
+ASSET_CACHE = True
+ASSET_CACHE_MAX_MB = 64
+ASSET_CACHE_TTL_HOURS = 12
+# неудачная или отвергнутая (больше ASSET_CACHE_MAX_MB) сборка повторяется не раньше чем через столько минут
+ASSET_CACHE_RETRY_MIN = 30
+ASSET_CACHE_DIR = PROFILES_DIR / "asset_cache"
+
 PHONE_HINT = "Введите номер телефона (логин) в формате +7XXXXXXXXXX\nПример: +79991234567"
 PHONE_BAD = "Телефон некорректный. Формат: +7XXXXXXXXXX\nПример: +79991234567"
 
@@ -291,9 +449,399 @@ async def cabinet_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Отменено. Выберите комнату:", reply_markup=room_keyboard(context))
 
 
+# ---------------- job cancellation / deadline ----------------
+class JobCancelled(Exception):
+    pass
+
+
+class DeadlineExceeded(JobCancelled):
+    def __init__(self, stage: str, budget_sec: float, stage_times: dict[str, float]):
+        self.stage = stage
+        self.budget_sec = budget_sec
+        self.stage_times = dict(stage_times)
+        super().__init__(f"Не уложились в {budget_sec:.0f} с (этап «{stage}»)")
+
+    def describe(self) -> str:
+        text = f"Не удалось получить слоты за {self.budget_sec:.0f} с: время закончилось на этапе «{self.stage}»."
+        if self.stage_times:
+            slowest, sec = max(self.stage_times.items(), key=lambda kv: kv[1])
+            text += f"\nДольше всего: «{slowest}» ({sec:.1f} с)."
+        return text
+
+
+class CancelToken:
+    """
+    Токен отмены браузерной задачи. Проверяется внутри циклов ожидания/опроса,
+    поэтому отменённая задача прерывается за один шаг опроса (~0.1-0.2 с).
+    Опционально несёт общий дедлайн сценария: все вложенные ожидания берут время из остатка.
+    """
+
+    def __init__(self):
+        self._event = Event()
+        self.deadline: Optional[float] = None
+        self.budget_sec = 0.0
+        self.stage = "старт"
+        self._stage_started = time.monotonic()
+        self.stage_times: dict[str, float] = {}
+
+    def start_budget(self, budget_sec: float):
+        self.budget_sec = float(budget_sec)
+        self.deadline = time.monotonic() + self.budget_sec
+        self.stage_times = {}
+        self._stage_started = time.monotonic()
+
+    def enter(self, stage: str):
+        now = time.monotonic()
+        self.stage_times[self.stage] = self.stage_times.get(self.stage, 0.0) + (now - self._stage_started)
+        self.stage = stage
+        self._stage_started = now
+
+    def remaining(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def timeout(self, cap: float) -> float:
+        rem = self.remaining()
+        return cap if rem is None else min(cap, rem)
+
+    def cancel(self):
+        self._event.set()
+
+    def child(self) -> "CancelToken":
+        """Токен подзадачи (клон сессии при параллельной записи): свои стадии и бюджет, отмена общая с этим токеном."""
+        tok = CancelToken()
+        tok._event = self._event
+        return tok
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise JobCancelled("Задача отменена более новым запросом.")
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.enter(self.stage)
+            raise DeadlineExceeded(self.stage, self.budget_sec, self.stage_times)
+
+    def sleep(self, sec: float):
+        # просыпаемся сразу при отмене, а не по окончании паузы
+        t0 = time.perf_counter()
+        self._event.wait(max(0.0, self.timeout(sec)))
+        DRIVER_PROFILER.record_sleep(time.perf_counter() - t0)
+        self.check()
+
+
+def check_cancel(token: Optional[CancelToken]):
+    if token is not None:
+        token.check()
+
+
+def enter_stage(token: Optional[CancelToken], stage: str):
+    if token is not None:
+        token.check()
+        token.enter(stage)
+
+
+def budget_timeout(token: Optional[CancelToken], timeout: float) -> float:
+    return timeout if token is None else token.timeout(timeout)
+
+
+def token_sleep(token: Optional[CancelToken], sec: float):
+    if token is None:
+        pause(sec)
+    else:
+        token.sleep(sec)
+
+
+def wait_until(driver, cond, timeout, token: Optional[CancelToken] = None):
+    if token is None:
+        return WebDriverWait(driver, timeout, poll_frequency=WAIT_POLL).until(cond)
+
+    def guarded(d):
+        token.check()
+        return cond(d)
+
+    try:
+        return WebDriverWait(driver, token.timeout(timeout), poll_frequency=WAIT_POLL).until(guarded)
+    except TimeoutException:
+        # ожидание оборвалось из-за исчерпания общего бюджета, а не своего таймаута
+        token.check()
+        raise
+
+
+# ---------------- on-demand profiling (/profile) ----------------
+PROFILE_TOP_N = 40
+
+
+class OnDemandProfiler:
+    """
+    cProfile для следующих N вызовов cb или задач воркера нужного вида; отчёт уходит админу файлом.
+    Пока не взведён — одна проверка счётчика на вызов.
+    Для cb (и задач Playwright) профиль снимается со всего потока event loop, т. е. включает чужие апдейты.
+    Профиль одновременно снимается только один на весь процесс: с Python 3.12 cProfile занимает общий
+    sys.monitoring, и второй enable() в другом потоке падает с ValueError.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.left = 0
+        self.target: Optional[tuple[str, Optional[str]]] = None  # ("cb", None) | ("job", kind)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.bot = None
+        self.active = False
+
+    def arm(self, target: str, kind: Optional[str], n: int, bot):
+        with self.lock:
+            self.target = (target, kind)
+            self.left = n
+            self.bot = bot
+            self.loop = asyncio.get_running_loop()
+
+    def disarm(self):
+        with self.lock:
+            self.left = 0
+            self.target = None
+
+    def start(self, target: str, kind: Optional[str] = None) -> Optional[cProfile.Profile]:
+        if not self.left:
+            return None
+        with self.lock:
+            # профиль уже идёт (в этом или другом потоке) — второй не снимаем
+            if self.active or self.left <= 0 or self.target not in ((target, kind), (target, None)):
+                return None
+            self.left -= 1
+            self.active = True
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError as e:
+            # профилировщик включён кем-то ещё (другой инструмент в процессе) — этот вызов не считаем
+            logger.warning("cannot start profiler for %s %s: %s", target, kind or "", e)
+            with self.lock:
+                self.active = False
+                if self.target is not None:
+                    self.left += 1
+            return None
+        return prof
+
+    def stop(self, prof: Optional[cProfile.Profile], label: str, wall_sec: float):
+        if prof is None:
+            return
+        prof.disable()
+        with self.lock:
+            self.active = False
+        buf = io.StringIO()
+        buf.write(f"{label}: {wall_sec:.2f} s wall\n\n")
+        stats = pstats.Stats(prof, stream=buf).strip_dirs()
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+        stats.sort_stats("tottime").print_stats(PROFILE_TOP_N)
+        data = buf.getvalue().encode("utf-8")
+        name = "profile_" + re.sub(r"[^\w.-]+", "_", label)[:60] + ".txt"
+        if self.bot is None or self.loop is None or not ADMIN_CHAT_ID:
+            logger.info("profile %s:\n%s", label, data.decode("utf-8")[:4000])
+            return
+        asyncio.run_coroutine_threadsafe(
+            self.bot.send_document(chat_id=ADMIN_CHAT_ID, document=data, filename=name, caption=f"{label} ({wall_sec:.2f} с)"),
+            self.loop,
+        )
+
+    @contextmanager
+    def job(self, kind: str):
+        prof = self.start("job", kind)
+        if prof is None:
+            yield
+            return
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stop(prof, f"job {kind}", time.monotonic() - t0)
+
+
+PROFILER = OnDemandProfiler()
+
+
+def profiled_handler(fn):
+    @functools.wraps(fn)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        prof = PROFILER.start("cb")
+        if prof is None:
+            return await fn(update, context)
+        t0 = time.monotonic()
+        try:
+            return await fn(update, context)
+        finally:
+            data = update.callback_query.data if update.callback_query else ""
+            PROFILER.stop(prof, f"cb {data}", time.monotonic() - t0)
+
+    return wrapper
+
+
+# ---------------- WebDriver instrumentation ----------------
+class FlowStats:
+    def __init__(self):
+        self.runs = 0
+        self.wall_sec = 0.0
+        self.commands = 0
+        self.wire_sec = 0.0
+        self.sleep_sec = 0.0
+        self.by_command: dict[str, list] = {}  # команда -> [count, sec]
+        self.by_site: dict[str, list] = {}  # "функция:строка" -> [count, sec]
+
+
+class DriverProfiler:
+    """
+    Сводка по WebDriver-командам: сколько их, сколько времени ушло на протокол и на явные паузы —
+    по сценариям (services/times/booking/...) и по местам вызова в этом файле.
+    Сценарий привязан к потоку: команды вне flow() не считаются.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.flows: dict[str, FlowStats] = {}
+        self._local = threading.local()
+
+    def current(self) -> Optional[str]:
+        return getattr(self._local, "flow", None)
+
+    @contextmanager
+    def flow(self, kind: str):
+        prev = self.current()
+        self._local.flow = kind
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.flow = prev
+            with self.lock:
+                st = self.flows.setdefault(kind, FlowStats())
+                st.runs += 1
+                st.wall_sec += time.perf_counter() - t0
+
+    def record_command(self, kind: str, command: str, sec: float, site: str):
+        with self.lock:
+            st = self.flows.setdefault(kind, FlowStats())
+            st.commands += 1
+            st.wire_sec += sec
+            for key, table in ((command, st.by_command), (site, st.by_site)):
+                row = table.setdefault(key, [0, 0.0])
+                row[0] += 1
+                row[1] += sec
+
+    def record_sleep(self, sec: float):
+        kind = self.current()
+        if kind is None:
+            return
+        with self.lock:
+            self.flows.setdefault(kind, FlowStats()).sleep_sec += sec
+
+    def reset(self):
+        with self.lock:
+            self.flows.clear()
+
+    def report(self, top: int = 6) -> str:
+        with self.lock:
+            if not self.flows:
+                return "Команд WebDriver пока не было."
+            parts = []
+            for kind, st in sorted(self.flows.items(), key=lambda kv: -kv[1].wall_sec):
+                runs = max(1, st.runs)
+                lines = [
+                    f"[{kind}] запусков {st.runs}, в среднем {st.wall_sec / runs:.2f} с: "
+                    f"{st.commands / runs:.0f} команд, протокол {st.wire_sec / runs:.2f} с, паузы {st.sleep_sec / runs:.2f} с"
+                ]
+                for title, table in (("команды", st.by_command), ("места вызова", st.by_site)):
+                    rows = sorted(table.items(), key=lambda kv: -kv[1][1])[:top]
+                    lines.append(f"  {title}: " + "; ".join(f"{k} ×{c / runs:.1f} {sec / runs:.2f} с" for k, (c, sec) in rows))
+                parts.append("\n".join(lines))
+            return "\n\n".join(parts)
+
+
+DRIVER_PROFILER = DriverProfiler()
+
+
+def _driver_call_site() -> str:
+    # ближайший кадр из этого файла выше обёртки execute — функция-хелпер, которая породила команду
+    f = sys._getframe(2)
+    while f is not None and f.f_code.co_filename != __file__:
+        f = f.f_back
+    return f"{f.f_code.co_name}:{f.f_lineno}" if f is not None else "?"
+
+
+def instrument_driver(driver):
+    """
+    Оборачивает driver.execute: через него идут все команды — и драйвера (get, execute_script, page_source, CDP),
+    и элементов (click, get_attribute, find_element(s)), так что хелперы менять не нужно.
+    """
+    execute = driver.execute
+
+    def timed_execute(driver_command, params=None):
+        kind = DRIVER_PROFILER.current()
+        if kind is None:
+            return execute(driver_command, params)
+        t0 = time.perf_counter()
+        try:
+            return execute(driver_command, params)
+        finally:
+            DRIVER_PROFILER.record_command(kind, driver_command, time.perf_counter() - t0, _driver_call_site())
+
+    driver.execute = timed_execute
+    return driver
+
+
+JS_NO_ANIMATIONS = r"""
+(() => {
+  const css = `*, *::before, *::after {
+    transition-duration: 0s !important; transition-delay: 0s !important;
+    animation-duration: 0s !important; animation-delay: 0s !important;
+    scroll-behavior: auto !important;
+  }`;
+  const add = () => {
+    if (document.getElementById('__bot_no_anim') || !document.documentElement) return;
+    const st = document.createElement('style');
+    st.id = '__bot_no_anim';
+    st.textContent = css;
+    (document.head || document.documentElement).appendChild(st);
+  };
+  if (document.documentElement) add();
+  else new MutationObserver((_, obs) => { if (document.documentElement) { obs.disconnect(); add(); } })
+    .observe(document, {childList: true});
+  document.addEventListener('DOMContentLoaded', () => {
+    add();
+    // jQuery-анимации (fadeIn/slideDown) идут таймерами, а не CSS
+    if (window.jQuery && window.jQuery.fx) window.jQuery.fx.off = true;
+  });
+})();
+"""
+
+
+def suppress_animations(driver):
+    """Ставит JS_NO_ANIMATIONS на все будущие документы текущей вкладки (CDP действует на одну вкладку)."""
+    if not SUPPRESS_ANIMATIONS:
+        return
+    try:
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": JS_NO_ANIMATIONS})
+    except WebDriverException as e:
+        logger.info("cannot install no-animation script: %s", e)
+
+
+def pause(sec: float):
+    """time.sleep, который попадает в сводку DRIVER_PROFILER как явная пауза."""
+    time.sleep(sec)
+    DRIVER_PROFILER.record_sleep(sec)
+
+
 # ---------------- selenium helpers ----------------
+# метка каждого Chrome бота, и с профилем, и без (Chrome неизвестные ключи игнорирует):
+# по ней reap_orphaned_chrome находит свои процессы, не трогая чужую автоматизацию того же пользователя ОС
+BOT_CHROME_FLAG = f"--bumpix-bot={PROFILES_DIR}"
+
+
 def make_driver(headless: bool, profile_dir: Optional[Path]):
     opts = Options()
+    opts.add_argument(BOT_CHROME_FLAG)
     if headless:
         opts.add_argument("--headless=new")
     opts.add_argument("--disable-gpu")
@@ -303,30 +851,422 @@ def make_driver(headless: bool, profile_dir: Optional[Path]):
     opts.add_argument("--disable-blink-features=AutomationControlled")
     opts.add_argument("--lang=ru-RU")
     opts.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    if NETWORK_SLOTS:
+        opts.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        opts.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": False})
     try:
         opts.page_load_strategy = "eager"
     except Exception:
         pass
 
     if profile_dir is not None:
-        profile_dir.mkdir(parents=True, exist_ok=True)
+        prepare_profile(profile_dir)
         opts.add_argument(f"--user-data-dir={str(profile_dir)}")
         opts.add_argument("--profile-directory=Default")
 
-    driver = webdriver.Chrome(service=CHROME_SERVICE, options=opts)
-    driver.set_page_load_timeout(35)
-    return driver
+    # свой Service на каждый драйвер: общий перезаписывал service.process, и quit() одного гасил чужой chromedriver
+    driver = webdriver.Chrome(service=Service(CHROMEDRIVER_PATH), options=opts)
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    suppress_animations(driver)
+    return instrument_driver(driver) if DRIVER_INSTRUMENTATION else driver
+
+
+def note_navigation(driver):
+    driver.bot_navigations = getattr(driver, "bot_navigations", 0) + 1
+
+
+def driver_tree_rss(driver) -> Optional[int]:
+    """RSS chromedriver + всех его потомков (Chrome, рендереры, GPU) в байтах; None — без psutil/процесса."""
+    if psutil is None:
+        return None
+    try:
+        root = psutil.Process(driver.service.process.pid)
+        procs = [root] + root.children(recursive=True)
+    except (AttributeError, psutil.Error):
+        return None
+    total = 0
+    for proc in procs:
+        try:
+            total += proc.memory_info().rss
+        except psutil.Error:
+            continue
+    return total
+
+
+def recycle_reason(driver) -> Optional[str]:
+    """Почему драйвер пора перезапустить (между задачами), или None."""
+    navs = getattr(driver, "bot_navigations", 0)
+    if RECYCLE_AFTER_NAVIGATIONS and navs >= RECYCLE_AFTER_NAVIGATIONS:
+        return f"{navs} навигаций"
+    if not RECYCLE_RSS_MB:
+        return None
+    now = time.monotonic()
+    if now - getattr(driver, "bot_rss_checked", 0.0) < RECYCLE_CHECK_SEC:
+        return None
+    driver.bot_rss_checked = now
+    rss = driver_tree_rss(driver)
+    if rss is not None and rss >= RECYCLE_RSS_MB * 2**20:
+        return f"RSS {rss / 2**20:.0f} МБ"
+    return None
+
+
+def log_recycle(who: str, reason: str, rss_before: Optional[int], rss_after: Optional[int]):
+    """rss_before — дерево старого Chrome перед quit(), rss_after — нового сразу после запуска."""
+
+    def mb(rss: Optional[int]) -> str:
+        return f"{rss / 2**20:.0f} МБ" if rss is not None else "n/a"
+
+    reclaimed = mb(rss_before - rss_after) if rss_before is not None and rss_after is not None else "n/a"
+    logger.info("recycled Chrome for %s (%s): rss_before %s, rss_after %s, reclaimed %s", who, reason, mb(rss_before), mb(rss_after), reclaimed)
+
+
+def quit_drivers(drivers: list, timeout: float):
+    """Параллельный quit(); зависшие за timeout драйверы убиваются вместе с деревом процессов."""
+    if not drivers:
+        return
+    pool = ThreadPoolExecutor(max_workers=min(16, len(drivers)), thread_name_prefix="quit")
+    futures = {pool.submit(driver.quit): driver for driver in drivers}
+    _, pending = wait(futures, timeout=timeout)
+    pool.shutdown(wait=False, cancel_futures=True)
+    for fut in pending:
+        kill_driver_tree(futures[fut])
+    logger.info("quit %d drivers (%d killed after %.0fs)", len(drivers), len(pending), timeout)
+
+
+def kill_driver_tree(driver):
+    if psutil is None:
+        return
+    try:
+        root = psutil.Process(driver.service.process.pid)
+        procs = root.children(recursive=True) + [root]
+    except (AttributeError, psutil.Error):
+        return
+    for proc in procs:
+        try:
+            proc.kill()
+        except psutil.Error:
+            pass
+
+
+# ---------------- profile disk budget ----------------
+PROFILE_LOCK_FILES = ("SingletonLock", "SingletonCookie", "SingletonSocket")
+# то, что Chrome спокойно пересоздаст сам; Cookies, Local Storage и Preferences не трогаем
+PROFILE_CACHE_DIRS = (
+    "Default/Cache",
+    "Default/Code Cache",
+    "Default/GPUCache",
+    "Default/Service Worker",
+    "Default/DawnCache",
+    "Default/DawnGraphiteCache",
+    "Default/DawnWebGPUCache",
+    "Default/blob_storage",
+    "Default/Session Storage",
+    "Default/Sessions",
+    "GrShaderCache",
+    "GraphiteDawnCache",
+    "ShaderCache",
+    "component_crx_cache",
+    "optimization_guide_model_store",
+    "BrowserMetrics",
+    "Crashpad",
+)
+
+
+class BackgroundTask:
+    """Обслуживание в фоновом потоке: не параллельно самому себе и не чаще заданного интервала между запусками."""
+
+    def __init__(self, name: str, fn):
+        self.name = name
+        self.fn = fn
+        self.lock = Lock()
+        self.running = False
+        self.last_start: Optional[float] = None
+
+    def kick(self, min_interval_sec: float) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            if self.running or (self.last_start is not None and now - self.last_start < min_interval_sec):
+                return False
+            self.running = True
+            self.last_start = now
+        threading.Thread(target=self._run, name=self.name, daemon=True).start()
+        return True
+
+    def _run(self):
+        try:
+            self.fn()
+        except Exception as e:
+            logger.warning("%s failed: %s", self.name, e)
+        finally:
+            with self.lock:
+                self.running = False
+
+
+def profiles_root() -> Path:
+    return PROFILES_TMPFS_DIR or PROFILES_DIR
+
+
+def profile_dir_for(tg_user_id: int) -> Path:
+    return profiles_root() / f"u_{tg_user_id}"
+
+
+def prepare_profile(profile_dir: Path):
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    # mtime каталога = последний запуск: по нему enforce_profiles_budget решает, кого удалять первым
+    profile_dir.touch()
+    if profile_dir.name.startswith("u_"):
+        seed_profile_cache(profile_dir)
+        refresh_asset_cache_async()
+
+
+ASSET_CACHE_LOCK = Lock()
+
+
+def asset_cache_fresh() -> bool:
+    try:
+        return time.time() - ASSET_CACHE_DIR.stat().st_mtime < ASSET_CACHE_TTL_HOURS * 3600
+    except OSError:
+        return False
+
+
+def seed_profile_cache(profile_dir: Path):
+    """Профиль без HTTP-кэша получает копию общего: бандлы Bumpix не качаются заново при первом открытии."""
+    cache = profile_dir / "Default" / "Cache"
+    if not ASSET_CACHE or cache.exists() or not ASSET_CACHE_DIR.is_dir():
+        return
+    try:
+        shutil.copytree(ASSET_CACHE_DIR, cache)
+    except (OSError, shutil.Error) as e:
+        # общий кэш могли как раз подменять — профиль просто стартует без него
+        logger.info("cannot seed %s from asset cache: %s", profile_dir.name, e)
+        shutil.rmtree(cache, ignore_errors=True)
+
+
+def build_asset_cache():
+    """
+    Анонимный Chrome в одноразовом профиле открывает публичные страницы комнат; его Default/Cache (после quit, когда
+    индекс сброшен на диск) атомарно подменяет ASSET_CACHE_DIR. Куки и данные пользователей туда не попадают.
+    """
+    if not ASSET_CACHE_LOCK.acquire(blocking=False):
+        return
+    build_dir = PROFILES_DIR / f".asset-build-{secrets.token_hex(4)}"
+    trash = PROFILES_DIR / f".trash-asset-cache-{secrets.token_hex(4)}"
+    try:
+        t0 = time.monotonic()
+        drv = make_driver(headless=True, profile_dir=build_dir)
+        try:
+            for room in ROOMS.values():
+                drv.get(room["url"])
+                WebDriverWait(drv, PAGE_LOAD_TIMEOUT, poll_frequency=WAIT_POLL).until(
+                    lambda d: d.execute_script("return document.readyState") == "complete"
+                )
+        finally:
+            drv.quit()
+        cache = build_dir / "Default" / "Cache"
+        size = dir_size(cache) if cache.is_dir() else 0
+        if not size:
+            logger.warning("asset cache build produced no cache, keeping the previous one")
+            return
+        if size > ASSET_CACHE_MAX_MB * 2**20:
+            logger.warning("asset cache is %.0f МБ (> ASSET_CACHE_MAX_MB), keeping the previous one", size / 2**20)
+            return
+        if ASSET_CACHE_DIR.exists():
+            ASSET_CACHE_DIR.rename(trash)
+        cache.rename(ASSET_CACHE_DIR)
+        ASSET_CACHE_DIR.touch()
+        logger.info("asset cache rebuilt: %.1f МБ in %.1fs", size / 2**20, time.monotonic() - t0)
+    except Exception as e:
+        logger.warning("cannot build asset cache: %s", e)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        shutil.rmtree(trash, ignore_errors=True)
+        ASSET_CACHE_LOCK.release()
+
+
+ASSET_CACHE_TASK = BackgroundTask("asset-cache", build_asset_cache)
+
+
+def refresh_asset_cache_async():
+    # время попытки запоминается при любом исходе: после неудачной сборки mtime кэша не меняется,
+    # и без паузы каждый старт Chrome запускал бы новую
+    if ASSET_CACHE and not asset_cache_fresh():
+        ASSET_CACHE_TASK.kick(ASSET_CACHE_RETRY_MIN * 60)
+
+
+def profile_in_use(profile_dir: Path) -> bool:
+    # SingletonLock живёт, пока Chrome держит профиль (зависшие после падения снимает reap_orphaned_chrome)
+    return (profile_dir / "SingletonLock").is_symlink()
+
+
+def dir_size(path: Path) -> int:
+    total = 0
+    for p in path.rglob("*"):
+        try:
+            if p.is_file() and not p.is_symlink():
+                total += p.stat().st_size
+        except OSError:
+            continue
+    return total
+
+
+def compact_profile(profile_dir: Path) -> int:
+    """Удаляет кэши из закрытого профиля; возвращает, сколько байт освобождено."""
+    if not PROFILE_COMPACT or profile_in_use(profile_dir):
+        return 0
+    freed = 0
+    for rel in PROFILE_CACHE_DIRS:
+        path = profile_dir / rel
+        if path.is_dir():
+            freed += dir_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+    return freed
 
 
-def open_page(driver, url: str):
-    driver.get(url)
-    WebDriverWait(driver, 25, poll_frequency=WAIT_POLL).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
+PROFILES_BUDGET_LOCK = Lock()
+
+
+def enforce_profiles_budget() -> int:
+    """LRU: удаляет закрытые профили, начиная с давно не запускавшихся, пока все u_* не уложатся в PROFILES_BUDGET_MB."""
+    if not PROFILES_BUDGET_MB:
+        return 0
+    with PROFILES_BUDGET_LOCK:
+        return _enforce_profiles_budget()
+
+
+def _enforce_profiles_budget() -> int:
+    profiles = []
+    for profile_dir in profiles_root().glob("u_*"):
+        try:
+            profiles.append((profile_dir.stat().st_mtime, profile_dir, dir_size(profile_dir)))
+        except OSError:
+            continue
+    total = sum(size for _, _, size in profiles)
+    budget = PROFILES_BUDGET_MB * 2**20
+    removed = 0
+    for _, profile_dir, size in sorted(profiles, key=lambda p: p[0]):
+        if total <= budget:
+            break
+        if profile_in_use(profile_dir):
+            continue
+        # сначала атомарно убираем с пути: Chrome, стартующий в этот момент, получит чистый профиль, а не полуудалённый
+        trash = profile_dir.with_name(f".trash-{profile_dir.name}-{secrets.token_hex(4)}")
+        try:
+            profile_dir.rename(trash)
+        except OSError:
+            continue
+        shutil.rmtree(trash, ignore_errors=True)
+        total -= size
+        removed += 1
+    if removed:
+        logger.info("profiles over budget: removed %d least recently used, %.0f МБ left", removed, total / 2**20)
+    return removed
+
+
+PROFILES_BUDGET_TASK = BackgroundTask("profiles-budget", enforce_profiles_budget)
+
+
+def release_profile(profile_dir: Path):
+    """После закрытия Chrome: сжать его профиль; общий бюджет проверяется в фоне (PROFILES_BUDGET_CHECK_SEC)."""
+    freed = compact_profile(profile_dir)
+    if freed:
+        logger.info("compacted %s: %.1f МБ freed", profile_dir.name, freed / 2**20)
+    if PROFILES_BUDGET_MB:
+        PROFILES_BUDGET_TASK.kick(PROFILES_BUDGET_CHECK_SEC)
+
+
+def maintain_profiles():
+    """Старт/остановка бота: сжать все закрытые профили и применить бюджет."""
+    # недоудалённое и недособранное с прошлого запуска (reap_orphaned_chrome уже погасил их Chrome)
+    for root in {PROFILES_DIR, profiles_root()}:
+        for leftover in [*root.glob(".trash-*"), *root.glob(".asset-build-*")]:
+            shutil.rmtree(leftover, ignore_errors=True)
+    freed = sum(compact_profile(profile_dir) for profile_dir in profiles_root().glob("u_*"))
+    if freed:
+        logger.info("compacted profiles: %.0f МБ freed", freed / 2**20)
+    enforce_profiles_budget()
+
+
+def _is_bot_chrome(proc) -> bool:
+    """Chrome прошлого запуска бота: с меткой BOT_CHROME_FLAG или (запущенный до неё) с профилем из наших каталогов."""
+    if "chrom" not in proc.name().lower():
+        return False
+    args = proc.cmdline()
+    if BOT_CHROME_FLAG in args:
+        return True
+    cmdline = " ".join(args)
+    return f"--user-data-dir={PROFILES_DIR}" in cmdline or f"--user-data-dir={profiles_root()}" in cmdline
+
+
+def _bot_chrome_tree(proc) -> list:
+    """Chrome бота вместе с его рендерерами и chromedriver, который его запустил."""
+    procs = [proc] + proc.children(recursive=True)
+    parent = proc.parent()
+    if parent is not None and "chromedriver" in parent.name().lower():
+        procs.append(parent)
+    return procs
+
+
+def reap_orphaned_chrome():
+    """
+    При старте: добивает chrome/chromedriver этого пользователя ОС, оставшиеся от прошлого запуска (рестарт, падение),
+    и удаляет Singleton*-блокировки в профилях — иначе Chrome откажется открыть профиль «занятым».
+    """
+    killed = 0
+    if psutil is None:
+        logger.warning("psutil is not installed, skipping orphaned Chrome reaper")
+    else:
+        me = psutil.Process()
+        user = me.username()
+        victims = {}
+        for proc in psutil.process_iter():
+            try:
+                if proc.pid != me.pid and proc.username() == user and _is_bot_chrome(proc):
+                    victims.update((p.pid, p) for p in _bot_chrome_tree(proc) if p.pid != me.pid)
+            except psutil.Error:
+                continue
+        victims = list(victims.values())
+        for proc in victims:
+            try:
+                proc.kill()
+                killed += 1
+            except psutil.Error:
+                pass
+        psutil.wait_procs(victims, timeout=5)
+    locks = 0
+    for profile_dir in profiles_root().glob("u_*"):
+        for fname in PROFILE_LOCK_FILES:
+            # SingletonLock — битая симлинка на hostname-pid, exists() для неё False
+            lock = profile_dir / fname
+            if lock.is_symlink() or lock.exists():
+                lock.unlink(missing_ok=True)
+                locks += 1
+    if killed or locks:
+        logger.info("reaped %d orphaned Chrome processes, removed %d profile locks", killed, locks)
+
+
+def open_page(driver, url: str, token: Optional[CancelToken] = None):
+    note_navigation(driver)
+    check_cancel(token)
+    load_timeout = budget_timeout(token, PAGE_LOAD_TIMEOUT)
+    if load_timeout < PAGE_LOAD_TIMEOUT:
+        driver.set_page_load_timeout(max(1, int(load_timeout)))
+        try:
+            driver.get(url)
+        except TimeoutException:
+            check_cancel(token)
+            raise
+        finally:
+            driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    else:
+        driver.get(url)
+    wait_until(driver, EC.presence_of_element_located((By.TAG_NAME, "body")), 25, token)
 
 
 def robust_click(driver, el):
     try:
         driver.execute_script("arguments[0].scrollIntoView({block:'center'});", el)
-        time.sleep(0.03)
+        if SCROLL_SETTLE_SEC:
+            pause(SCROLL_SETTLE_SEC)
         el.click()
     except StaleElementReferenceException:
         raise
@@ -345,82 +1285,88 @@ def is_disabled_like(driver, el):
         return True
 
 
-def page_source_has_any(driver, needles: list[str]) -> bool:
-    src = (driver.page_source or "").lower()
+AUTH_REQUIRED_NEEDLES = [
+    "sign in required",
+    "you have not signed in yet",
+    "войти",
+    "логин",
+    "пароль",
+    "регистрация",
+    "sign in",
+    "forgot password",
+    "восстанов",
+]
+LOGGED_IN_NEEDLES = ["выход", "logout"]
+
+
+def text_has_any(src: str, needles: list[str]) -> bool:
+    src = (src or "").lower()
     return any((n or "").lower() in src for n in needles)
 
 
+def page_source_has_any(driver, needles: list[str]) -> bool:
+    return text_has_any(driver.page_source, needles)
+
+
 def looks_like_auth_required(driver) -> bool:
-    return page_source_has_any(
-        driver,
-        [
-            "sign in required",
-            "you have not signed in yet",
-            "войти",
-            "логин",
-            "пароль",
-            "регистрация",
-            "sign in",
-            "forgot password",
-            "восстанов",
-        ],
-    )
+    return page_source_has_any(driver, AUTH_REQUIRED_NEEDLES)
 
 
 def looks_like_logged_in(driver) -> bool:
-    return page_source_has_any(driver, ["выход", "logout"])
+    return page_source_has_any(driver, LOGGED_IN_NEEDLES)
+
+
+JS_VISIBLE_MODAL_ROOT = r"""
+function visible(el){
+  if(!el) return false;
+  const st = window.getComputedStyle(el);
+  if(st.display === 'none' || st.visibility === 'hidden' || st.opacity === '0') return false;
+  const r = el.getBoundingClientRect();
+  return r.width > 50 && r.height > 50;
+}
+const mods = Array.from(document.querySelectorAll('.modal,[role="dialog"]'));
+for(const m of mods){
+  if(visible(m)) return m;
+}
+return null;
+"""
 
 
 def js_get_visible_modal_root(driver):
-    return driver.execute_script(
-        r"""
-        function visible(el){
-          if(!el) return false;
-          const st = window.getComputedStyle(el);
-          if(st.display === 'none' || st.visibility === 'hidden' || st.opacity === '0') return false;
-          const r = el.getBoundingClientRect();
-          return r.width > 50 && r.height > 50;
-        }
-        const mods = Array.from(document.querySelectorAll('.modal,[role="dialog"]'));
-        for(const m of mods){
-          if(visible(m)) return m;
-        }
-        return null;
-        """
-    )
+    return driver.execute_script(JS_VISIBLE_MODAL_ROOT)
 
 
 def js_modal_visible(driver) -> bool:
     return bool(js_get_visible_modal_root(driver))
 
 
+JS_CLICK_BY_TEXT = r"""
+const arr = (arguments[0]||[]).map(x => String(x||'').trim().toLowerCase()).filter(Boolean);
+function visible(el){
+  if(!el) return false;
+  const st = window.getComputedStyle(el);
+  if(st.display === 'none' || st.visibility === 'hidden' || st.opacity === '0') return false;
+  const r = el.getBoundingClientRect();
+  return r.width > 10 && r.height > 10;
+}
+const nodes = Array.from(document.querySelectorAll('a,button,span,div'));
+for(const n of nodes){
+  const tx = (n.textContent||'').trim().toLowerCase();
+  if(!tx) continue;
+  if(!arr.includes(tx)) continue;
+  if(!visible(n)) continue;
+  const clickEl = n.closest('a,button') || n;
+  clickEl.scrollIntoView({block:'center'});
+  clickEl.click();
+  return true;
+}
+return false;
+"""
+
+
 def js_find_and_click_by_text(driver, texts: list[str]) -> bool:
     return bool(
-        driver.execute_script(
-            r"""
-            const arr = (arguments[0]||[]).map(x => String(x||'').trim().toLowerCase()).filter(Boolean);
-            function visible(el){
-              if(!el) return false;
-              const st = window.getComputedStyle(el);
-              if(st.display === 'none' || st.visibility === 'hidden' || st.opacity === '0') return false;
-              const r = el.getBoundingClientRect();
-              return r.width > 10 && r.height > 10;
-            }
-            const nodes = Array.from(document.querySelectorAll('a,button,span,div'));
-            for(const n of nodes){
-              const tx = (n.textContent||'').trim().toLowerCase();
-              if(!tx) continue;
-              if(!arr.includes(tx)) continue;
-              if(!visible(n)) continue;
-              const clickEl = n.closest('a,button') || n;
-              clickEl.scrollIntoView({block:'center'});
-              clickEl.click();
-              return true;
-            }
-            return false;
-            """,
-            texts,
-        )
+        driver.execute_script(JS_CLICK_BY_TEXT, texts)
     )
 
 
@@ -485,45 +1431,237 @@ def click_modal_button_by_text(driver, text_variants: list[str]) -> bool:
     return False
 
 
-def read_modal_errors(driver) -> str:
-    return driver.execute_script(
-        r"""
-        function visible(el){
-          if(!el) return false;
-          const st = window.getComputedStyle(el);
-          if(st.display === 'none' || st.visibility === 'hidden' || st.opacity === '0') return false;
-          const r = el.getBoundingClientRect();
-          return r.width > 10 && r.height > 8;
-        }
-        const root = (() => {
-          const mods = Array.from(document.querySelectorAll('.modal,[role="dialog"]'));
-          for(const m of mods){ if(visible(m)) return m; }
-          return document;
-        })();
-        const nodes = Array.from(root.querySelectorAll('.alert,.help-block,.text-danger,.error,.has-error'));
-        const texts = [];
-        for(const n of nodes){
-          const t = (n.innerText || n.textContent || '').trim();
-          if(t && t.length < 700) texts.push(t);
-        }
-        const uniq = [...new Set(texts)];
-        return uniq.join('\n');
-        """
-    )
+JS_MODAL_ERRORS = r"""
+function visible(el){
+  if(!el) return false;
+  const st = window.getComputedStyle(el);
+  if(st.display === 'none' || st.visibility === 'hidden' || st.opacity === '0') return false;
+  const r = el.getBoundingClientRect();
+  return r.width > 10 && r.height > 8;
+}
+const root = (() => {
+  const mods = Array.from(document.querySelectorAll('.modal,[role="dialog"]'));
+  for(const m of mods){ if(visible(m)) return m; }
+  return document;
+})();
+const nodes = Array.from(root.querySelectorAll('.alert,.help-block,.text-danger,.error,.has-error'));
+const texts = [];
+for(const n of nodes){
+  const t = (n.innerText || n.textContent || '').trim();
+  if(t && t.length < 700) texts.push(t);
+}
+const uniq = [...new Set(texts)];
+return uniq.join('\n');
+"""
+
+
+def read_modal_errors(driver) -> str:
+    return driver.execute_script(JS_MODAL_ERRORS)
+
+
+# ---------------- session check (cookies + cached verdict) ----------------
+class RecordsUrlMemo:
+    """Какой из вариантов MY_RECORDS_URLS открылся последним (на весь процесс) — его пробуем первым."""
+
+    def __init__(self):
+        self.lock = RLock()
+        self.preferred: Optional[str] = None
+
+    def ordered(self) -> list[str]:
+        with self.lock:
+            pref = self.preferred
+        if not pref:
+            return list(MY_RECORDS_URLS)
+        return [pref] + [u for u in MY_RECORDS_URLS if u != pref]
+
+    def remember(self, url: str):
+        with self.lock:
+            self.preferred = url
+
+
+RECORDS_URLS = RecordsUrlMemo()
+
+
+def bumpix_cookies(driver) -> Optional[list[dict]]:
+    """Непросроченные куки bumpix.net из браузера (без навигации). None — прочитать не удалось."""
+    try:
+        cookies = (driver.execute_cdp_cmd("Network.getAllCookies", {}) or {}).get("cookies") or []
+    except Exception:
+        try:
+            cookies = driver.get_cookies() or []
+        except Exception:
+            return None
+    return live_bumpix_cookies(cookies)
+
+
+def live_bumpix_cookies(cookies: list[dict]) -> list[dict]:
+    """Из кук браузера (CDP, Selenium или Playwright) — непросроченные куки bumpix.net."""
+    now = time.time()
+    out = []
+    for c in cookies:
+        domain = (c.get("domain") or "").lstrip(".").lower()
+        if not domain.endswith(BUMPIX_COOKIE_DOMAIN):
+            continue
+        expires = c.get("expires", c.get("expiry"))
+        if isinstance(expires, (int, float)) and 0 < expires < now:
+            continue
+        out.append(c)
+    return out
 
 
-def verify_records_access(driver) -> bool:
-    for u in MY_RECORDS_URLS:
+def cookie_fingerprint(cookies: list[dict]) -> frozenset:
+    # значения сессионных кук сайт переподписывает на каждом ответе, поэтому сравниваем только имена
+    return frozenset((c.get("name") or "") for c in cookies)
+
+
+class SessionCheckCache:
+    def __init__(self):
+        self.lock = RLock()
+        self.by_session: dict[str, tuple[frozenset, float, bool]] = {}
+
+    @staticmethod
+    def _key(driver) -> str:
+        key = str(getattr(driver, "session_id", "") or id(driver))
+        if BROWSER_MODE == "contexts":
+            # один драйвер на многих пользователей — различаем по вкладке (она живёт в контексте пользователя)
+            try:
+                key += ":" + driver.current_window_handle
+            except WebDriverException:
+                pass
+        return key
+
+    def get(self, driver, fingerprint: frozenset) -> Optional[bool]:
+        with self.lock:
+            hit = self.by_session.get(self._key(driver))
+        if not hit:
+            return None
+        fp, ts, ok = hit
+        if fp != fingerprint or (time.time() - ts) > SESSION_CHECK_TTL:
+            return None
+        return ok
+
+    def put(self, driver, fingerprint: frozenset, ok: bool):
+        with self.lock:
+            self.by_session[self._key(driver)] = (fingerprint, time.time(), ok)
+
+    def invalidate(self, driver):
+        with self.lock:
+            self.by_session.pop(self._key(driver), None)
+
+
+SESSION_CHECKS = SessionCheckCache()
+
+
+def remember_session_verdict(driver, ok: bool):
+    cookies = bumpix_cookies(driver)
+    if cookies is None:
+        SESSION_CHECKS.invalidate(driver)
+    else:
+        SESSION_CHECKS.put(driver, cookie_fingerprint(cookies), ok)
+
+
+def probe_records_access(driver, token: Optional[CancelToken] = None) -> bool:
+    """
+    Открываем "Мои записи". Если вариант URL уже известен и страница загрузилась,
+    её вердикт окончательный; остальные варианты пробуем только если загрузка не удалась.
+    """
+    known = RECORDS_URLS.preferred is not None
+    for u in RECORDS_URLS.ordered():
         try:
-            open_page(driver, u)
+            open_page(driver, u, token)
+        except JobCancelled:
+            raise
         except Exception:
             continue
-        time.sleep(0.25)
+        token_sleep(token, 0.25)
         if not looks_like_auth_required(driver):
+            RECORDS_URLS.remember(u)
             return True
+        if known:
+            return False
     return False
 
 
+def verify_records_access(driver, token: Optional[CancelToken] = None, force: bool = False) -> bool:
+    cookies = bumpix_cookies(driver)
+    if cookies is not None and not cookies:
+        # кук bumpix нет вовсе — сессии точно нет, страницы не открываем
+        SESSION_CHECKS.put(driver, frozenset(), False)
+        return False
+
+    if not force and cookies is not None:
+        cached = SESSION_CHECKS.get(driver, cookie_fingerprint(cookies))
+        if cached is not None:
+            return cached
+
+    ok = probe_records_access(driver, token)
+    remember_session_verdict(driver, ok)
+    return ok
+
+
+def clear_bumpix_site_data(driver) -> bool:
+    """Удаляет куки bumpix.net и его localStorage/sessionStorage/IndexedDB прямо в живом браузере."""
+    cookies = bumpix_cookies(driver)
+    if cookies is None:
+        return False
+    try:
+        for c in cookies:
+            driver.execute_cdp_cmd("Network.deleteCookies", {"name": c.get("name") or "", "domain": c.get("domain") or ""})
+    except Exception:
+        return False
+    for origin in BUMPIX_ORIGINS:
+        try:
+            driver.execute_cdp_cmd(
+                "Storage.clearDataForOrigin",
+                {"origin": origin, "storageTypes": "cookies,local_storage,session_storage,indexeddb,websql"},
+            )
+        except Exception:
+            pass
+    SESSION_CHECKS.invalidate(driver)
+    return True
+
+
+def cabinet_logout_cdp(driver) -> bool:
+    if not clear_bumpix_site_data(driver):
+        return False
+    # одна дешёвая проверка: живых кук bumpix не осталось
+    left = bumpix_cookies(driver)
+    if left is None or left:
+        return False
+    SESSION_CHECKS.put(driver, frozenset(), False)
+    return True
+
+
+def driver_is_healthy(driver) -> bool:
+    try:
+        return driver.execute_script("return 1;") == 1 and bool(driver.window_handles)
+    except Exception:
+        return False
+
+
+def wipe_browser_state(driver):
+    """
+    Возвращает тот же процесс Chrome в чистое состояние: одна вкладка about:blank,
+    без кук, кэша и хранилища сайта.
+    """
+    handles = list(driver.window_handles)
+    keep = handles[0]
+    for h in handles[1:]:
+        driver.switch_to.window(h)
+        driver.close()
+    driver.switch_to.window(keep)
+    driver.get("about:blank")
+
+    driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    for origin in BUMPIX_ORIGINS:
+        try:
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+        except Exception:
+            pass
+    SESSION_CHECKS.invalidate(driver)
+
+
 def cabinet_logout_with_driver(driver) -> bool:
     """
     Реальный logout: ищем "Выйти/Выход/Logout" и кликаем.
@@ -537,19 +1675,19 @@ def cabinet_logout_with_driver(driver) -> bool:
     # 1) Пытаемся кликнуть явный "Выход/Logout" (в меню/шапке/странице)
     clicked = js_find_and_click_by_text(driver, ["выход", "выйти", "logout", "log out", "sign out"])
     if clicked:
-        time.sleep(0.6)
+        pause(MODAL_SETTLE_SEC)
 
     # 2) Если модалка/подтверждение — пробуем подтвердить
     try:
         if js_modal_visible(driver):
             click_modal_button_by_text(driver, ["выйти", "выход", "да", "ok", "подтвердить", "logout", "sign out"])
-            time.sleep(0.6)
+            pause(MODAL_SETTLE_SEC)
     except Exception:
         pass
 
     # 3) Проверяем: "Мои записи" должны требовать вход
     try:
-        if verify_records_access(driver):
+        if verify_records_access(driver, force=True):
             # всё ещё доступно => logout не сработал
             return False
     except Exception:
@@ -558,7 +1696,7 @@ def cabinet_logout_with_driver(driver) -> bool:
     # Доп. проверка: на главной/кабинете появились признаки необходимости входа
     try:
         open_page(driver, CABINET_URL)
-        time.sleep(0.2)
+        pause(0.2)
     except Exception:
         pass
 
@@ -594,37 +1732,65 @@ def short_raw_service_fallback(raw: str) -> str:
 
 
 # ---------------- timeBlocks helpers ----------------
+JS_TIMEBLOCKS_HTML = "const tb = document.querySelector('#timeBlocks'); return tb ? tb.innerHTML : null;"
+JS_TIMEBLOCKS_TEXT = "const tb = document.querySelector('#timeBlocks'); return tb ? (tb.innerText || '') : '';"
+JS_TIMEBLOCKS_CHANGED = "const tb = document.querySelector('#timeBlocks'); return (tb ? tb.innerHTML : '') !== arguments[0];"
+
+
 def get_timeblocks_html(driver):
-    return driver.execute_script("const tb = document.querySelector('#timeBlocks'); return tb ? tb.innerHTML : null;")
+    return driver.execute_script(JS_TIMEBLOCKS_HTML)
 
 
 def get_timeblocks_text(driver):
-    return driver.execute_script("const tb = document.querySelector('#timeBlocks'); return tb ? (tb.innerText || '') : '';") or ""
+    return driver.execute_script(JS_TIMEBLOCKS_TEXT) or ""
 
 
-def is_server_error_timeblocks(driver) -> bool:
-    low = (get_timeblocks_text(driver) or "").strip().lower()
+def is_server_error_text(txt: str) -> bool:
+    low = (txt or "").strip().lower()
     return ("servererror" in low) or ("при запросе к серверу произошла ошибка" in low) or ("попробуйте позже" in low)
 
 
-def is_placeholder_timeblocks(driver) -> bool:
-    txt = (get_timeblocks_text(driver) or "").strip()
+def is_placeholder_text(txt: str) -> bool:
+    txt = (txt or "").strip()
     if not txt:
         return True
     return bool(re.fullmatch(r"[.\s]+", txt))
 
 
-def wait_timeblocks_changed(driver, prev_html, timeout=10):
-    WebDriverWait(driver, timeout, poll_frequency=WAIT_POLL).until(
-        lambda d: (get_timeblocks_html(d) or "") != (prev_html or "")
-    )
+def is_server_error_timeblocks(driver) -> bool:
+    return is_server_error_text(get_timeblocks_text(driver))
+
+
+def is_placeholder_timeblocks(driver) -> bool:
+    return is_placeholder_text(get_timeblocks_text(driver))
+
+
+JS_MARK_TIMEBLOCKS_STALE = r"""
+const tb = document.querySelector('#timeBlocks');
+if (!tb) return null;
+tb.appendChild(document.createComment('bot-stale'));
+return tb.innerHTML;
+"""
+
+
+def mark_timeblocks_stale(driver) -> str:
+    """
+    Дописывает в #timeBlocks комментарий-маркер и возвращает новый innerHTML.
+    Любая перерисовка блока сайтом убирает маркер, поэтому смена даты видна даже при одинаковых слотах.
+    """
+    return driver.execute_script(JS_MARK_TIMEBLOCKS_STALE) or ""
+
+
+def wait_timeblocks_changed(driver, prev_html, timeout=10, token: Optional[CancelToken] = None):
+    wait_until(driver, lambda d: (get_timeblocks_html(d) or "") != (prev_html or ""), timeout, token)
 
 
-def wait_timeblocks_stable(driver, timeout=12, stable_for_sec=0.7):
-    end = time.time() + timeout
+def wait_timeblocks_stable(driver, timeout=12, stable_for_sec=TIMEBLOCKS_QUIET_SEC, token: Optional[CancelToken] = None):
+    end = time.time() + budget_timeout(token, timeout)
     last = None
     last_change = time.time()
     while time.time() < end:
+        check_cancel(token)
         cur = get_timeblocks_html(driver) or ""
         if last is None:
             last = cur
@@ -635,63 +1801,92 @@ def wait_timeblocks_stable(driver, timeout=12, stable_for_sec=0.7):
         else:
             if time.time() - last_change >= stable_for_sec:
                 return True
-        time.sleep(0.1)
+        token_sleep(token, 0.1)
+    check_cancel(token)
     raise TimeoutException("timeBlocks did not become stable")
 
 
-def wait_timeblocks_not_placeholder(driver, timeout=10):
-    WebDriverWait(driver, timeout, poll_frequency=WAIT_POLL).until(
-        lambda d: (not is_placeholder_timeblocks(d)) or is_server_error_timeblocks(d)
-    )
+def wait_timeblocks_not_placeholder(driver, timeout=10, token: Optional[CancelToken] = None):
+    wait_until(driver, lambda d: (not is_placeholder_timeblocks(d)) or is_server_error_timeblocks(d), timeout, token)
 
 
 # ---------------- slot parsing ----------------
-def extract_times_now(driver):
-    times_raw = driver.execute_script(
-        r"""
-        const tb = document.querySelector('#timeBlocks');
-        if (!tb) return [];
-        const isHidden = (el) => {
-          const st = window.getComputedStyle(el);
-          return st.display === 'none' || st.visibility === 'hidden';
-        };
-        const isDisabled = (el) => {
-          if (!el) return true;
-          const cls = (el.getAttribute('class') || '').toLowerCase();
-          const aria = (el.getAttribute('aria-disabled') || '').toLowerCase();
-          const disabled = el.getAttribute('disabled');
-          const pe = window.getComputedStyle(el).pointerEvents;
-          return !!disabled || aria === 'true' || cls.includes('disabled') || pe === 'none';
-        };
-        const nodes = Array.from(tb.querySelectorAll('label,button,a'));
-        const out = [];
-        const re = /\b\d{1,2}:\d{2}\b/;
-        for (const el of nodes) {
-          if (isHidden(el)) continue;
-          const tag = el.tagName.toLowerCase();
-          let ok = false;
-          if (tag === 'label') {
-            const inpInside = el.querySelector('input');
-            const htmlFor = (el.getAttribute('for') || '').trim();
-            const cls = (el.getAttribute('class') || '').toLowerCase();
-            ok = !!inpInside || !!htmlFor || cls.includes('btn-time');
-            if (inpInside && isDisabled(inpInside)) ok = false;
-          } else {
-            ok = true;
-          }
-          if (!ok) continue;
-          if (isDisabled(el)) continue;
-          const t = (el.textContent || el.innerText || '').trim();
-          if (re.test(t)) out.push(t);
-        }
-        return out;
-        """
-    )
+JS_EXTRACT_TIMES = r"""
+const html = arguments[0];
+let tb = null, sandbox = null;
+if (html !== null && html !== undefined) {
+  // у узлов из DOMParser getComputedStyle пустой — ответ монтируем в живой контейнер за краем экрана,
+  // с id/классами настоящего #timeBlocks, чтобы на него действовали стили страницы; убираем в том же вызове
+  const doc = new DOMParser().parseFromString(String(html), 'text/html');
+  doc.querySelectorAll('script,iframe,object,embed').forEach((el) => el.remove());
+  const live = document.querySelector('#timeBlocks');
+  sandbox = document.createElement(live ? live.tagName : 'div');
+  sandbox.id = 'timeBlocks';
+  if (live) sandbox.className = live.className;
+  sandbox.style.cssText = 'position:absolute;left:-100000px;top:0;';
+  const src = doc.querySelector('#timeBlocks') || doc.body;
+  for (const child of Array.from(src.childNodes)) sandbox.appendChild(document.importNode(child, true));
+  document.body.appendChild(sandbox);
+  tb = sandbox;
+} else {
+  tb = document.querySelector('#timeBlocks');
+}
+if (!tb) return [];
+try {
+const isHidden = (el) => {
+  const st = window.getComputedStyle(el);
+  return st.display === 'none' || st.visibility === 'hidden';
+};
+const isDisabled = (el) => {
+  if (!el) return true;
+  const cls = (el.getAttribute('class') || '').toLowerCase();
+  const aria = (el.getAttribute('aria-disabled') || '').toLowerCase();
+  const disabled = el.getAttribute('disabled');
+  const pe = window.getComputedStyle(el).pointerEvents;
+  return !!disabled || aria === 'true' || cls.includes('disabled') || pe === 'none';
+};
+const nodes = Array.from(tb.querySelectorAll('label,button,a'));
+const out = [];
+const re = /\b\d{1,2}:\d{2}\b/;
+for (const el of nodes) {
+  if (isHidden(el)) continue;
+  const tag = el.tagName.toLowerCase();
+  let ok = false;
+  if (tag === 'label') {
+    const inpInside = el.querySelector('input');
+    const htmlFor = (el.getAttribute('for') || '').trim();
+    const cls = (el.getAttribute('class') || '').toLowerCase();
+    ok = !!inpInside || !!htmlFor || cls.includes('btn-time');
+    if (inpInside && isDisabled(inpInside)) ok = false;
+  } else {
+    ok = true;
+  }
+  if (!ok) continue;
+  if (isDisabled(el)) continue;
+  const t = (el.textContent || el.innerText || '').trim();
+  if (re.test(t)) out.push(t);
+}
+return out;
+} finally {
+  if (sandbox) sandbox.remove();
+}
+"""
+
+
+def extract_times_now(driver, html: Optional[str] = None):
+    """
+    Свободные слоты из #timeBlocks. Если передан html (ответ сервера), на время разбора он монтируется
+    в скрытый контейнер страницы (стили и видимость — как у настоящего #timeBlocks); #timeBlocks не трогаем.
+    """
+    times_raw = driver.execute_script(JS_EXTRACT_TIMES, html)
 
-    if not times_raw:
+    if not times_raw and html is None:
         txt = get_timeblocks_text(driver) or ""
         times_raw = re.findall(r"\b\d{1,2}:\d{2}\b", txt)
+    return normalize_times(times_raw)
+
 
+def normalize_times(times_raw) -> list[str]:
     out, seen = [], set()
     for t in times_raw or []:
         m = re.search(r"\b\d{1,2}:\d{2}\b", t)
@@ -704,14 +1899,137 @@ def extract_times_now(driver):
     return out
 
 
-def parse_times_mode(driver, tries=26, sleep_sec=0.2, min_votes=2):
+# ---------------- slots from network (performance log) ----------------
+@dataclass(frozen=True)
+class NetworkSlots:
+    times: list[str]
+    server_error: bool = False
+
+
+def drain_performance_log(driver) -> list[dict]:
+    """Забирает накопленные события performance log (заодно не даёт буферу расти)."""
+    if not NETWORK_SLOTS:
+        return []
+    try:
+        entries = driver.get_log("performance") or []
+    except Exception:
+        return []
+    out = []
+    for e in entries:
+        try:
+            msg = json.loads(e.get("message") or "{}").get("message") or {}
+        except ValueError:
+            continue
+        msg["webview"] = e.get("webview") or ""
+        out.append(msg)
+    return out
+
+
+def _is_current_webview(current: str, webview: str) -> bool:
+    return not (current and webview) or current.endswith(webview) or webview.endswith(current)
+
+
+def is_slots_xhr(resource_type: str, status: int, url: str) -> bool:
+    if (resource_type or "").lower() not in ("xhr", "fetch"):
+        return False
+    if not (200 <= int(status or 0) < 300):
+        return False
+    url = (url or "").lower()
+    return "bumpix" in url and any(h in url for h in SLOTS_XHR_URL_HINTS)
+
+
+def _looks_like_slots_xhr(params: dict) -> bool:
+    resp = params.get("response") or {}
+    return is_slots_xhr(params.get("type"), resp.get("status"), resp.get("url"))
+
+
+def _find_html_in_json(data, with_times: bool = True) -> Optional[str]:
+    if isinstance(data, str):
+        if "<" not in data:
+            return None
+        return data if (not with_times or re.search(r"\b\d{1,2}:\d{2}\b", data)) else None
+    if isinstance(data, dict):
+        data = list(data.values())
+    if isinstance(data, list):
+        for v in data:
+            found = _find_html_in_json(v, with_times)
+            if found:
+                return found
+    return None
+
+
+def slots_html_from_payload(body: str) -> tuple[bool, Optional[str]]:
+    """(server_error, html со слотами) из тела XHR-ответа; html=None — это не ответ со слотами."""
+    low = (body or "").lower()
+    if "servererror" in low or "при запросе к серверу произошла ошибка" in low:
+        return True, None
+    try:
+        data = json.loads(body)
+    except ValueError:
+        # ответ — сама разметка #timeBlocks (в том числе «нет свободного времени» без единого слота)
+        return False, (body if "<" in body else None)
+    # поле со слотами узнаём по времени в разметке; нет такого — это пустой день, если разметка вообще есть
+    return False, _find_html_in_json(data) or _find_html_in_json(data, with_times=False)
+
+
+def parse_slots_payload(driver, body: str) -> Optional[NetworkSlots]:
+    server_error, html = slots_html_from_payload(body)
+    if server_error:
+        return NetworkSlots(times=[], server_error=True)
+    if not html:
+        return None
+    return NetworkSlots(times=extract_times_now(driver, html=html))
+
+
+def wait_slots_response(driver, timeout=NETWORK_SLOTS_TIMEOUT, token: Optional[CancelToken] = None) -> Optional[NetworkSlots]:
+    """
+    Ждёт XHR/fetch-ответ со слотами (событие из performance log) и разбирает его тело.
+    None — подходящего ответа не было, пусть работает DOM-путь.
+    """
+    try:
+        current = driver.current_window_handle or ""
+    except WebDriverException:
+        current = ""
+    pending: dict[str, str] = {}
+    end = time.time() + budget_timeout(token, timeout)
+    while time.time() < end:
+        check_cancel(token)
+        for msg in drain_performance_log(driver):
+            webview = msg.get("webview") or ""
+            if not _is_current_webview(current, webview):
+                continue
+            method = msg.get("method")
+            params = msg.get("params") or {}
+            rid = params.get("requestId")
+            if method == "Network.responseReceived" and _looks_like_slots_xhr(params):
+                pending[rid] = (params.get("response") or {}).get("url") or ""
+            elif method == "Network.loadingFailed":
+                pending.pop(rid, None)
+            elif method == "Network.loadingFinished" and rid in pending:
+                url = pending.pop(rid)
+                try:
+                    res = driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": rid}) or {}
+                except WebDriverException:
+                    continue
+                if res.get("base64Encoded"):
+                    continue
+                parsed = parse_slots_payload(driver, res.get("body") or "")
+                if parsed is not None:
+                    logger.info("slots from network: %s (%d)", url, len(parsed.times))
+                    return parsed
+        token_sleep(token, 0.05)
+    return None
+
+
+def parse_times_mode(driver, tries=26, sleep_sec=0.2, min_votes=2, token: Optional[CancelToken] = None):
     samples = []
     for _ in range(tries):
+        check_cancel(token)
         if not is_server_error_timeblocks(driver):
             cur = extract_times_now(driver)
             if cur:
                 samples.append(tuple(cur))
-        time.sleep(sleep_sec)
+        token_sleep(token, sleep_sec)
     if not samples:
         return []
     counts = Counter(samples)
@@ -728,33 +2046,42 @@ class ServiceItem:
     title: str
 
 
-def bumpix_get_services_with_driver(driver, url: str):
-    open_page(driver, url)
-    WebDriverWait(driver, 18, poll_frequency=WAIT_POLL).until(
-        lambda d: (d.execute_script("return document.querySelectorAll(\"input[data-service-id]\").length || 0;") > 0)
-    )
+JS_SERVICES_ROWS = r"""
+const inputs = Array.from(document.querySelectorAll("input[data-service-id]"));
+const out = [];
+for (const input of inputs) {
+  const item = input.closest("div.masterServiceItem") || input.closest(".masterServiceItem");
+  const id = (input.getAttribute("data-service-id") || "").trim();
+  if (!item || !id) continue;
+  const name = (item.querySelector(".msnBody")?.textContent || "").trim();
+  const duration = (item.querySelector(".sDuration")?.textContent || "").trim();
+  const cost = (item.querySelector(".sCost")?.textContent || "").trim();
+  const raw = (item.innerText || "").trim();
+  out.push({id, name, duration, cost, raw});
+}
+return out;
+"""
 
-    rows = driver.execute_script(
-        r"""
-        const inputs = Array.from(document.querySelectorAll("input[data-service-id]"));
-        const out = [];
-        for (const input of inputs) {
-          const item = input.closest("div.masterServiceItem") || input.closest(".masterServiceItem");
-          const id = (input.getAttribute("data-service-id") || "").trim();
-          if (!item || !id) continue;
-          const name = (item.querySelector(".msnBody")?.textContent || "").trim();
-          const duration = (item.querySelector(".sDuration")?.textContent || "").trim();
-          const cost = (item.querySelector(".sCost")?.textContent || "").trim();
-          const raw = (item.innerText || "").trim();
-          out.push({id, name, duration, cost, raw});
-        }
-        return out;
-        """
+
+JS_SERVICES_PRESENT = 'return document.querySelectorAll("input[data-service-id]").length || 0;'
+
+
+def bumpix_get_services_with_driver(driver, url: str, token: Optional[CancelToken] = None):
+    open_page(driver, url, token)
+    wait_until(
+        driver,
+        lambda d: (d.execute_script(JS_SERVICES_PRESENT) > 0),
+        18,
+        token,
     )
 
+    return services_from_rows(driver.execute_script(JS_SERVICES_ROWS))
+
+
+def services_from_rows(rows) -> list[ServiceItem]:
     services = []
     seen = set()
-    for r in rows:
+    for r in rows or []:
         sid = clean_spaces(r.get("id"))
         if not sid or sid in seen:
             continue
@@ -787,15 +2114,14 @@ def clear_all_services(driver):
         }
         """
     )
-    time.sleep(0.12)
+    pause(0.12)
 
 
-def click_service_by_id(driver, sid: str):
+def click_service_by_id(driver, sid: str, token: Optional[CancelToken] = None):
     for _ in range(8):
+        check_cancel(token)
         try:
-            inp = WebDriverWait(driver, 10, poll_frequency=WAIT_POLL).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, f"input[data-service-id='{sid}']"))
-            )
+            inp = wait_until(driver, EC.presence_of_element_located((By.CSS_SELECTOR, f"input[data-service-id='{sid}']")), 10, token)
             label = None
             try:
                 label = driver.execute_script("return arguments[0].closest('label');", inp)
@@ -820,43 +2146,117 @@ def click_service_by_id(driver, sid: str):
             )
             return
         except StaleElementReferenceException:
-            time.sleep(0.12)
+            token_sleep(token, 0.12)
             continue
     raise RuntimeError(f"Не удалось выбрать услугу {sid} (stale).")
 
 
-def wait_services_selected(driver, sids, timeout=15):
+JS_SERVICES_SELECTED = r"""
+const sids = arguments[0];
+function selected(sid) {
+  const inp = document.querySelector(`input[data-service-id="${sid}"]`);
+  if (!inp) return false;
+  const label = inp.closest('label');
+  const checked = !!inp.checked;
+  const active = label ? label.classList.contains('active') : false;
+  return checked || active;
+}
+for (const sid of sids) {
+  if (!selected(sid)) return false;
+}
+return true;
+"""
+
+
+def wait_services_selected(driver, sids, timeout=15, token: Optional[CancelToken] = None):
     sids = list(map(str, sids))
 
     def cond(d):
-        return d.execute_script(
-            r"""
-            const sids = arguments[0];
-            function selected(sid) {
-              const inp = document.querySelector(`input[data-service-id="${sid}"]`);
-              if (!inp) return false;
-              const label = inp.closest('label');
-              const checked = !!inp.checked;
-              const active = label ? label.classList.contains('active') : false;
-              return checked || active;
-            }
-            for (const sid of sids) {
-              if (!selected(sid)) return false;
-            }
-            return true;
-            """,
-            sids,
-        )
+        return d.execute_script(JS_SERVICES_SELECTED, sids)
+
+    wait_until(driver, cond, timeout, token)
+
+
+JS_SELECT_SERVICES_BATCH = r"""
+const want = new Set((arguments[0] || []).map(x => String(x).trim()));
+const inputs = Array.from(document.querySelectorAll("input[data-service-id]"));
+const fire = (inp) => {
+  inp.dispatchEvent(new Event('input', {bubbles:true}));
+  inp.dispatchEvent(new Event('change', {bubbles:true}));
+};
+const isOn = (inp) => {
+  const label = inp.closest('label');
+  return !!inp.checked || (label ? label.classList.contains('active') : false);
+};
+const found = new Set();
+for (const inp of inputs) {
+  const sid = (inp.getAttribute("data-service-id") || "").trim();
+  const label = inp.closest("label");
+  const should = want.has(sid);
+  if (should) found.add(sid);
+  if (isOn(inp) === should) continue;
+  if (should) {
+    try { (label || inp).click(); } catch (e) {}
+    inp.checked = true;
+    fire(inp);
+    if (label) label.classList.add("active");
+  } else {
+    inp.checked = false;
+    fire(inp);
+    if (label) label.classList.remove("active");
+  }
+}
 
-    WebDriverWait(driver, timeout, poll_frequency=WAIT_POLL).until(cond)
+const selected = inputs.filter(isOn).map(inp => (inp.getAttribute("data-service-id") || "").trim());
+
+let chooseTimeEnabled = false;
+const cands = Array.from(document.querySelectorAll("button,a,input[type='button'],input[type='submit'],[role='button']"));
+for (const el of cands) {
+  const tag = el.tagName.toLowerCase();
+  const tx = ((tag === 'input' ? el.value : el.textContent) || '').trim();
+  if (!tx.includes('Выбрать время')) continue;
+  const cls = (el.getAttribute('class') || '').toLowerCase();
+  const aria = (el.getAttribute('aria-disabled') || '').toLowerCase();
+  const disabled = !!el.getAttribute('disabled') || aria === 'true' || cls.includes('disabled')
+    || window.getComputedStyle(el).pointerEvents === 'none';
+  if (!disabled) { chooseTimeEnabled = true; break; }
+}
+
+return {
+  selected: selected,
+  missing: Array.from(want).filter(s => !found.has(s)),
+  choose_time_enabled: chooseTimeEnabled,
+};
+"""
+
+
+def js_select_services_batch(driver, sids) -> Optional[dict]:
+    """
+    Одним скриптом выставляет ровно нужный набор услуг (как clear_all_services + click_service_by_id)
+    и возвращает {selected, missing, choose_time_enabled}.
+    """
+    return driver.execute_script(JS_SELECT_SERVICES_BATCH, list(map(str, sids)))
 
 
-def select_services(driver, sids):
+def select_services(driver, sids, token: Optional[CancelToken] = None) -> Optional[dict]:
+    sids = [str(x) for x in sids]
+    check_cancel(token)
+    try:
+        state = js_select_services_batch(driver, sids)
+    except WebDriverException:
+        state = None
+    if state and not state.get("missing") and set(state.get("selected") or []) == set(sids):
+        return state
+
+    # запасной путь: по одному элементу, как раньше
+    logger.info("batch service selection mismatch (%s), falling back to per-element clicks", state)
     clear_all_services(driver)
     for sid in sids:
-        click_service_by_id(driver, str(sid))
-        time.sleep(0.08)
-    wait_services_selected(driver, sids, timeout=15)
+        check_cancel(token)
+        click_service_by_id(driver, sid, token)
+        token_sleep(token, 0.08)
+    wait_services_selected(driver, sids, timeout=15, token=token)
+    return None
 
 
 # ---------------- choose time ----------------
@@ -887,7 +2287,7 @@ def find_choose_time_button(driver):
     return None
 
 
-def click_choose_time(driver, timeout=22):
+def click_choose_time(driver, timeout=22, token: Optional[CancelToken] = None):
     def cond(d):
         el = find_choose_time_button(d)
         if not el:
@@ -896,112 +2296,122 @@ def click_choose_time(driver, timeout=22):
             return False
         return el
 
-    btn = WebDriverWait(driver, timeout, poll_frequency=WAIT_POLL).until(cond)
+    btn = wait_until(driver, cond, timeout, token)
     robust_click(driver, btn)
 
 
 # ---------------- calendar/date selection (UTC safe) ----------------
-def wait_calendar_visible(driver, timeout=14):
-    WebDriverWait(driver, timeout, poll_frequency=WAIT_POLL).until(
-        EC.visibility_of_element_located((By.CSS_SELECTOR, SEL_PICKER_CALENDAR))
-    )
+def wait_calendar_visible(driver, timeout=14, token: Optional[CancelToken] = None):
+    wait_until(driver, EC.visibility_of_element_located((By.CSS_SELECTOR, SEL_PICKER_CALENDAR)), timeout, token)
 
 
-def wait_calendar_days_present_js(driver, timeout=14):
-    WebDriverWait(driver, timeout, poll_frequency=WAIT_POLL).until(
-        lambda d: (d.execute_script("return document.querySelectorAll('td.day').length || 0;") > 0)
-    )
+def wait_calendar_days_present_js(driver, timeout=14, token: Optional[CancelToken] = None):
+    wait_until(driver, lambda d: (d.execute_script("return document.querySelectorAll('td.day').length || 0;") > 0), timeout, token)
+
+
+JS_CALENDAR_NAV_BUTTON = r"""
+const dir = arguments[0];
+const root = document.querySelector('.picker_calendar') || document;
+const th = root.querySelector(`.datepicker-days th.${dir}`) || root.querySelector(`th.${dir}`);
+return th || null;
+"""
 
 
 def click_calendar_nav(driver, direction: str):
-    btn = driver.execute_script(
-        r"""
-        const dir = arguments[0];
-        const root = document.querySelector('.picker_calendar') || document;
-        const th = root.querySelector(`.datepicker-days th.${dir}`) || root.querySelector(`th.${dir}`);
-        return th || null;
-        """,
-        direction,
-    )
+    btn = driver.execute_script(JS_CALENDAR_NAV_BUTTON, direction)
     if btn:
         robust_click(driver, btn)
-    time.sleep(0.12)
+    pause(CALENDAR_NAV_SETTLE_SEC)
+
+
+JS_CALENDAR_VIEW = r"""
+const root = document.querySelector('.picker_calendar') || document;
+const cells = Array.from(root.querySelectorAll('td.day'));
+for (const c of cells) {
+  const cls = c.getAttribute('class') || '';
+  if (cls.includes('old') || cls.includes('new') || cls.includes('disabled')) continue;
+  const ms = c.getAttribute('data-date');
+  if (!ms) continue;
+  const dt = new Date(Number(ms));
+  return {y: dt.getUTCFullYear(), m: dt.getUTCMonth()};
+}
+return null;
+"""
 
 
 def get_calendar_view_year_month_utc(driver):
-    res = driver.execute_script(
-        r"""
-        const root = document.querySelector('.picker_calendar') || document;
-        const cells = Array.from(root.querySelectorAll('td.day'));
-        for (const c of cells) {
-          const cls = c.getAttribute('class') || '';
-          if (cls.includes('old') || cls.includes('new') || cls.includes('disabled')) continue;
-          const ms = c.getAttribute('data-date');
-          if (!ms) continue;
-          const dt = new Date(Number(ms));
-          return {y: dt.getUTCFullYear(), m: dt.getUTCMonth()};
-        }
-        return null;
-        """
-    )
+    res = driver.execute_script(JS_CALENDAR_VIEW)
     if not res:
         return None
     return int(res.get("y")), int(res.get("m"))
 
 
+JS_FIND_DAY_CELL = r"""
+const y = arguments[0], m = arguments[1], d = arguments[2];
+const root = document.querySelector('.picker_calendar') || document;
+const tds = Array.from(root.querySelectorAll('td.day'));
+for (const c of tds) {
+  const cls = c.getAttribute('class') || '';
+  if (cls.includes('old') || cls.includes('new') || cls.includes('disabled')) continue;
+  const ms = c.getAttribute('data-date');
+  if (!ms) continue;
+  const dt = new Date(Number(ms));
+  if (dt.getUTCFullYear() === y && dt.getUTCMonth() === m && dt.getUTCDate() === d) return c;
+}
+return null;
+"""
+
+
 def find_day_cell_for_date_utc(driver, y: int, m0: int, d: int):
     return driver.execute_script(
-        r"""
-        const y = arguments[0], m = arguments[1], d = arguments[2];
-        const root = document.querySelector('.picker_calendar') || document;
-        const tds = Array.from(root.querySelectorAll('td.day'));
-        for (const c of tds) {
-          const cls = c.getAttribute('class') || '';
-          if (cls.includes('old') || cls.includes('new') || cls.includes('disabled')) continue;
-          const ms = c.getAttribute('data-date');
-          if (!ms) continue;
-          const dt = new Date(Number(ms));
-          if (dt.getUTCFullYear() === y && dt.getUTCMonth() === m && dt.getUTCDate() === d) return c;
-        }
-        return null;
-        """,
+        JS_FIND_DAY_CELL,
         int(y),
         int(m0),
         int(d),
     )
 
 
-def click_specific_date(driver, target_date: date):
+def settle_timeblocks(driver, prev_html: str, token: Optional[CancelToken] = None):
+    try:
+        wait_timeblocks_changed(driver, prev_html, timeout=8, token=token)
+    except TimeoutException:
+        pass
+    try:
+        wait_timeblocks_stable(driver, timeout=12, stable_for_sec=TIMEBLOCKS_QUIET_SEC, token=token)
+    except TimeoutException:
+        pass
+    try:
+        wait_timeblocks_not_placeholder(driver, timeout=8, token=token)
+    except TimeoutException:
+        pass
+
+
+def click_specific_date(driver, target_date: date, token: Optional[CancelToken] = None, settle: bool = True) -> str:
+    """
+    Кликает дату в календаре сайта. settle=False — не ждём перерисовки #timeBlocks
+    (слоты будут прочитаны из сетевого ответа); возвращает innerHTML блока до клика.
+    """
     try:
         driver.switch_to.default_content()
     except Exception:
         pass
 
-    wait_calendar_days_present_js(driver, timeout=14)
+    wait_calendar_days_present_js(driver, timeout=14, token=token)
     y, m0, d = target_date.year, target_date.month - 1, target_date.day
 
-    prev = get_timeblocks_html(driver) or ""
+    prev = mark_timeblocks_stale(driver)
     for _ in range(14):
+        check_cancel(token)
         cell = find_day_cell_for_date_utc(driver, y, m0, d)
         if cell:
             for _ in range(10):
                 try:
                     robust_click(driver, cell)
-                    try:
-                        wait_timeblocks_changed(driver, prev, timeout=8)
-                    except TimeoutException:
-                        pass
-                    try:
-                        wait_timeblocks_stable(driver, timeout=12, stable_for_sec=0.7)
-                    except TimeoutException:
-                        pass
-                    try:
-                        wait_timeblocks_not_placeholder(driver, timeout=8)
-                    except TimeoutException:
-                        pass
-                    return
+                    if settle:
+                        settle_timeblocks(driver, prev, token)
+                    return prev
                 except StaleElementReferenceException:
-                    time.sleep(0.12)
+                    token_sleep(token, 0.12)
                     cell = find_day_cell_for_date_utc(driver, y, m0, d)
                     if not cell:
                         break
@@ -1010,7 +2420,7 @@ def click_specific_date(driver, target_date: date):
         view = get_calendar_view_year_month_utc(driver)
         if not view:
             click_calendar_nav(driver, "next")
-            wait_calendar_days_present_js(driver, timeout=14)
+            wait_calendar_days_present_js(driver, timeout=14, token=token)
             continue
 
         vy, vm = view
@@ -1018,132 +2428,398 @@ def click_specific_date(driver, target_date: date):
             click_calendar_nav(driver, "next")
         else:
             click_calendar_nav(driver, "prev")
-        wait_calendar_days_present_js(driver, timeout=14)
+        wait_calendar_days_present_js(driver, timeout=14, token=token)
 
     raise RuntimeError("Не удалось выбрать дату в календаре.")
 
 
-# ---------------- main scenario (find times) ----------------
-@dataclass(frozen=True)
-class TimesResult:
-    status: str  # "OK" | "EMPTY" | "ERROR"
-    times: list[str]
-    error: Optional[str] = None
+# ---------------- circuit breaker (Bumpix server errors) ----------------
+def backoff_delay(attempt: int, base: float, cap: float, jitter: float = BREAKER_JITTER) -> float:
+    delay = min(cap, base * (2 ** attempt))
+    return delay * (1 + random.uniform(-jitter, jitter))
 
 
-def get_times_for_selection(driver, url: str, sids, target_date: date) -> TimesResult:
-    open_page(driver, url)
-    select_services(driver, sids)
-    click_choose_time(driver, timeout=22)
-    wait_calendar_visible(driver, timeout=14)
+class RoomBreaker:
+    """
+    Общий для всех воркеров breaker одной комнаты.
+    closed -> (ошибки сервера подряд) -> open -> (по истечении паузы) -> half_open -> один пробный запрос.
+    """
 
-    for attempt in range(5):
-        click_specific_date(driver, target_date)
+    def __init__(self, url: str):
+        self.lock = RLock()
+        self.url = url
+        self.state = "closed"  # "closed" | "open" | "half_open"
+        self.failures = 0
+        self.trips_in_row = 0
+        self.open_until = 0.0
+        self.probe_in_flight = False
+        self.trips_total = 0
+        self.rejected_total = 0
+        self.server_errors_total = 0
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == "open":
+                if time.time() < self.open_until:
+                    self.rejected_total += 1
+                    return False
+                self.state = "half_open"
+                self.probe_in_flight = False
+                logger.info("breaker %s: half_open", self.url)
+            if self.state == "half_open":
+                if self.probe_in_flight:
+                    self.rejected_total += 1
+                    return False
+                self.probe_in_flight = True
+            return True
 
-        if is_server_error_timeblocks(driver):
-            time.sleep(0.8 + attempt * 0.4)
-            continue
+    def release_probe(self):
+        with self.lock:
+            self.probe_in_flight = False
 
-        times = parse_times_mode(driver, tries=26, sleep_sec=0.2, min_votes=2)
-        if times:
-            time.sleep(0.25)
-            confirm = parse_times_mode(driver, tries=10, sleep_sec=0.18, min_votes=1)
-            return TimesResult(status="OK", times=confirm if confirm else times)
+    def record_success(self):
+        with self.lock:
+            if self.state != "closed":
+                logger.info("breaker %s: closed", self.url)
+            self.state = "closed"
+            self.failures = 0
+            self.trips_in_row = 0
+            self.probe_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Возвращает True, если breaker открыт (дальше повторять бессмысленно)."""
+        with self.lock:
+            self.server_errors_total += 1
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= BREAKER_FAIL_THRESHOLD:
+                pause = backoff_delay(self.trips_in_row, BREAKER_BASE_SEC, BREAKER_MAX_SEC)
+                self.state = "open"
+                self.open_until = time.time() + pause
+                self.failures = 0
+                self.trips_in_row += 1
+                self.trips_total += 1
+                self.probe_in_flight = False
+                logger.warning("breaker %s: open for %.1fs (trip #%d in row)", self.url, pause, self.trips_in_row)
+            return self.state == "open"
+
+    def retry_in(self) -> float:
+        with self.lock:
+            return max(0.0, self.open_until - time.time()) if self.state == "open" else 0.0
 
-        if not is_placeholder_timeblocks(driver):
-            return TimesResult(status="EMPTY", times=[])
+    def metrics(self) -> dict:
+        with self.lock:
+            return {
+                "url": self.url,
+                "state": self.state,
+                "state_code": {"closed": 0, "half_open": 1, "open": 2}[self.state],
+                "retry_in_sec": round(self.retry_in(), 1),
+                "trips_total": self.trips_total,
+                "rejected_total": self.rejected_total,
+                "server_errors_total": self.server_errors_total,
+            }
 
-        time.sleep(0.5)
-        driver.refresh()
-        WebDriverWait(driver, 25, poll_frequency=WAIT_POLL).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-        select_services(driver, sids)
-        click_choose_time(driver, timeout=22)
-        wait_calendar_visible(driver, timeout=14)
 
-    click_specific_date(driver, target_date)
-    if is_server_error_timeblocks(driver):
-        return TimesResult(status="ERROR", times=[], error="Ошибка сервера при получении слотов")
+class BreakerRegistry:
+    def __init__(self):
+        self.lock = RLock()
+        self.by_url: dict[str, RoomBreaker] = {}
 
-    times = parse_times_mode(driver, tries=28, sleep_sec=0.2, min_votes=1)
-    if times:
-        return TimesResult(status="OK", times=times)
+    def get(self, url: str) -> RoomBreaker:
+        with self.lock:
+            br = self.by_url.get(url)
+            if br is None:
+                br = RoomBreaker(url)
+                self.by_url[url] = br
+            return br
+
+    def metrics(self) -> list[dict]:
+        with self.lock:
+            breakers = list(self.by_url.values())
+        return [b.metrics() for b in breakers]
+
+
+BREAKERS = BreakerRegistry()
+
+
+def breaker_fallback_times(breaker: RoomBreaker, url: str, sids, target_date: date) -> Optional["TimesResult"]:
+    """Брейкер комнаты открыт — отдаём последние известные слоты (или ошибку); None — можно идти на сайт."""
+    if breaker.allow():
+        return None
+    cached = SLOTS_CACHE.get(url, sids, target_date, max_age=SLOTS_STALE_TTL)
+    if cached:
+        times, age = cached
+        return TimesResult(status="OK" if times else "EMPTY", times=times, cached_age_sec=age)
+    return TimesResult(status="ERROR", times=[], error=breaker_open_message(breaker))
+
+
+def breaker_open_message(breaker: RoomBreaker) -> str:
+    return f"Bumpix сейчас отвечает ошибкой сервера. Повторите попытку примерно через {max(1, round(breaker.retry_in()))} с."
+
+
+# ---------------- page state (skip redundant navigation) ----------------
+@dataclass
+class PageState:
+    """Что сейчас открыто в драйвере: комната, выбранные услуги, календарь, месяц и дата."""
+
+    url: Optional[str] = None
+    sids: tuple = ()
+    calendar_open: bool = False
+    month: Optional[tuple] = None  # (year, month0) — показанный месяц календаря
+    shown_date: Optional[date] = None
+
+    def reset(self):
+        self.url = None
+        self.sids = ()
+        self.calendar_open = False
+        self.month = None
+        self.shown_date = None
+
+
+def _norm_page_url(u: str) -> str:
+    u = (u or "").split("#", 1)[0].split("?", 1)[0]
+    return u.rstrip("/").lower()
+
+
+JS_PAGE_STATE = r"""
+const inputs = Array.from(document.querySelectorAll("input[data-service-id]"));
+const selected = inputs.filter(inp => {
+  const label = inp.closest('label');
+  return !!inp.checked || (label ? label.classList.contains('active') : false);
+}).map(inp => (inp.getAttribute("data-service-id") || "").trim());
+const cal = document.querySelector(arguments[0]);
+let calVisible = false;
+if (cal) {
+  const st = window.getComputedStyle(cal);
+  const r = cal.getBoundingClientRect();
+  calVisible = st.display !== 'none' && st.visibility !== 'hidden' && r.width > 0 && r.height > 0;
+}
+return {
+  href: location.href,
+  selected: selected,
+  calendar_visible: calVisible && document.querySelectorAll('td.day').length > 0,
+};
+"""
+
+
+def js_page_state(driver) -> Optional[dict]:
+    return driver.execute_script(JS_PAGE_STATE, SEL_PICKER_CALENDAR)
+
+
+def ensure_calendar_ready(driver, url: str, sids, token: Optional[CancelToken] = None, state: Optional[PageState] = None) -> int:
+    """
+    Доводит страницу до открытого календаря, продолжая с самого глубокого валидного шага:
+    0 — открыть страницу, 1 — выбрать услуги, 2 — открыть календарь, 3 — всё уже готово.
+    Возвращает шаг, с которого продолжили.
+    """
+    if state is None:
+        state = PageState()
+    sids_key = tuple(sorted(map(str, sids)))
+
+    step = 0
+    if state.url == url:
+        try:
+            live = js_page_state(driver) or {}
+        except WebDriverException:
+            live = {}
+        if live and _norm_page_url(live.get("href")) == _norm_page_url(url):
+            step = 1
+            if state.sids == sids_key and set(live.get("selected") or []) == set(sids_key):
+                step = 2
+                if state.calendar_open and live.get("calendar_visible"):
+                    step = 3
+
+    if step < 1:
+        state.reset()
+        enter_stage(token, "открытие страницы")
+        open_page(driver, url, token)
+        state.url = url
+    if step < 2:
+        state.sids = ()
+        state.calendar_open = False
+        state.shown_date = None
+        enter_stage(token, "выбор услуг")
+        select_services(driver, sids, token)
+        state.sids = sids_key
+    if step < 3:
+        enter_stage(token, "кнопка «Выбрать время»")
+        click_choose_time(driver, timeout=22, token=token)
+        enter_stage(token, "календарь")
+        wait_calendar_visible(driver, timeout=14, token=token)
+        state.calendar_open = True
+    return step
+
+
+def select_date_tracked(
+    driver, target_date: date, token: Optional[CancelToken] = None, state: Optional[PageState] = None, settle: bool = True
+) -> str:
+    enter_stage(token, "выбор даты")
+    if state is not None:
+        state.shown_date = None
+    prev = click_specific_date(driver, target_date, token, settle=settle)
+    if state is not None:
+        state.shown_date = target_date
+        state.month = (target_date.year, target_date.month - 1)
+    return prev
+
+
+# ---------------- main scenario (find times) ----------------
+@dataclass(frozen=True)
+class TimesResult:
+    status: str  # "OK" | "EMPTY" | "ERROR"
+    times: list[str]
+    error: Optional[str] = None
+    cached_age_sec: Optional[float] = None  # слоты взяты из кэша (Bumpix недоступен)
+
+
+def get_times_for_selection(
+    driver, url: str, sids, target_date: date, token: Optional[CancelToken] = None, state: Optional[PageState] = None
+) -> TimesResult:
+    try:
+        return _get_times_for_selection(driver, url, sids, target_date, token, state if state is not None else PageState())
+    except DeadlineExceeded as e:
+        return TimesResult(status="ERROR", times=[], error=e.describe())
+
+
+def _get_times_for_selection(driver, url: str, sids, target_date: date, token: Optional[CancelToken], state: PageState) -> TimesResult:
+    breaker = BREAKERS.get(url)
+    if state.shown_date == target_date:
+        # "Обновить" той же даты: повторный клик по дате сайт может не перезапросить — открываем заново
+        state.reset()
+    ensure_calendar_ready(driver, url, sids, token, state)
+
+    for attempt in range(5):
+        if NETWORK_SLOTS:
+            drain_performance_log(driver)
+            prev = select_date_tracked(driver, target_date, token, state, settle=False)
+            enter_stage(token, "ответ сервера со слотами")
+            net = wait_slots_response(driver, token=token)
+            if net is not None and net.server_error:
+                if breaker.record_failure():
+                    return TimesResult(status="ERROR", times=[], error=breaker_open_message(breaker))
+                enter_stage(token, "повтор после ошибки сервера")
+                token_sleep(token, backoff_delay(attempt, 0.8, 5.0))
+                continue
+            if net is not None:
+                breaker.record_success()
+                return TimesResult(status="OK" if net.times else "EMPTY", times=net.times)
+            # ответа со слотами не было — решает DOM, как раньше
+            settle_timeblocks(driver, prev, token)
+        else:
+            select_date_tracked(driver, target_date, token, state)
+
+        if is_server_error_timeblocks(driver):
+            if breaker.record_failure():
+                return TimesResult(status="ERROR", times=[], error=breaker_open_message(breaker))
+            enter_stage(token, "повтор после ошибки сервера")
+            token_sleep(token, backoff_delay(attempt, 0.8, 5.0))
+            continue
+
+        enter_stage(token, "чтение слотов")
+        times = parse_times_mode(driver, tries=26, sleep_sec=0.2, min_votes=2, token=token)
+        if times:
+            breaker.record_success()
+            token_sleep(token, 0.25)
+            confirm = parse_times_mode(driver, tries=10, sleep_sec=0.18, min_votes=1, token=token)
+            return TimesResult(status="OK", times=confirm if confirm else times)
+
+        if not is_placeholder_timeblocks(driver):
+            breaker.record_success()
+            return TimesResult(status="EMPTY", times=[])
+
+        enter_stage(token, "перезагрузка страницы")
+        token_sleep(token, 0.5)
+        state.reset()
+        ensure_calendar_ready(driver, url, sids, token, state)
+
+    select_date_tracked(driver, target_date, token, state)
+    if is_server_error_timeblocks(driver):
+        if breaker.record_failure():
+            return TimesResult(status="ERROR", times=[], error=breaker_open_message(breaker))
+        return TimesResult(status="ERROR", times=[], error="Ошибка сервера при получении слотов")
+
+    enter_stage(token, "чтение слотов")
+    times = parse_times_mode(driver, tries=28, sleep_sec=0.2, min_votes=1, token=token)
+    breaker.record_success()
+    if times:
+        return TimesResult(status="OK", times=times)
     return TimesResult(status="EMPTY", times=[])
 
 
 # ---------------- booking helpers ----------------
+JS_CLICK_TIME_SLOT = r"""
+const target = String(arguments[0] || '').trim();
+const tb = document.querySelector('#timeBlocks');
+if (!tb || !target) return false;
+
+const isHidden = (el) => {
+  const st = window.getComputedStyle(el);
+  return st.display === 'none' || st.visibility === 'hidden';
+};
+const isDisabled = (el) => {
+  if (!el) return true;
+  const cls = (el.getAttribute('class') || '').toLowerCase();
+  const aria = (el.getAttribute('aria-disabled') || '').toLowerCase();
+  const disabled = el.getAttribute('disabled');
+  const pe = window.getComputedStyle(el).pointerEvents;
+  return !!disabled || aria === 'true' || cls.includes('disabled') || pe === 'none';
+};
+
+const nodes = Array.from(tb.querySelectorAll('label,button,a'));
+for (const el of nodes) {
+  if (isHidden(el)) continue;
+  const txt = (el.textContent || el.innerText || '').trim();
+  if (!txt) continue;
+  if (!txt.includes(target)) continue;
+  if (isDisabled(el)) continue;
+  el.scrollIntoView({block:'center'});
+  el.click();
+  return true;
+}
+return false;
+"""
+
+
 def click_time_slot(driver, time_str: str) -> bool:
     time_str = (time_str or "").strip()
     if not time_str:
         return False
 
-    ok = driver.execute_script(
-        r"""
-        const target = String(arguments[0] || '').trim();
-        const tb = document.querySelector('#timeBlocks');
-        if (!tb || !target) return false;
-
-        const isHidden = (el) => {
-          const st = window.getComputedStyle(el);
-          return st.display === 'none' || st.visibility === 'hidden';
-        };
-        const isDisabled = (el) => {
-          if (!el) return true;
-          const cls = (el.getAttribute('class') || '').toLowerCase();
-          const aria = (el.getAttribute('aria-disabled') || '').toLowerCase();
-          const disabled = el.getAttribute('disabled');
-          const pe = window.getComputedStyle(el).pointerEvents;
-          return !!disabled || aria === 'true' || cls.includes('disabled') || pe === 'none';
-        };
-
-        const nodes = Array.from(tb.querySelectorAll('label,button,a'));
-        for (const el of nodes) {
-          if (isHidden(el)) continue;
-          const txt = (el.textContent || el.innerText || '').trim();
-          if (!txt) continue;
-          if (!txt.includes(target)) continue;
-          if (isDisabled(el)) continue;
-          el.scrollIntoView({block:'center'});
-          el.click();
-          return true;
-        }
-        return false;
-        """,
-        time_str,
-    )
+    ok = driver.execute_script(JS_CLICK_TIME_SLOT, time_str)
     return bool(ok)
 
 
+JS_OPEN_COMMENT_UI = r"""
+const rootSel = arguments[0];
+const root = document.querySelector(rootSel) || document;
+const candidates = [
+  '.fa-comment','.fa-comments','.glyphicon-comment',
+  '[class*="comment"]',
+  '[title*="коммент"]','[aria-label*="коммент"]',
+  '[title*="comment"]','[aria-label*="comment"]',
+];
+for (const sel of candidates) {
+  const el = root.querySelector(sel);
+  if (!el) continue;
+  const btn = el.closest('button,a,span,div') || el;
+  const st = window.getComputedStyle(btn);
+  if (st.display === 'none' || st.visibility === 'hidden') continue;
+  const r = btn.getBoundingClientRect();
+  if (r.width < 8 || r.height < 8) continue;
+  try { btn.click(); } catch(e) {}
+  break;
+}
+"""
+
+
 def maybe_open_comment_ui(driver):
-    driver.execute_script(
-        r"""
-        const rootSel = arguments[0];
-        const root = document.querySelector(rootSel) || document;
-        const candidates = [
-          '.fa-comment','.fa-comments','.glyphicon-comment',
-          '[class*="comment"]',
-          '[title*="коммент"]','[aria-label*="коммент"]',
-          '[title*="comment"]','[aria-label*="comment"]',
-        ];
-        for (const sel of candidates) {
-          const el = root.querySelector(sel);
-          if (!el) continue;
-          const btn = el.closest('button,a,span,div') || el;
-          const st = window.getComputedStyle(btn);
-          if (st.display === 'none' || st.visibility === 'hidden') continue;
-          const r = btn.getBoundingClientRect();
-          if (r.width < 8 || r.height < 8) continue;
-          try { btn.click(); } catch(e) {}
-          break;
-        }
-        """,
-        COMMENT_ROOT_SELECTOR,
-    )
+    driver.execute_script(JS_OPEN_COMMENT_UI, COMMENT_ROOT_SELECTOR)
 
 
-def find_first_visible(driver, selectors: list[str], timeout=12):
-    end = time.time() + timeout
+def find_first_visible(driver, selectors: list[str], timeout=12, token: Optional[CancelToken] = None):
+    end = time.time() + budget_timeout(token, timeout)
     last_exc = None
     while time.time() < end:
+        check_cancel(token)
         for sel in selectors:
             try:
                 el = driver.find_element(By.CSS_SELECTOR, sel)
@@ -1160,13 +2836,14 @@ def find_first_visible(driver, selectors: list[str], timeout=12):
             except Exception as e:
                 last_exc = e
                 continue
-        time.sleep(0.2)
+        token_sleep(token, 0.2)
+    check_cancel(token)
     if last_exc:
         raise TimeoutException(str(last_exc))
     raise TimeoutException("Element not found")
 
 
-def fill_comment_strict(driver, comment: str, timeout=14) -> bool:
+def fill_comment_strict(driver, comment: str, timeout=14, token: Optional[CancelToken] = None) -> bool:
     comment = (comment or "").strip()
     if not comment:
         return False
@@ -1174,7 +2851,7 @@ def fill_comment_strict(driver, comment: str, timeout=14) -> bool:
     maybe_open_comment_ui(driver)
 
     try:
-        el = find_first_visible(driver, COMMENT_INPUT_SELECTORS, timeout=timeout)
+        el = find_first_visible(driver, COMMENT_INPUT_SELECTORS, timeout=timeout, token=token)
     except TimeoutException:
         return False
 
@@ -1221,8 +2898,9 @@ def fill_comment_strict(driver, comment: str, timeout=14) -> bool:
     except Exception:
         return False
 
-    end = time.time() + 8
+    end = time.time() + budget_timeout(token, 8)
     while time.time() < end:
+        check_cancel(token)
         try:
             if is_contenteditable:
                 cur = (el.text or "").strip()
@@ -1232,15 +2910,14 @@ def fill_comment_strict(driver, comment: str, timeout=14) -> bool:
             cur = ""
         if comment in cur or cur == comment:
             return True
-        time.sleep(0.2)
+        token_sleep(token, 0.2)
+    check_cancel(token)
     return False
 
 
-def click_appointment_button(driver) -> bool:
+def click_appointment_button(driver, token: Optional[CancelToken] = None) -> bool:
     try:
-        btn = WebDriverWait(driver, 12, poll_frequency=WAIT_POLL).until(
-            EC.element_to_be_clickable((By.CSS_SELECTOR, APPOINTMENT_BTN_SELECTOR))
-        )
+        btn = wait_until(driver, EC.element_to_be_clickable((By.CSS_SELECTOR, APPOINTMENT_BTN_SELECTOR)), 12, token)
     except TimeoutException:
         return False
     if is_disabled_like(driver, btn):
@@ -1249,28 +2926,145 @@ def click_appointment_button(driver) -> bool:
     return True
 
 
-def wait_booking_feedback(driver, timeout=10) -> str:
-    end = time.time() + timeout
-    needles = [
-        "спасибо",
-        "успеш",
-        "запис",
-        "appointment",
-        "подтверж",
-        "ваша запись",
-        "created",
-        "success",
-        "ошибка",
-        "error",
-    ]
+JS_WATCH_BOOKING_RESULT = r"""
+const okSel = arguments[0], errSel = arguments[1];
+window.__bumpixBooking = null;
+if (window.__bumpixBookingObserver) window.__bumpixBookingObserver.disconnect();
+const visible = (el) => {
+  const st = window.getComputedStyle(el);
+  const r = el.getBoundingClientRect();
+  return st.display !== 'none' && st.visibility !== 'hidden' && r.width > 0 && r.height > 0;
+};
+const seen = new Set(document.querySelectorAll(okSel + ',' + errSel));
+const verdict = () => {
+  for (const [sel, ok] of [[errSel, false], [okSel, true]]) {
+    for (const el of document.querySelectorAll(sel)) {
+      if (seen.has(el) && !el.__bumpixChanged) continue;
+      if (!visible(el)) continue;
+      return {ok: ok, text: (el.innerText || el.textContent || '').trim().slice(0, 300)};
+    }
+  }
+  return null;
+};
+const obs = new MutationObserver((muts) => {
+  for (const m of muts) if (m.type === 'attributes' || m.type === 'characterData') {
+    const el = m.target.nodeType === 1 ? m.target : m.target.parentElement;
+    if (el) el.__bumpixChanged = true;
+  }
+  const v = verdict();
+  if (v) { window.__bumpixBooking = v; obs.disconnect(); }
+});
+obs.observe(document.body, {childList: true, subtree: true, attributes: true, attributeFilter: ['class', 'style'], characterData: true});
+window.__bumpixBookingObserver = obs;
+"""
+
+JS_WAIT_BOOKING_RESULT = r"""
+const done = arguments[arguments.length - 1];
+const waitMs = arguments[0];
+const t0 = Date.now();
+(function poll() {
+  if (window.__bumpixBooking || Date.now() - t0 >= waitMs) return done(window.__bumpixBooking || null);
+  requestAnimationFrame(poll);
+})();
+"""
+
+
+@dataclass(frozen=True)
+class BookingConfirmation:
+    ok: bool
+    detail: str
+    source: str  # "network" | "dom"
+
+
+def _json_flag(data: dict, keys: tuple) -> Optional[object]:
+    for k in keys:
+        if k in data and data[k] not in (None, "", [], {}):
+            return data[k]
+    return None
+
+
+def booking_verdict_from_response(status: int, body: str) -> Optional[BookingConfirmation]:
+    """Вердикт по ответу на создание записи; None — ответ ни о чём не говорит (ждём дальше)."""
+    if int(status or 0) >= 400:
+        return BookingConfirmation(False, f"Сервер ответил {status}", "network")
+    try:
+        data = json.loads(body or "")
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        err = _json_flag(data, ("error", "errors", "errorMessage", "message_error"))
+        if err:
+            return BookingConfirmation(False, clean_spaces(str(err))[:300], "network")
+        flag = _json_flag(data, ("success", "ok", "result", "status"))
+        if flag is True or str(flag).lower() in ("ok", "success", "true", "1", "created"):
+            return BookingConfirmation(True, clean_spaces(str(data.get("message") or ""))[:300], "network")
+        if flag is False or str(flag).lower() in ("error", "fail", "false", "0"):
+            return BookingConfirmation(False, clean_spaces(str(data.get("message") or ""))[:300], "network")
+        return None
+    low = (body or "").lower()
+    if "servererror" in low or "ошибка" in low:
+        return BookingConfirmation(False, "Сервер вернул ошибку", "network")
+    if "успеш" in low or "success" in low:
+        return BookingConfirmation(True, "", "network")
+    return None
+
+
+def is_booking_post(method: str, resource_type: str, url: str) -> bool:
+    if (method or "").upper() != "POST" or (resource_type or "").lower() not in ("xhr", "fetch"):
+        return False
+    url = (url or "").lower()
+    return "bumpix" in url and any(h in url for h in BOOKING_POST_URL_HINTS)
+
+
+def arm_booking_confirmation(driver):
+    """Вызывается прямо перед кликом «Записаться»: чистим performance log и ставим MutationObserver."""
+    drain_performance_log(driver)
+    driver.execute_script(JS_WATCH_BOOKING_RESULT, BOOKING_SUCCESS_SELECTORS, BOOKING_ERROR_SELECTORS)
+
+
+def wait_booking_confirmation(driver, timeout=BOOKING_CONFIRM_TIMEOUT, token: Optional[CancelToken] = None) -> Optional[BookingConfirmation]:
+    try:
+        current = driver.current_window_handle or ""
+    except WebDriverException:
+        current = ""
+    posts: dict[str, str] = {}
+    statuses: dict[str, int] = {}
+    end = time.time() + budget_timeout(token, timeout)
     while time.time() < end:
-        src = (driver.page_source or "")
-        low = src.lower()
-        for n in needles:
-            if n in low:
-                return n
-        time.sleep(0.25)
-    return ""
+        check_cancel(token)
+        for msg in drain_performance_log(driver):
+            if not _is_current_webview(current, msg.get("webview") or ""):
+                continue
+            method = msg.get("method")
+            params = msg.get("params") or {}
+            rid = params.get("requestId")
+            if method == "Network.requestWillBeSent":
+                req = params.get("request") or {}
+                if is_booking_post(req.get("method"), params.get("type"), req.get("url")):
+                    posts[rid] = req.get("url") or ""
+            elif method == "Network.responseReceived" and rid in posts:
+                statuses[rid] = int((params.get("response") or {}).get("status") or 0)
+            elif method == "Network.loadingFailed" and rid in posts:
+                posts.pop(rid, None)
+            elif method == "Network.loadingFinished" and rid in posts:
+                url = posts.pop(rid)
+                try:
+                    res = driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": rid}) or {}
+                except WebDriverException:
+                    res = {}
+                body = "" if res.get("base64Encoded") else (res.get("body") or "")
+                verdict = booking_verdict_from_response(statuses.get(rid, 0), body)
+                if verdict is not None:
+                    logger.info("booking confirmation from network: %s -> %s", url, verdict.ok)
+                    return verdict
+        # DOM ждём событийно: скрипт возвращается сразу, как только наблюдатель что-то увидел
+        try:
+            dom = driver.execute_async_script(JS_WAIT_BOOKING_RESULT, int(min(300, max(0.0, end - time.time()) * 1000)))
+        except WebDriverException:
+            dom = None
+        if dom:
+            return BookingConfirmation(bool(dom.get("ok")), clean_spaces(dom.get("text") or "")[:300], "dom")
+    return None
 
 
 @dataclass(frozen=True)
@@ -1278,46 +3072,91 @@ class BookingAttempt:
     time: str
     ok: bool
     message: str
-
-
-def book_appointment_flow(driver, url: str, sids, target_date: date, time_str: str, comment: str) -> BookingAttempt:
+    alternatives: tuple = ()
+
+
+def booking_attempt_from_confirmation(time_str: str, conf: Optional[BookingConfirmation]) -> BookingAttempt:
+    if conf is None:
+        # ни ответа сервера, ни узла результата — успехом не считаем; пусть пользователь сверится с «Моими записями»
+        return BookingAttempt(time=time_str, ok=False, message="Запись не подтверждена: «Записаться» нажата, ответа сайта нет — проверьте «Мои записи»")
+    if conf.ok:
+        return BookingAttempt(time=time_str, ok=True, message="Запись подтверждена" + (f": {conf.detail}" if conf.detail else ""))
+    return BookingAttempt(time=time_str, ok=False, message="Сайт отклонил запись" + (f": {conf.detail}" if conf.detail else ""))
+
+
+def _minutes(hhmm: str) -> int:
+    h, m = hhmm.split(":", 1)
+    return int(h) * 60 + int(m)
+
+
+def nearest_times(target: str, available: list[str], n: int = SLOT_ALTERNATIVES) -> list[str]:
+    t = _minutes(target)
+    return sorted(sorted(available, key=lambda a: (abs(_minutes(a) - t), _minutes(a)))[:n], key=_minutes)
+
+
+def book_appointment_flow(
+    driver,
+    url: str,
+    sids,
+    target_date: date,
+    time_str: str,
+    comment: str,
+    token: Optional[CancelToken] = None,
+    state: Optional[PageState] = None,
+) -> BookingAttempt:
+    if state is None:
+        state = PageState()
+    breaker = BREAKERS.get(url)
+    if not breaker.allow():
+        # комната отвечает ошибками — не добавляем ей нагрузки, как и поиск слотов
+        return BookingAttempt(time=time_str, ok=False, message=breaker_open_message(breaker))
     try:
-        open_page(driver, url)
-        select_services(driver, sids)
-        click_choose_time(driver, timeout=22)
-        wait_calendar_visible(driver, timeout=14)
-        click_specific_date(driver, target_date)
+        step = ensure_calendar_ready(driver, url, sids, token, state)
+        # если нужная дата уже показана (после поиска слотов) — сразу к слоту
+        if step < 3 or state.shown_date != target_date:
+            select_date_tracked(driver, target_date, token, state)
 
         if is_server_error_timeblocks(driver):
+            if breaker.record_failure():
+                return BookingAttempt(time=time_str, ok=False, message=breaker_open_message(breaker))
             return BookingAttempt(time=time_str, ok=False, message="Серверная ошибка в timeBlocks")
+        breaker.record_success()
 
         try:
-            wait_timeblocks_stable(driver, timeout=12, stable_for_sec=0.7)
+            wait_timeblocks_stable(driver, timeout=12, stable_for_sec=TIMEBLOCKS_QUIET_SEC, token=token)
         except TimeoutException:
             pass
         try:
-            wait_timeblocks_not_placeholder(driver, timeout=8)
+            wait_timeblocks_not_placeholder(driver, timeout=8, token=token)
         except TimeoutException:
             pass
 
+        enter_stage(token, "выбор слота")
         if not click_time_slot(driver, time_str):
             return BookingAttempt(time=time_str, ok=False, message=f"Не смог кликнуть слот {time_str}")
 
-        time.sleep(0.2)
-        if not fill_comment_strict(driver, comment, timeout=14):
+        enter_stage(token, "комментарий")
+        token_sleep(token, 0.2)
+        if not fill_comment_strict(driver, comment, timeout=14, token=token):
             return BookingAttempt(time=time_str, ok=False, message="Не нашёл/не смог заполнить поле комментария")
 
-        time.sleep(0.2)
-        if not click_appointment_button(driver):
+        token_sleep(token, 0.2)
+        arm_booking_confirmation(driver)
+        if not click_appointment_button(driver, token):
             return BookingAttempt(time=time_str, ok=False, message="Кнопка «Записаться» не найдена/не кликабельна")
 
-        hint = wait_booking_feedback(driver, timeout=10)
-        if hint in ("ошибка", "error"):
-            return BookingAttempt(time=time_str, ok=False, message="После клика обнаружен текст ошибки на странице")
-
-        return BookingAttempt(time=time_str, ok=True, message="Комментарий заполнен, «Записаться» нажата")
+        enter_stage(token, "подтверждение записи")
+        return booking_attempt_from_confirmation(time_str, wait_booking_confirmation(driver, token=token))
+    except DeadlineExceeded as e:
+        return BookingAttempt(time=time_str, ok=False, message=str(e))
+    except JobCancelled:
+        raise
     except Exception as e:
         return BookingAttempt(time=time_str, ok=False, message=str(e) or "Unknown error")
+    finally:
+        # после клика по слоту/«Записаться» страница уже в другом состоянии
+        state.reset()
+        breaker.release_probe()
 
 
 # ---------------- Cabinet Selenium logic ----------------
@@ -1357,7 +3196,7 @@ def cabinet_login_with_driver(driver, url: str, phone: str, password: str) -> Au
     inp_pass = find_input_in_modal_by_placeholder(driver, "парол", timeout=10)
 
     fill_input_send_keys(inp_phone, phone)
-    time.sleep(0.1)
+    pause(0.1)
     fill_input_send_keys(inp_pass, password)
 
     if not click_modal_button_by_text(driver, ["войти", "вход", "sign in", "login"]):
@@ -1372,9 +3211,10 @@ def cabinet_login_with_driver(driver, url: str, phone: str, password: str) -> Au
             break
         if looks_like_logged_in(driver):
             break
-        time.sleep(0.25)
+        pause(0.25)
 
     try:
+        note_navigation(driver)
         driver.refresh()
         WebDriverWait(driver, 18, poll_frequency=WAIT_POLL).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
     except Exception:
@@ -1384,7 +3224,7 @@ def cabinet_login_with_driver(driver, url: str, phone: str, password: str) -> Au
     if err:
         return AuthResult(False, err, verified_records=False)
 
-    if verify_records_access(driver):
+    if verify_records_access(driver, force=True):
         return AuthResult(True, "Вход подтверждён: «Мои записи» доступны.", verified_records=True)
 
     return AuthResult(
@@ -1413,11 +3253,11 @@ def cabinet_register_with_driver(driver, url: str, name: str, phone: str, passwo
 
     if inp_name:
         fill_input_send_keys(inp_name, name)
-    time.sleep(0.05)
+    pause(0.05)
     fill_input_send_keys(inp_phone, phone)
-    time.sleep(0.05)
+    pause(0.05)
     fill_input_send_keys(inp_pass, password)
-    time.sleep(0.05)
+    pause(0.05)
     if inp_pass2:
         fill_input_send_keys(inp_pass2, password2)
 
@@ -1431,304 +3271,2154 @@ def cabinet_register_with_driver(driver, url: str, name: str, phone: str, passwo
             return AuthResult(False, err, verified_records=False)
         if not js_modal_visible(driver):
             return AuthResult(True, "Окно регистрации закрылось (похоже на успешную регистрацию).", verified_records=False)
-        time.sleep(0.25)
+        pause(0.25)
+
+    err = read_modal_errors(driver)
+    return AuthResult(False, err or "Не удалось определить результат регистрации.", verified_records=False)
+
+
+# ---------------- FIX: proper records extraction (no junk lines, no duplicates) ----------------
+JS_MY_RECORDS = r"""
+function visible(el){
+  if(!el) return false;
+  const st = window.getComputedStyle(el);
+  if(st.display === 'none' || st.visibility === 'hidden' || st.opacity === '0') return false;
+  const r = el.getBoundingClientRect();
+  return r.width > 20 && r.height > 10;
+}
+
+const nodes = Array.from(document.querySelectorAll('div,li,article,section,main')).filter(visible);
+const out = [];
+const seen = new Set();
+
+const reDateWord = /\d{1,2}\s*[A-Za-zА-Яа-яёЁ]+\s*-?\s*\d{2,4}/;
+const reDateNum  = /\d{1,2}[.\/-]\d{1,2}[.\/-]\d{2,4}/;
+const reTime     = /\b\d{1,2}:\d{2}\b/;
+
+const BAD_LINE_WORDS = [
+  'отзыв', 'отзывы', 'оставить отзыв', 'написать отзыв', 'review',
+  'новая запись', 'создать запись', 'записаться', 'new appointment',
+  'подробнее', 'детали'
+];
+
+function normSpaces(s){
+  return (s||'').replace(/\u00a0/g,' ').replace(/\u202f/g,' ').replace(/\s+/g,' ').trim();
+}
+
+function normKey(s){
+  return normSpaces(s).toLowerCase();
+}
+
+function isBadLine(line){
+  const l = (line||'').trim().toLowerCase();
+  if(!l) return true;
+  for(const w of BAD_LINE_WORDS){
+    if(l === w) return true;
+  }
+  for(const w of BAD_LINE_WORDS){
+    if(l.includes(w) && l.length <= 40) return true;
+  }
+  if(l.includes('на главную') && l.length < 30) return true;
+  if(l.includes('политика') && l.length < 50) return true;
+  return false;
+}
+
+function looksLikeRealRecord(text){
+  const tx = text || '';
+  const low = tx.toLowerCase();
+  const hasDate = reDateWord.test(tx) || reDateNum.test(tx);
+  const hasTime = reTime.test(tx);
+  const hasMoney = low.includes('₽') || low.includes('руб') || low.includes('uah');
+  const hasStatus =
+    low.includes('подтверж') || low.includes('ожида') || low.includes('отмен') || low.includes('перенес') ||
+    low.includes('confirmed') || low.includes('pending') || low.includes('cancel');
+  return hasDate && hasTime && (hasMoney || hasStatus);
+}
+
+for(const el of nodes){
+  const raw = (el.innerText || '').trim();
+  if(!raw) continue;
+  if(raw.length < 50 || raw.length > 2000) continue;
+
+  const lines = raw
+    .split('\n')
+    .map(s => (s||'').trim())
+    .map(normSpaces)
+    .filter(Boolean)
+    .filter(s => !isBadLine(s));
+
+  if(!lines.length) continue;
+
+  const joined = lines.slice(0, 18).join('\n').trim();
+  if(!joined) continue;
+
+  if(!looksLikeRealRecord(joined)) continue;
+
+  const key = normKey(joined);
+  if(seen.has(key)) continue;
+  seen.add(key);
+
+  out.push(joined);
+  if(out.length >= 40) break;
+}
+
+return out;
+"""
+
+
+def js_extract_my_records(driver) -> list[str]:
+    return driver.execute_script(JS_MY_RECORDS)
+
+
+def cabinet_open_my_records_with_driver(driver, token: Optional[CancelToken] = None) -> RecordsResult:
+    last_url = None
+    for u in RECORDS_URLS.ordered():
+        last_url = u
+        try:
+            open_page(driver, u, token)
+        except JobCancelled:
+            raise
+        except Exception:
+            continue
+        token_sleep(token, 0.25)
+        if not looks_like_auth_required(driver):
+            RECORDS_URLS.remember(u)
+            break
+
+    if last_url is None:
+        return RecordsResult(False, [], "Не удалось открыть страницу «Мои записи» (URL не загрузились).")
+
+    if looks_like_auth_required(driver):
+        remember_session_verdict(driver, False)
+        return RecordsResult(False, [], "Нужна авторизация. Страница записей просит вход.")
+    remember_session_verdict(driver, True)
+
+    recs = js_extract_my_records(driver) or []
+    recs = dedupe_records(recs)
+
+    if not recs:
+        return RecordsResult(True, [], "Записей не найдено (возможно, их нет).")
+
+    return RecordsResult(True, recs, f"Найдено записей: {len(recs)}")
+
+
+def cabinet_logout_flow(driver) -> LogoutResult:
+    try:
+        if not looks_like_logged_in(driver) and not verify_records_access(driver):
+            return LogoutResult(True, "Вы уже вышли из аккаунта.")
+    except Exception:
+        pass
+
+    if LOGOUT_MODE == "cdp":
+        try:
+            if cabinet_logout_cdp(driver):
+                return LogoutResult(True, "Вы вышли из аккаунта.")
+        except Exception as e:
+            logger.info("cdp logout failed, falling back to UI: %s", e)
+
+    ok = False
+    try:
+        ok = cabinet_logout_with_driver(driver)
+    except Exception as e:
+        return LogoutResult(False, f"Ошибка logout: {e}")
+
+    if not ok:
+        return LogoutResult(False, "Не удалось подтвердить выход (кнопка 'Выйти/Logout' не найдена или сессия осталась активной).")
+
+    return LogoutResult(True, "Вы вышли из аккаунта.")
+
+
+# ---------------- Playwright flows (async, BROWSER_BACKEND = "playwright") ----------------
+# Те же JS-скрипты, что и у Selenium-сценариев; ожидания — через wait_for_function/локаторы, без потоков.
+PW_CHOOSE_TIME_SELECTOR = ", ".join(
+    f"{sel}:not(.disabled):not([aria-disabled='true'])"
+    for sel in (
+        "button:has-text('Выбрать время')",
+        "a:has-text('Выбрать время')",
+        "input[type='button'][value*='Выбрать время']",
+        "input[type='submit'][value*='Выбрать время']",
+        "[role='button']:has-text('Выбрать время')",
+        "button.btn-orange",
+    )
+)
+PW_MODAL_SELECTOR = ".modal:visible, [role='dialog']:visible"
+
+
+def _pw_fn(body: str) -> str:
+    # скрипт в стиле execute_script: внутри arguments[i] — i-й элемент переданного массива
+    return "(args) => (function () {\n" + body + "\n}).apply(null, args)"
+
+
+async def pw_eval(page, body: str, *args):
+    return await page.evaluate(_pw_fn(body), list(args))
+
+
+async def pw_eval_element(page, body: str, *args):
+    handle = await page.evaluate_handle(_pw_fn(body), list(args))
+    el = handle.as_element()
+    if el is None:
+        await handle.dispose()
+    return el
+
+
+async def pw_sleep(token: Optional[CancelToken], sec: float):
+    await asyncio.sleep(budget_timeout(token, sec))
+    check_cancel(token)
+
+
+async def pw_wait_js(page, body: str, timeout: float, token: Optional[CancelToken] = None, *args):
+    check_cancel(token)
+    try:
+        await page.wait_for_function(
+            _pw_fn(body), arg=list(args), timeout=budget_timeout(token, timeout) * 1000, polling=int(WAIT_POLL * 1000)
+        )
+    except PlaywrightTimeout:
+        check_cancel(token)
+        raise
+
+
+async def pw_open_page(page, url: str, token: Optional[CancelToken] = None):
+    check_cancel(token)
+    try:
+        await page.goto(url, wait_until="domcontentloaded", timeout=budget_timeout(token, PAGE_LOAD_TIMEOUT) * 1000)
+    except PlaywrightTimeout:
+        check_cancel(token)
+        raise
+
+
+async def pw_page_text_has_any(page, needles: list[str]) -> bool:
+    return text_has_any(await page.content(), needles)
+
+
+async def pw_extract_times(page, html: Optional[str] = None) -> list[str]:
+    times_raw = await pw_eval(page, JS_EXTRACT_TIMES, html)
+    if not times_raw and html is None:
+        txt = await pw_eval(page, JS_TIMEBLOCKS_TEXT) or ""
+        times_raw = re.findall(r"\b\d{1,2}:\d{2}\b", txt)
+    return normalize_times(times_raw)
+
+
+async def pw_timeblocks_text(page) -> str:
+    return await pw_eval(page, JS_TIMEBLOCKS_TEXT) or ""
+
+
+async def pw_settle_timeblocks(page, prev_html: str, token: Optional[CancelToken] = None):
+    try:
+        await pw_wait_js(page, JS_TIMEBLOCKS_CHANGED, 8, token, prev_html or "")
+    except PlaywrightTimeout:
+        pass
+
+    end = time.time() + budget_timeout(token, 12)
+    last, last_change = None, time.time()
+    while time.time() < end:
+        cur = await pw_eval(page, JS_TIMEBLOCKS_HTML) or ""
+        if cur != last:
+            last, last_change = cur, time.time()
+        elif time.time() - last_change >= TIMEBLOCKS_QUIET_SEC:
+            break
+        await pw_sleep(token, 0.1)
+
+    end = time.time() + budget_timeout(token, 8)
+    while time.time() < end:
+        txt = await pw_timeblocks_text(page)
+        if not is_placeholder_text(txt) or is_server_error_text(txt):
+            break
+        await pw_sleep(token, WAIT_POLL)
+
+
+async def pw_parse_times_mode(page, tries=26, sleep_sec=0.2, min_votes=2, token: Optional[CancelToken] = None):
+    samples = []
+    for _ in range(tries):
+        check_cancel(token)
+        if not is_server_error_text(await pw_timeblocks_text(page)):
+            cur = await pw_extract_times(page)
+            if cur:
+                samples.append(tuple(cur))
+        await pw_sleep(token, sleep_sec)
+    if not samples:
+        return []
+    best, votes = Counter(samples).most_common(1)[0]
+    if votes < min_votes:
+        best = max(samples, key=len)
+    return list(best)
+
+
+async def pw_get_services(page, url: str, token: Optional[CancelToken] = None) -> list[ServiceItem]:
+    await pw_open_page(page, url, token)
+    await pw_wait_js(page, JS_SERVICES_PRESENT, 18, token)
+    return services_from_rows(await pw_eval(page, JS_SERVICES_ROWS))
+
+
+async def pw_select_services(page, sids, token: Optional[CancelToken] = None):
+    sids = [str(x) for x in sids]
+    check_cancel(token)
+    state = await pw_eval(page, JS_SELECT_SERVICES_BATCH, sids)
+    if state and not state.get("missing") and set(state.get("selected") or []) == set(sids):
+        return state
+
+    logger.info("batch service selection mismatch (%s), falling back to per-element clicks", state)
+    await pw_eval(page, JS_SELECT_SERVICES_BATCH, [])  # пустой набор = снять все услуги
+    for sid in sids:
+        check_cancel(token)
+        label = page.locator(f"label:has(input[data-service-id='{sid}'])").first
+        if await label.count():
+            await label.click(timeout=budget_timeout(token, 10) * 1000)
+        else:
+            await page.locator(f"input[data-service-id='{sid}']").first.check(force=True, timeout=budget_timeout(token, 10) * 1000)
+        await pw_sleep(token, 0.08)
+    await pw_wait_js(page, JS_SERVICES_SELECTED, 15, token, sids)
+    return None
+
+
+async def pw_ensure_calendar_ready(page, url: str, sids, token: Optional[CancelToken], state: PageState) -> int:
+    """То же, что ensure_calendar_ready: продолжаем с самого глубокого валидного шага."""
+    sids_key = tuple(sorted(map(str, sids)))
+    step = 0
+    if state.url == url:
+        try:
+            live = await pw_eval(page, JS_PAGE_STATE, SEL_PICKER_CALENDAR) or {}
+        except PlaywrightError:
+            live = {}
+        if live and _norm_page_url(live.get("href")) == _norm_page_url(url):
+            step = 1
+            if state.sids == sids_key and set(live.get("selected") or []) == set(sids_key):
+                step = 2
+                if state.calendar_open and live.get("calendar_visible"):
+                    step = 3
+
+    if step < 1:
+        state.reset()
+        enter_stage(token, "открытие страницы")
+        await pw_open_page(page, url, token)
+        state.url = url
+    if step < 2:
+        state.sids = ()
+        state.calendar_open = False
+        state.shown_date = None
+        enter_stage(token, "выбор услуг")
+        await pw_select_services(page, sids, token)
+        state.sids = sids_key
+    if step < 3:
+        enter_stage(token, "кнопка «Выбрать время»")
+        await page.locator(PW_CHOOSE_TIME_SELECTOR).first.click(timeout=budget_timeout(token, 22) * 1000)
+        enter_stage(token, "календарь")
+        await page.locator(SEL_PICKER_CALENDAR).first.wait_for(state="visible", timeout=budget_timeout(token, 14) * 1000)
+        state.calendar_open = True
+    return step
+
+
+async def pw_select_date(page, target_date: date, token: Optional[CancelToken], state: PageState, settle: bool = True) -> str:
+    enter_stage(token, "выбор даты")
+    state.shown_date = None
+    await pw_wait_js(page, "return document.querySelectorAll('td.day').length > 0;", 14, token)
+    y, m0, d = target_date.year, target_date.month - 1, target_date.day
+
+    prev = await pw_eval(page, JS_MARK_TIMEBLOCKS_STALE) or ""
+    for _ in range(14):
+        check_cancel(token)
+        cell = await pw_eval_element(page, JS_FIND_DAY_CELL, y, m0, d)
+        if cell is not None:
+            await cell.click(timeout=budget_timeout(token, 10) * 1000)
+            if settle:
+                await pw_settle_timeblocks(page, prev, token)
+            state.shown_date = target_date
+            state.month = (y, m0)
+            return prev
+
+        view = await pw_eval(page, JS_CALENDAR_VIEW)
+        direction = "next" if not view or (y, m0) > (int(view["y"]), int(view["m"])) else "prev"
+        btn = await pw_eval_element(page, JS_CALENDAR_NAV_BUTTON, direction)
+        if btn is not None:
+            await btn.click()
+        await pw_sleep(token, CALENDAR_NAV_SETTLE_SEC)
+
+    raise RuntimeError("Не удалось выбрать дату в календаре.")
+
+
+async def pw_select_date_from_network(page, target_date: date, token: Optional[CancelToken], state: PageState):
+    """Кликает дату и ждёт XHR со слотами. Возвращает (innerHTML #timeBlocks до клика, NetworkSlots | None)."""
+    got: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def on_response(resp):
+        if not got.done() and is_slots_xhr(resp.request.resource_type, resp.status, resp.url):
+            got.set_result(resp)
+
+    page.on("response", on_response)
+    try:
+        prev = await pw_select_date(page, target_date, token, state, settle=False)
+        enter_stage(token, "ответ сервера со слотами")
+        try:
+            resp = await asyncio.wait_for(got, budget_timeout(token, NETWORK_SLOTS_TIMEOUT))
+            body = await resp.text()
+        except (asyncio.TimeoutError, PlaywrightError):
+            return prev, None
+    finally:
+        page.remove_listener("response", on_response)
+
+    server_error, html = slots_html_from_payload(body)
+    if server_error:
+        return prev, NetworkSlots(times=[], server_error=True)
+    if not html:
+        return prev, None
+    logger.info("slots from network: %s", resp.url)
+    return prev, NetworkSlots(times=await pw_extract_times(page, html))
+
+
+async def pw_get_times_for_selection(page, url: str, sids, target_date: date, token: CancelToken, state: PageState) -> TimesResult:
+    breaker = BREAKERS.get(url)
+    if state.shown_date == target_date:
+        state.reset()
+    await pw_ensure_calendar_ready(page, url, sids, token, state)
+
+    for attempt in range(5):
+        if NETWORK_SLOTS:
+            prev, net = await pw_select_date_from_network(page, target_date, token, state)
+            if net is not None and net.server_error:
+                if breaker.record_failure():
+                    return TimesResult(status="ERROR", times=[], error=breaker_open_message(breaker))
+                enter_stage(token, "повтор после ошибки сервера")
+                await pw_sleep(token, backoff_delay(attempt, 0.8, 5.0))
+                continue
+            if net is not None:
+                breaker.record_success()
+                return TimesResult(status="OK" if net.times else "EMPTY", times=net.times)
+            await pw_settle_timeblocks(page, prev, token)
+        else:
+            await pw_select_date(page, target_date, token, state)
+
+        txt = await pw_timeblocks_text(page)
+        if is_server_error_text(txt):
+            if breaker.record_failure():
+                return TimesResult(status="ERROR", times=[], error=breaker_open_message(breaker))
+            enter_stage(token, "повтор после ошибки сервера")
+            await pw_sleep(token, backoff_delay(attempt, 0.8, 5.0))
+            continue
+
+        enter_stage(token, "чтение слотов")
+        times = await pw_parse_times_mode(page, tries=26, sleep_sec=0.2, min_votes=2, token=token)
+        if times:
+            breaker.record_success()
+            await pw_sleep(token, 0.25)
+            confirm = await pw_parse_times_mode(page, tries=10, sleep_sec=0.18, min_votes=1, token=token)
+            return TimesResult(status="OK", times=confirm if confirm else times)
+
+        if not is_placeholder_text(await pw_timeblocks_text(page)):
+            breaker.record_success()
+            return TimesResult(status="EMPTY", times=[])
+
+        enter_stage(token, "перезагрузка страницы")
+        await pw_sleep(token, 0.5)
+        state.reset()
+        await pw_ensure_calendar_ready(page, url, sids, token, state)
+
+    # последняя попытка без ожидания XHR, как в get_times_for_selection
+    await pw_select_date(page, target_date, token, state)
+    if is_server_error_text(await pw_timeblocks_text(page)):
+        if breaker.record_failure():
+            return TimesResult(status="ERROR", times=[], error=breaker_open_message(breaker))
+        return TimesResult(status="ERROR", times=[], error="Ошибка сервера при получении слотов")
+
+    enter_stage(token, "чтение слотов")
+    times = await pw_parse_times_mode(page, tries=28, sleep_sec=0.2, min_votes=1, token=token)
+    breaker.record_success()
+    if times:
+        return TimesResult(status="OK", times=times)
+    return TimesResult(status="EMPTY", times=[])
+
+
+async def pw_fill_comment(page, comment: str, token: Optional[CancelToken] = None) -> bool:
+    comment = (comment or "").strip()
+    if not comment:
+        return False
+    await pw_eval(page, JS_OPEN_COMMENT_UI, COMMENT_ROOT_SELECTOR)
+    field = page.locator(", ".join(COMMENT_INPUT_SELECTORS) + " >> visible=true").first
+    try:
+        await field.fill(comment, timeout=budget_timeout(token, 14) * 1000)
+    except PlaywrightError:
+        return False
+    cur = await field.evaluate("el => (el.isContentEditable ? el.textContent : el.value) || ''")
+    return comment in (cur or "").strip()
+
+
+async def pw_wait_booking_confirmation(page, responses: asyncio.Queue, token: Optional[CancelToken] = None) -> Optional[BookingConfirmation]:
+    """Ответ на POST записи или узел результата в DOM — что придёт первым."""
+
+    async def from_network():
+        while True:
+            resp = await responses.get()
+            try:
+                verdict = booking_verdict_from_response(resp.status, await resp.text())
+            except PlaywrightError:
+                continue
+            if verdict is not None:
+                return verdict
+
+    async def from_dom():
+        handle = await page.wait_for_function("() => window.__bumpixBooking", timeout=0, polling="raf")
+        dom = await handle.json_value()
+        return BookingConfirmation(bool(dom.get("ok")), clean_spaces(dom.get("text") or "")[:300], "dom")
+
+    waiters = [asyncio.ensure_future(from_network()), asyncio.ensure_future(from_dom())]
+    try:
+        done, _ = await asyncio.wait(waiters, timeout=budget_timeout(token, BOOKING_CONFIRM_TIMEOUT), return_when=asyncio.FIRST_COMPLETED)
+        for w in done:
+            if not w.cancelled() and w.exception() is None:
+                return w.result()
+        return None
+    finally:
+        for w in waiters:
+            w.cancel()
+
+
+async def pw_book_appointment_flow(
+    page, url: str, sids, target_date: date, time_str: str, comment: str, token: CancelToken, state: PageState
+) -> BookingAttempt:
+    breaker = BREAKERS.get(url)
+    if not breaker.allow():
+        return BookingAttempt(time=time_str, ok=False, message=breaker_open_message(breaker))
+    try:
+        step = await pw_ensure_calendar_ready(page, url, sids, token, state)
+        if step < 3 or state.shown_date != target_date:
+            await pw_select_date(page, target_date, token, state)
+
+        if is_server_error_text(await pw_timeblocks_text(page)):
+            if breaker.record_failure():
+                return BookingAttempt(time=time_str, ok=False, message=breaker_open_message(breaker))
+            return BookingAttempt(time=time_str, ok=False, message="Серверная ошибка в timeBlocks")
+        breaker.record_success()
+
+        enter_stage(token, "выбор слота")
+        if not await pw_eval(page, JS_CLICK_TIME_SLOT, (time_str or "").strip()):
+            return BookingAttempt(time=time_str, ok=False, message=f"Не смог кликнуть слот {time_str}")
+
+        enter_stage(token, "комментарий")
+        if not await pw_fill_comment(page, comment, token):
+            return BookingAttempt(time=time_str, ok=False, message="Не нашёл/не смог заполнить поле комментария")
+
+        await pw_eval(page, JS_WATCH_BOOKING_RESULT, BOOKING_SUCCESS_SELECTORS, BOOKING_ERROR_SELECTORS)
+        responses: asyncio.Queue = asyncio.Queue()
+
+        def on_response(resp):
+            if is_booking_post(resp.request.method, resp.request.resource_type, resp.url):
+                responses.put_nowait(resp)
+
+        page.on("response", on_response)
+        try:
+            try:
+                await page.locator(APPOINTMENT_BTN_SELECTOR).first.click(timeout=budget_timeout(token, 12) * 1000)
+            except PlaywrightTimeout:
+                return BookingAttempt(time=time_str, ok=False, message="Кнопка «Записаться» не найдена/не кликабельна")
+            enter_stage(token, "подтверждение записи")
+            conf = await pw_wait_booking_confirmation(page, responses, token)
+        finally:
+            page.remove_listener("response", on_response)
+        return booking_attempt_from_confirmation(time_str, conf)
+    except DeadlineExceeded as e:
+        return BookingAttempt(time=time_str, ok=False, message=str(e))
+    except JobCancelled:
+        raise
+    except Exception as e:
+        return BookingAttempt(time=time_str, ok=False, message=str(e) or "Unknown error")
+    finally:
+        state.reset()
+        breaker.release_probe()
+
+
+async def pw_modal_input(page, placeholder_subs: list[str], timeout=10):
+    """timeout=0 — не ждать: только поле, которое уже есть в модалке (как find_elements в Selenium-сценарии)."""
+    modal = page.locator(PW_MODAL_SELECTOR).first
+    for sub in placeholder_subs:
+        inp = modal.locator(f"input[placeholder*='{sub}' i]").first
+        if not timeout:
+            if await inp.count() and await inp.is_visible():
+                return inp
+            continue
+        try:
+            await inp.wait_for(state="visible", timeout=timeout * 1000)
+            return inp
+        except PlaywrightTimeout:
+            continue
+    return None
+
+
+async def pw_click_modal_button(page, texts: list[str]) -> bool:
+    modal = page.locator(PW_MODAL_SELECTOR).first
+    for t in texts:
+        exact = re.compile(rf"^\s*{re.escape(t)}\s*$", re.I)
+        for btn in (
+            modal.locator("button, a").filter(has_text=exact).first,
+            modal.locator(f"input[type='button'][value='{t}' i], input[type='submit'][value='{t}' i]").first,
+        ):
+            if await btn.count():
+                await btn.click()
+                return True
+    return False
+
+
+async def pw_wait_auth_modal_closed(page) -> str:
+    """Ждём закрытия модалки входа/регистрации. Возвращает текст ошибки из модалки, если он появился."""
+    end = time.time() + 18
+    while time.time() < end:
+        err = await pw_eval(page, JS_MODAL_ERRORS)
+        if err:
+            return err
+        if not await page.locator(PW_MODAL_SELECTOR).count():
+            break
+        if await pw_page_text_has_any(page, LOGGED_IN_NEEDLES):
+            break
+        await asyncio.sleep(0.25)
+    return ""
+
+
+async def pw_verify_records_access(page, token: Optional[CancelToken] = None) -> bool:
+    known = RECORDS_URLS.preferred is not None
+    for u in RECORDS_URLS.ordered():
+        try:
+            await pw_open_page(page, u, token)
+        except PlaywrightError:
+            continue
+        await pw_sleep(token, 0.25)
+        if not await pw_page_text_has_any(page, AUTH_REQUIRED_NEEDLES):
+            RECORDS_URLS.remember(u)
+            return True
+        if known:
+            return False
+    return False
+
+
+async def pw_cabinet_login(page, url: str, phone: str, password: str) -> AuthResult:
+    await pw_open_page(page, url)
+    if await pw_page_text_has_any(page, LOGGED_IN_NEEDLES) and await pw_verify_records_access(page):
+        return AuthResult(True, "Сессия уже активна, «Мои записи» доступны.", verified_records=True)
+
+    await pw_eval(page, JS_CLICK_BY_TEXT, ["вход", "войти", "sign in", "login"])
+    await page.locator(PW_MODAL_SELECTOR).first.wait_for(state="visible", timeout=14000)
+    inp_phone = await pw_modal_input(page, ["телефон", "номер"])
+    inp_pass = await pw_modal_input(page, ["парол"])
+    if inp_phone is None or inp_pass is None:
+        return AuthResult(False, "Не нашёл поля телефона/пароля в модалке.", verified_records=False)
+    await inp_phone.fill(phone)
+    await inp_pass.fill(password)
+
+    if not await pw_click_modal_button(page, ["войти", "вход", "sign in", "login"]):
+        return AuthResult(False, "Не нашёл кнопку «Войти/Sign in» в модалке.", verified_records=False)
+
+    err = await pw_wait_auth_modal_closed(page)
+    if err:
+        return AuthResult(False, err, verified_records=False)
+    try:
+        await page.reload(wait_until="domcontentloaded", timeout=18000)
+    except PlaywrightError:
+        pass
+    err = await pw_eval(page, JS_MODAL_ERRORS)
+    if err:
+        return AuthResult(False, err, verified_records=False)
+
+    if await pw_verify_records_access(page):
+        return AuthResult(True, "Вход подтверждён: «Мои записи» доступны.", verified_records=True)
+    return AuthResult(
+        False,
+        "Вход не подтверждён: «Мои записи» всё ещё требуют авторизацию (возможно, вход не прошёл или аккаунт не имеет доступа к этой странице).",
+        verified_records=False,
+    )
+
+
+async def pw_cabinet_register(page, url: str, name: str, phone: str, password: str, password2: str) -> AuthResult:
+    await pw_open_page(page, url)
+    await pw_eval(page, JS_CLICK_BY_TEXT, ["регистрация", "sign up", "registration"])
+    await page.locator(PW_MODAL_SELECTOR).first.wait_for(state="visible", timeout=14000)
+
+    # обязательные поля ждём, а необязательные к этому моменту уже отрисованы — их не ждём по 10 с
+    fields = (("телефон", phone, True), ("парол", password, True), ("имя", name, False), ("повтор", password2, False))
+    for placeholder, value, required in fields:
+        inp = await pw_modal_input(page, [placeholder], timeout=10 if required else 0)
+        if inp is not None:
+            await inp.fill(value)
+        elif required:
+            return AuthResult(False, "Не нашёл поля регистрации в модалке.", verified_records=False)
+
+    if not await pw_click_modal_button(page, ["зарегистрироваться", "sign up", "registration"]):
+        return AuthResult(False, "Не нашёл кнопку «Зарегистрироваться/Sign up» в модалке.", verified_records=False)
+
+    end = time.time() + 18
+    while time.time() < end:
+        err = await pw_eval(page, JS_MODAL_ERRORS)
+        if err:
+            return AuthResult(False, err, verified_records=False)
+        if not await page.locator(PW_MODAL_SELECTOR).count():
+            return AuthResult(True, "Окно регистрации закрылось (похоже на успешную регистрацию).", verified_records=False)
+        await asyncio.sleep(0.25)
+    err = await pw_eval(page, JS_MODAL_ERRORS)
+    return AuthResult(False, err or "Не удалось определить результат регистрации.", verified_records=False)
+
+
+async def pw_open_my_records(page, token: Optional[CancelToken] = None) -> RecordsResult:
+    if not await pw_verify_records_access(page, token):
+        return RecordsResult(False, [], "Нужна авторизация. Страница записей просит вход.")
+    recs = dedupe_records(await pw_eval(page, JS_MY_RECORDS) or [])
+    if not recs:
+        return RecordsResult(True, [], "Записей не найдено (возможно, их нет).")
+    return RecordsResult(True, recs, f"Найдено записей: {len(recs)}")
+
+
+async def pw_clear_site_data(context, page, storage_types: str):
+    await context.clear_cookies()
+    cdp = await context.new_cdp_session(page)
+    try:
+        for origin in BUMPIX_ORIGINS:
+            await cdp.send("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": storage_types})
+        if storage_types == "all":
+            await cdp.send("Network.clearBrowserCache")
+    finally:
+        await cdp.detach()
+
+
+async def pw_bumpix_cookies(context) -> Optional[list[dict]]:
+    try:
+        return live_bumpix_cookies(await context.cookies())
+    except PlaywrightError:
+        return None
+
+
+async def pw_cabinet_logout_cdp(context, page) -> bool:
+    await pw_clear_site_data(context, page, "cookies,local_storage,session_storage,indexeddb,websql")
+    # как cabinet_logout_cdp: одна дешёвая проверка, что живых кук bumpix не осталось
+    left = await pw_bumpix_cookies(context)
+    return left is not None and not left
+
+
+async def pw_cabinet_logout_with_ui(page) -> bool:
+    """Как cabinet_logout_with_driver: кнопка «Выход» в кабинете, подтверждение в модалке, проверка «Моих записей»."""
+    try:
+        await pw_open_page(page, CABINET_URL)
+    except PlaywrightError:
+        pass
+    if await pw_eval(page, JS_CLICK_BY_TEXT, ["выход", "выйти", "logout", "log out", "sign out"]):
+        await asyncio.sleep(MODAL_SETTLE_SEC)
+    if await page.locator(PW_MODAL_SELECTOR).count():
+        if await pw_click_modal_button(page, ["выйти", "выход", "да", "ok", "подтвердить", "logout", "sign out"]):
+            await asyncio.sleep(MODAL_SETTLE_SEC)
+    return not await pw_verify_records_access(page)
+
+
+async def pw_cabinet_logout(context, page) -> LogoutResult:
+    if not await pw_verify_records_access(page):
+        return LogoutResult(True, "Вы уже вышли из аккаунта.")
+
+    if LOGOUT_MODE == "cdp":
+        try:
+            if await pw_cabinet_logout_cdp(context, page):
+                return LogoutResult(True, "Вы вышли из аккаунта.")
+        except PlaywrightError as e:
+            logger.info("cdp logout failed, falling back to UI: %s", e)
+
+    try:
+        ok = await pw_cabinet_logout_with_ui(page)
+    except PlaywrightError as e:
+        return LogoutResult(False, f"Ошибка logout: {e}")
+    if not ok:
+        return LogoutResult(False, "Не удалось подтвердить выход (кнопка 'Выйти/Logout' не найдена или сессия осталась активной).")
+    return LogoutResult(True, "Вы вышли из аккаунта.")
+
+
+# ---------------- shared Chrome + per-user browser contexts ----------------
+def user_cookies_path(tg_user_id: int) -> Path:
+    return COOKIES_DIR / f"u_{tg_user_id}.json"
+
+
+def load_user_cookies(tg_user_id: int) -> list[dict]:
+    try:
+        return json.loads(user_cookies_path(tg_user_id).read_text(encoding="utf-8")) or []
+    except (OSError, ValueError):
+        return []
+
+
+def save_user_cookies(tg_user_id: int, cookies: list[dict]):
+    path = user_cookies_path(tg_user_id)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(cookies, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+    except OSError as e:
+        logger.warning("cannot save cookies for u_%s: %s", tg_user_id, e)
+
+
+def delete_user_cookies(tg_user_id: int):
+    try:
+        user_cookies_path(tg_user_id).unlink()
+    except OSError:
+        pass
+
+
+def _cookie_param(c: dict) -> dict:
+    # Storage.getCookies отдаёт Cookie, а setCookies ждёт CookieParam — оставляем только нужные поля
+    out = {k: c[k] for k in ("name", "value", "domain", "path", "secure", "httpOnly", "sameSite") if k in c}
+    expires = c.get("expires", c.get("expiry"))
+    if not c.get("session") and isinstance(expires, (int, float)) and expires > 0:
+        out["expires"] = expires
+    return out
+
+
+def context_cookies(driver, context_id: Optional[str] = None) -> list[dict]:
+    # без context_id — куки основного контекста (профиль на tmpfs)
+    res = driver.execute_cdp_cmd("Storage.getCookies", {"browserContextId": context_id} if context_id else {}) or {}
+    return [_cookie_param(c) for c in (res.get("cookies") or [])]
+
+
+def open_context_tab(driver, context_id: str) -> str:
+    target = driver.execute_cdp_cmd("Target.createTarget", {"url": "about:blank", "browserContextId": context_id})["targetId"]
+    # chromedriver видит новую цель как окно; handle совпадает с targetId (в старых версиях — с префиксом)
+    handle = next((h for h in driver.window_handles if h == target or h.endswith(target)), target)
+    driver.switch_to.window(handle)
+    suppress_animations(driver)
+    return handle
+
+
+def create_user_context(driver, cookies: list[dict]) -> tuple[str, str]:
+    context_id = driver.execute_cdp_cmd("Target.createBrowserContext", {"disposeOnDetach": False})["browserContextId"]
+    if cookies:
+        try:
+            driver.execute_cdp_cmd("Storage.setCookies", {"cookies": [_cookie_param(c) for c in cookies], "browserContextId": context_id})
+        except WebDriverException as e:
+            logger.warning("cannot restore cookies into context: %s", e)
+    return context_id, open_context_tab(driver, context_id)
+
+
+def dispose_user_context(driver, context_id: str):
+    try:
+        driver.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": context_id})
+    except WebDriverException:
+        pass
+
+
+class SharedChrome:
+    """Один общий Chrome: задачи разных пользователей на нём идут по очереди (lock), у каждого свой контекст."""
+
+    def __init__(self, idx: int):
+        self.idx = idx
+        self.lock = RLock()
+        self.driver = None
+        self.generation = 0
+        self.users: set[int] = set()
+
+    def ensure(self):
+        reason = rss_before = None
+        if self.driver is not None and driver_is_healthy(self.driver):
+            # вызывается под self.lock в начале задачи — значит, ни одна задача на этом Chrome сейчас не идёт
+            reason = recycle_reason(self.driver)
+            if reason is None:
+                return self.driver
+            rss_before = driver_tree_rss(self.driver)
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+        t0 = time.monotonic()
+        self.driver = make_driver(headless=HEADLESS, profile_dir=None)
+        DRIVER_START_STATS.add(time.monotonic() - t0)
+        if reason is not None:
+            log_recycle(f"shared Chrome #{self.idx}", reason, rss_before, driver_tree_rss(self.driver))
+        # все контексты старого процесса пропали — воркеры увидят новое поколение и создадут свои заново
+        self.generation += 1
+        return self.driver
+
+    def quit(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+        self.driver = None
+
+
+class SharedChromePool:
+    def __init__(self):
+        self.lock = RLock()
+        self.hosts: list[SharedChrome] = []
+
+    def lease(self, tg_user_id: int) -> SharedChrome:
+        with self.lock:
+            if len(self.hosts) < max(1, SHARED_CHROMES):
+                self.hosts.append(SharedChrome(len(self.hosts)))
+            host = min(self.hosts, key=lambda h: len(h.users))
+            host.users.add(tg_user_id)
+            return host
+
+
+SHARED_CHROMES_POOL = SharedChromePool()
+
+
+# ---------------- parallel booking (cloned sessions) ----------------
+class BookingDriverPool:
+    """
+    Chrome без профиля для параллельной записи; между задачами в них не остаётся ни кук, ни хранилища.
+    Одновременно живут не больше size драйверов на всех пользователей, запускаются по одному;
+    между задачами — та же плановая пересборка, что у пользовательских Chrome, простаивающие закрываются.
+    """
+
+    def __init__(self, size: int, idle_sec: float):
+        self.size = size
+        self.idle_sec = idle_sec
+        self.lock = Lock()
+        self.slots = threading.BoundedSemaphore(size)
+        self.start_lock = Lock()
+        self.idle: list[tuple[object, float]] = []
+        self.timer: Optional[threading.Timer] = None
+
+    def acquire(self, token: CancelToken):
+        while not self.slots.acquire(timeout=0.25):
+            token.check()
+        try:
+            with self.lock:
+                drv = self.idle.pop()[0] if self.idle else None
+            if drv is not None and driver_is_healthy(drv):
+                return drv
+            if drv is not None:
+                self._quit(drv)
+            token.check()
+            with self.start_lock:
+                return make_driver(headless=HEADLESS, profile_dir=None)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, drv):
+        try:
+            self._put_back(drv)
+        finally:
+            self.slots.release()
+
+    def _put_back(self, drv):
+        reason = recycle_reason(drv)
+        if reason:
+            rss = driver_tree_rss(drv)
+            self._quit(drv)
+            log_recycle("booking pool", reason, rss, None)
+            return
+        try:
+            drv.get("about:blank")
+            drv.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            for origin in BUMPIX_ORIGINS:
+                drv.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+        except Exception:
+            self._quit(drv)
+            return
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((drv, time.monotonic()))
+                self._schedule_expiry()
+                return
+        self._quit(drv)
+
+    def _schedule_expiry(self):
+        # под self.lock
+        if self.timer is None and self.idle and self.idle_sec:
+            self.timer = threading.Timer(self.idle_sec, self._expire)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.idle_sec
+        with self.lock:
+            self.timer = None
+            stale = [drv for drv, ts in self.idle if ts <= cutoff]
+            self.idle = [(drv, ts) for drv, ts in self.idle if ts > cutoff]
+            self._schedule_expiry()
+        for drv in stale:
+            self._quit(drv)
+        if stale:
+            logger.info("booking pool: closed %d idle Chrome", len(stale))
+
+    @staticmethod
+    def _quit(drv):
+        try:
+            drv.quit()
+        except Exception:
+            pass
+
+    def drain(self) -> list:
+        """Забирает свободные драйверы (закрывает их вызывающий — при остановке все драйверы гасятся разом)."""
+        with self.lock:
+            idle, self.idle = [drv for drv, _ in self.idle], []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        return idle
+
+
+BOOKING_POOL = BookingDriverPool(BOOKING_CONTEXTS, BOOKING_POOL_IDLE_SEC)
+
+
+def book_in_cloned_session(
+    cookies: list[dict], url: str, sids, target_date: date, time_str: str, comment: str, token: CancelToken
+) -> BookingAttempt:
+    token.start_budget(BOOKING_DEADLINE_SEC)
+    token.check()
+    try:
+        drv = BOOKING_POOL.acquire(token)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        return BookingAttempt(time=time_str, ok=False, message=f"Не удалось запустить браузер: {e}")
+    try:
+        with DRIVER_PROFILER.flow("booking-clone"):
+            drv.execute_cdp_cmd("Network.setCookies", {"cookies": [_cookie_param(c) for c in cookies]})
+            return book_appointment_flow(drv, url, sids, target_date, time_str, comment, token, PageState())
+    except DeadlineExceeded as e:
+        return BookingAttempt(time=time_str, ok=False, message=str(e))
+    except JobCancelled:
+        raise
+    except Exception as e:
+        return BookingAttempt(time=time_str, ok=False, message=str(e) or "Unknown error")
+    finally:
+        drain_performance_log(drv)
+        BOOKING_POOL.release(drv)
+
+
+# ---------------- Workers: per Telegram user ----------------
+class HitCounter:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def ratio(self) -> Optional[float]:
+        total = self.hits + self.misses
+        return (self.hits / total) if total else None
+
+
+class ServicesCache:
+    def __init__(self):
+        self.lock = RLock()
+        self.by_url: dict[str, list[ServiceItem]] = {}
+        self.ts_by_url: dict[str, float] = {}
+        self.ttl = 10 * 60
+        self.stats = HitCounter()
+
+    def get(self, url: str):
+        with self.lock:
+            now = time.time()
+            items = self.by_url.get(url)
+            ts = self.ts_by_url.get(url, 0.0)
+            hit = bool(items) and (now - ts) < self.ttl
+            self.stats.count(hit)
+            return list(items) if hit else None
+
+    def put(self, url: str, items: list[ServiceItem]):
+        with self.lock:
+            self.by_url[url] = list(items)
+            self.ts_by_url[url] = time.time()
+
+
+SERVICES_CACHE = ServicesCache()
+
+
+class SlotsCache:
+    """Последние полученные слоты по (комната, услуги, дата)."""
+
+    def __init__(self):
+        self.lock = RLock()
+        self.items: dict[tuple, tuple[list[str], float]] = {}
+        self.stats = HitCounter()
+
+    @staticmethod
+    def _key(url: str, sids, target_date: date) -> tuple:
+        return url, tuple(sorted(map(str, sids))), target_date.isoformat()
+
+    def get(self, url: str, sids, target_date: date, max_age: float):
+        """Возвращает (times, age_sec) или None."""
+        with self.lock:
+            hit = self.items.get(self._key(url, sids, target_date))
+            if not hit:
+                self.stats.count(False)
+                return None
+            times, ts = hit
+            age = time.time() - ts
+            self.stats.count(age <= max_age)
+            if age > max_age:
+                return None
+            return list(times), age
+
+    def invalidate(self, url: str, sids, target_date: date):
+        with self.lock:
+            self.items.pop(self._key(url, sids, target_date), None)
+
+    def put(self, url: str, sids, target_date: date, times: list[str]):
+        with self.lock:
+            self.items[self._key(url, sids, target_date)] = (list(times), time.time())
+            if len(self.items) > 2000:
+                oldest = sorted(self.items.items(), key=lambda kv: kv[1][1])[:500]
+                for k, _ in oldest:
+                    self.items.pop(k, None)
+
+
+SLOTS_CACHE = SlotsCache()
+
+
+# задачи этих видов вытесняются более новой задачей того же вида от того же пользователя;
+# запись/вход/выход/регистрацию не прерываем на середине
+SUPERSEDABLE_JOBS = {"services", "times", "records"}
+
+
+class DurationStats:
+    def __init__(self):
+        self.lock = RLock()
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, sec: float):
+        with self.lock:
+            self.count += 1
+            self.total += sec
+
+    def avg(self) -> Optional[float]:
+        with self.lock:
+            return (self.total / self.count) if self.count else None
+
+
+# сколько в среднем стоит холодный старт make_driver — с этим сравниваем мягкий сброс
+DRIVER_START_STATS = DurationStats()
+
+
+class LatencyRing:
+    """
+    Длительности задач по видам за последние window_sec секунд; перцентили считаются только по запросу.
+    Буфер вида ограничен size записями — при большом потоке он покрывает меньше окна, это видно по covered_sec().
+    """
+
+    def __init__(self, size: int = 4096, window_sec: float = 3600):
+        self.size = size
+        self.window_sec = window_sec
+        self.lock = Lock()
+        self.rings: dict[str, deque] = {}
+
+    def add(self, kind: str, sec: float):
+        now = time.monotonic()
+        with self.lock:
+            ring = self.rings.get(kind)
+            if ring is None:
+                ring = self.rings[kind] = deque(maxlen=self.size)
+            while ring and ring[0][0] < now - self.window_sec:
+                ring.popleft()
+            ring.append((now, sec))
+
+    def percentiles(self, kind: str, window_sec: Optional[float] = None, qs=(50, 95, 99)) -> tuple[int, list[float]]:
+        since = time.monotonic() - (window_sec or self.window_sec)
+        with self.lock:
+            vals = sorted(sec for ts, sec in self.rings.get(kind, ()) if ts >= since)
+        if not vals:
+            return 0, []
+        return len(vals), [vals[min(len(vals) - 1, int(len(vals) * q / 100))] for q in qs]
+
+    def covered_sec(self, kind: str, window_sec: Optional[float] = None) -> float:
+        """Сколько секунд окна реально есть в буфере: меньше окна, только если буфер заполнен и вытеснил старое."""
+        window = window_sec or self.window_sec
+        with self.lock:
+            ring = self.rings.get(kind)
+            if not ring or len(ring) < self.size:
+                return window
+            return min(window, time.monotonic() - ring[0][0])
+
+
+JOB_LATENCY = LatencyRing()
+
+
+class ExecutorLoad:
+    """Счётчики задач, отданных в пул потоков: сколько ждут свободного потока и сколько выполняются."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.submitted = 0
+        self.started = 0
+        self.finished = 0
+        self.dropped = 0  # отменены, не успев начаться
+
+    def submit(self, executor: ThreadPoolExecutor, fn):
+        def run():
+            with self.lock:
+                self.started += 1
+            return fn()
+
+        def done(f):
+            with self.lock:
+                if f.cancelled():
+                    self.dropped += 1
+                else:
+                    self.finished += 1
+
+        with self.lock:
+            self.submitted += 1
+        future = executor.submit(run)
+        future.add_done_callback(done)
+        return future
+
+    def queued(self) -> int:
+        with self.lock:
+            return self.submitted - self.started - self.dropped
+
+    def running(self) -> int:
+        with self.lock:
+            return self.started - self.finished
+
+
+EXECUTOR_LOAD = ExecutorLoad()
+
+
+@dataclass(frozen=True)
+class ResetResult:
+    soft: bool
+    elapsed_sec: float
+    saved_sec: Optional[float] = None
+
+
+# после этих сценариев куки сессии другие — открытые вкладки комнат отрисованы со старой сессией
+SESSION_CHANGING_JOBS = {"login", "register", "logout"}
+
+
+@dataclass
+class RoomTab:
+    handle: str
+    page: PageState
+
+
+class BumpixUserWorker:
+    def __init__(self, tg_user_id: int):
+        self.tg_user_id = tg_user_id
+        self.lock = RLock()
+        self.driver = None
+        self.profile_dir = profile_dir_for(tg_user_id)
+        self.jobs_lock = Lock()
+        self.jobs: dict[str, CancelToken] = {}
+        self.main_handle: Optional[str] = None
+        self.tabs: OrderedDict[str, RoomTab] = OrderedDict()
+        # BROWSER_MODE == "contexts"
+        self.host: Optional[SharedChrome] = None
+        self.context_id: Optional[str] = None
+        self.host_generation = 0
+
+    def _host(self) -> SharedChrome:
+        if self.host is None:
+            self.host = SHARED_CHROMES_POOL.lease(self.tg_user_id)
+        return self.host
+
+    def _driver_lock(self):
+        # общий Chrome нельзя дёргать из двух задач сразу: у WebDriver одна "текущая вкладка" на сессию
+        return self._host().lock if BROWSER_MODE == "contexts" else nullcontext()
+
+    def _ensure_driver(self):
+        if BROWSER_MODE == "contexts":
+            host = self._host()
+            drv = host.ensure()
+            if self.context_id is None or self.host_generation != host.generation:
+                self.tabs.clear()
+                self.context_id, self.main_handle = create_user_context(drv, load_user_cookies(self.tg_user_id))
+                self.host_generation = host.generation
+            self.driver = drv
+            return
+        if self.driver is None:
+            t0 = time.monotonic()
+            self.driver = make_driver(headless=HEADLESS, profile_dir=self.profile_dir)
+            if PROFILES_TMPFS_DIR is not None:
+                cookies = load_user_cookies(self.tg_user_id)
+                if cookies:
+                    self.driver.execute_cdp_cmd("Network.setCookies", {"cookies": [_cookie_param(c) for c in cookies]})
+            DRIVER_START_STATS.add(time.monotonic() - t0)
+            self.main_handle = self.driver.current_window_handle
+            self.tabs.clear()
+
+    def _maybe_recycle(self):
+        """Плановый перезапуск своего Chrome — только между задачами (вызывается под self.lock до сценария)."""
+        if BROWSER_MODE == "contexts" or self.driver is None:
+            return
+        reason = recycle_reason(self.driver)
+        if reason is None:
+            return
+        rss_before = driver_tree_rss(self.driver)
+        self.reset_driver()
+        # сразу поднимаем новый Chrome (вызывающий всё равно сделал бы это следующим шагом), чтобы замерить разницу
+        self._ensure_driver()
+        log_recycle(f"u_{self.tg_user_id}", reason, rss_before, driver_tree_rss(self.driver))
+
+    def _save_cookies(self):
+        """Куки в COOKIES_DIR — там, где профиль не переживает перезапуск Chrome (contexts) или бота (tmpfs)."""
+        if self.driver is None:
+            return
+        if BROWSER_MODE == "contexts":
+            if self.context_id is None:
+                return
+        elif PROFILES_TMPFS_DIR is None:
+            return
+        try:
+            save_user_cookies(self.tg_user_id, context_cookies(self.driver, self.context_id))
+        except WebDriverException as e:
+            logger.info("u_%s: cannot read cookies: %s", self.tg_user_id, e)
+
+    def _drop_context(self):
+        if self.driver is not None and self.context_id is not None:
+            SESSION_CHECKS.invalidate(self.driver)
+            dispose_user_context(self.driver, self.context_id)
+        self.context_id = None
+        self.driver = None
+
+    def reset_driver(self):
+        self.tabs.clear()
+        self.main_handle = None
+        if BROWSER_MODE == "contexts":
+            self._save_cookies()
+            self._drop_context()
+            return
+        if self.driver:
+            SESSION_CHECKS.invalidate(self.driver)
+            self._save_cookies()
+        try:
+            if self.driver:
+                self.driver.quit()
+        except Exception:
+            pass
+        self.driver = None
+        release_profile(self.profile_dir)
+
+    def _new_tab(self) -> str:
+        if BROWSER_MODE == "contexts" and self.context_id is not None:
+            return open_context_tab(self.driver, self.context_id)
+        self.driver.switch_to.new_window("tab")
+        suppress_animations(self.driver)
+        return self.driver.current_window_handle
+
+    # ---- tabs: одна "тёплая" вкладка на комнату ----
+    def _switch_to_main_tab(self):
+        try:
+            if self.main_handle and self.driver.current_window_handle != self.main_handle:
+                self.driver.switch_to.window(self.main_handle)
+            return
+        except NoSuchWindowException:
+            pass
+        # основную вкладку кто-то закрыл — берём любую, не занятую комнатами
+        room_handles = {t.handle for t in self.tabs.values()}
+        free = [h for h in self.driver.window_handles if h not in room_handles]
+        if free and BROWSER_MODE != "contexts":
+            self.driver.switch_to.window(free[0])
+            self.main_handle = free[0]
+        else:
+            self.main_handle = self._new_tab()
+
+    def _switch_to_live_tab(self):
+        """
+        После close() драйвер смотрит в закрытое окно, и new_window/createTarget из него падают —
+        возвращаемся в основную вкладку или в последнюю использованную вкладку комнаты.
+        """
+        for handle in [self.main_handle, *reversed([t.handle for t in self.tabs.values()])]:
+            if not handle:
+                continue
+            try:
+                self.driver.switch_to.window(handle)
+                return
+            except NoSuchWindowException:
+                continue
+        handles = self.driver.window_handles
+        if handles:
+            self.driver.switch_to.window(handles[0])
+
+    def _switch_to_room_tab(self, url: str) -> PageState:
+        tab = self.tabs.get(url)
+        if tab is not None:
+            try:
+                if self.driver.current_window_handle != tab.handle:
+                    self.driver.switch_to.window(tab.handle)
+                self.tabs.move_to_end(url)
+                return tab.page
+            except NoSuchWindowException:
+                self.tabs.pop(url, None)
+
+        evicted = False
+        while len(self.tabs) >= max(1, ROOM_TABS_BUDGET):
+            old_url, old = self.tabs.popitem(last=False)
+            try:
+                self.driver.switch_to.window(old.handle)
+                self.driver.close()
+            except WebDriverException:
+                pass
+            evicted = True
+            logger.info("u_%s: closed LRU tab %s", self.tg_user_id, old_url)
+        if evicted:
+            self._switch_to_live_tab()
+
+        tab = RoomTab(handle=self._new_tab(), page=PageState())
+        self.tabs[url] = tab
+        return tab.page
+
+    def _use_tab(self, room_url: Optional[str]) -> Optional[PageState]:
+        if room_url:
+            return self._switch_to_room_tab(room_url)
+        self._switch_to_main_tab()
+        return None
+
+    def _invalidate_room_tabs(self):
+        for tab in self.tabs.values():
+            tab.page.reset()
+
+    def _begin_job(self, kind: str) -> CancelToken:
+        token = CancelToken()
+        with self.jobs_lock:
+            prev = self.jobs.get(kind)
+            if prev is not None and kind in SUPERSEDABLE_JOBS:
+                prev.cancel()
+            self.jobs[kind] = token
+        return token
+
+    def _end_job(self, kind: str, token: CancelToken):
+        with self.jobs_lock:
+            if self.jobs.get(kind) is token:
+                self.jobs.pop(kind, None)
+
+    def soft_reset(self) -> ResetResult:
+        """
+        Сброс веб-сессии без перезапуска Chrome: чистим куки/кэш/хранилище и лишние вкладки через CDP.
+        Полный перезапуск — только если драйвер действительно нездоров.
+        """
+        t0 = time.monotonic()
+        with self.lock, self._driver_lock():
+            if BROWSER_MODE == "contexts":
+                # чистый лист = новый пустой контекст; общий Chrome не трогаем
+                self.tabs.clear()
+                self._drop_context()
+                delete_user_cookies(self.tg_user_id)
+                return ResetResult(soft=True, elapsed_sec=time.monotonic() - t0)
+            if self.driver is None:
+                return ResetResult(soft=True, elapsed_sec=0.0)
+            if driver_is_healthy(self.driver):
+                try:
+                    self.tabs.clear()
+                    wipe_browser_state(self.driver)
+                    self.main_handle = self.driver.current_window_handle
+                    elapsed = time.monotonic() - t0
+                    cold = DRIVER_START_STATS.avg()
+                    saved = (cold - elapsed) if cold is not None else None
+                    logger.info(
+                        "soft reset u_%s: %.2fs (cold start avg %s)",
+                        self.tg_user_id,
+                        elapsed,
+                        f"{cold:.2f}s" if cold is not None else "n/a",
+                    )
+                    return ResetResult(soft=True, elapsed_sec=elapsed, saved_sec=saved)
+                except Exception as e:
+                    logger.info("soft reset u_%s failed, relaunching Chrome: %s", self.tg_user_id, e)
+            self.reset_driver()
+            return ResetResult(soft=False, elapsed_sec=time.monotonic() - t0)
+
+    def cancel_job(self, kind: str):
+        if kind not in SUPERSEDABLE_JOBS:
+            return
+        with self.jobs_lock:
+            token = self.jobs.get(kind)
+        if token is not None:
+            token.cancel()
+
+    def _run_job(self, kind: str, fn, on_error=None, budget_sec: Optional[float] = None, room_url: Optional[str] = None):
+        """
+        Запускает fn(token, page) на драйвере пользователя: один перезапуск Chrome при WebDriverException.
+        room_url задан — работаем во вкладке этой комнаты (page — её трекер состояния), иначе в основной (page=None).
+        JobCancelled пробрасывается наружу — вызывающий хендлер просто молча выходит.
+        Бюджет (budget_sec) отсчитывается с момента захвата драйвера и общий для повторной попытки.
+        """
+        token = self._begin_job(kind)
+        try:
+            with self.lock, self._driver_lock(), DRIVER_PROFILER.flow(kind), PROFILER.job(kind):
+                token.check()
+                if budget_sec:
+                    token.start_budget(budget_sec)
+                self._maybe_recycle()
+                self._ensure_driver()
+                page = None
+                try:
+                    page = self._use_tab(room_url)
+                    return fn(token, page)
+                except JobCancelled:
+                    # живую страницу перед следующим сценарием всё равно сверяем, трекер не сбрасываем
+                    raise
+                except (WebDriverException, StaleElementReferenceException) as e:
+                    token.check()
+                    self.reset_driver()
+                    self._ensure_driver()
+                    try:
+                        page = self._use_tab(room_url)
+                        return fn(token, page)
+                    except JobCancelled:
+                        raise
+                    except Exception as e2:
+                        if page is not None:
+                            page.reset()
+                        if on_error is None:
+                            raise
+                        return on_error(str(e2) or str(e))
+                except Exception:
+                    if page is not None:
+                        page.reset()
+                    raise
+                finally:
+                    if kind in SESSION_CHANGING_JOBS:
+                        self._invalidate_room_tabs()
+                    if self.driver is not None:
+                        drain_performance_log(self.driver)
+                        self._save_cookies()
+        finally:
+            self._end_job(kind, token)
+
+    def get_services(self, url: str):
+        cached = SERVICES_CACHE.get(url)
+        if cached:
+            return cached
+
+        def job(token, page):
+            page.reset()
+            services = bumpix_get_services_with_driver(self.driver, url, token)
+            page.url = url  # вкладка комнаты открыта, услуги ещё не выбраны
+            return services
+
+        services = self._run_job("services", job, room_url=url)
+        SERVICES_CACHE.put(url, services)
+        return services
+
+    def get_times(self, url: str, sids, target_date: date) -> TimesResult:
+        breaker = BREAKERS.get(url)
+        fallback = breaker_fallback_times(breaker, url, sids, target_date)
+        if fallback is not None:
+            return fallback
+
+        try:
+            result = self._run_job(
+                "times",
+                lambda token, page: get_times_for_selection(self.driver, url, sids, target_date, token, page),
+                lambda err: TimesResult(status="ERROR", times=[], error=err),
+                budget_sec=TIMES_DEADLINE_SEC,
+                room_url=url,
+            )
+        except DeadlineExceeded as e:
+            return TimesResult(status="ERROR", times=[], error=e.describe())
+        finally:
+            breaker.release_probe()
+
+        if result.status in ("OK", "EMPTY"):
+            SLOTS_CACHE.put(url, sids, target_date, result.times)
+        return result
+
+    def book_appointments(self, url: str, sids, target_date: date, times: list[str], comment: str) -> list[BookingAttempt]:
+        token = self._begin_job("booking")
+        try:
+            cookies = self._session_cookies() if PARALLEL_BOOKING and len(times) > 1 else None
+            if cookies:
+                # каждый слот — в своём браузере с копией сессии; свой Chrome пользователя при этом свободен.
+                # Потоки — свои у каждой записи (поток EXECUTOR всё равно ждёт их), Chrome ограничивает BOOKING_POOL
+                with ThreadPoolExecutor(
+                    max_workers=min(len(times), BOOKING_CONTEXTS), thread_name_prefix=f"booking-u{self.tg_user_id}"
+                ) as pool:
+                    futures = [
+                        pool.submit(book_in_cloned_session, cookies, url, sids, target_date, t, comment, token.child())
+                        for t in times
+                    ]
+                    return [f.result() for f in futures]
+            with self.lock, self._driver_lock(), DRIVER_PROFILER.flow("booking"), PROFILER.job("booking"):
+                self._maybe_recycle()
+                self._ensure_driver()
+                out: list[BookingAttempt] = []
+                for t in times:
+                    # свой бюджет на каждый слот, и до проверки: перерасход прошлого слота не должен обрывать следующие
+                    token.start_budget(BOOKING_DEADLINE_SEC)
+                    token.check()
+                    try:
+                        page = self._switch_to_room_tab(url)
+                        out.append(book_appointment_flow(self.driver, url, sids, target_date, t, comment, token, page))
+                    except DeadlineExceeded as e:
+                        out.append(BookingAttempt(time=t, ok=False, message=str(e)))
+                    except (WebDriverException, StaleElementReferenceException) as e:
+                        self.reset_driver()
+                        self._ensure_driver()
+                        try:
+                            page = self._switch_to_room_tab(url)
+                            out.append(book_appointment_flow(self.driver, url, sids, target_date, t, comment, token, page))
+                        except DeadlineExceeded as e2:
+                            out.append(BookingAttempt(time=t, ok=False, message=str(e2)))
+                        except JobCancelled:
+                            raise
+                        except Exception as e2:
+                            out.append(BookingAttempt(time=t, ok=False, message=str(e2) or str(e)))
+                drain_performance_log(self.driver)
+                self._save_cookies()
+                return out
+        finally:
+            self._end_job("booking", token)
+
+    def _session_cookies(self) -> Optional[list[dict]]:
+        with self.lock, self._driver_lock():
+            self._ensure_driver()
+            self._switch_to_main_tab()
+            return bumpix_cookies(self.driver)
+
+    def cabinet_login(self, url: str, phone: str, password: str) -> AuthResult:
+        return self._run_job(
+            "login",
+            lambda token, page: cabinet_login_with_driver(self.driver, url, phone, password),
+            lambda err: AuthResult(False, err, verified_records=False),
+        )
+
+    def cabinet_register(self, url: str, name: str, phone: str, password: str, password2: str) -> AuthResult:
+        return self._run_job(
+            "register",
+            lambda token, page: cabinet_register_with_driver(self.driver, url, name, phone, password, password2),
+            lambda err: AuthResult(False, err, verified_records=False),
+        )
+
+    def get_my_records(self) -> RecordsResult:
+        return self._run_job(
+            "records",
+            lambda token, page: cabinet_open_my_records_with_driver(self.driver, token),
+            lambda err: RecordsResult(False, [], err),
+        )
+
+    def cabinet_logout(self) -> LogoutResult:
+        return self._run_job(
+            "logout",
+            lambda token, page: cabinet_logout_flow(self.driver),
+            lambda err: LogoutResult(False, err),
+        )
+
+
+WORKERS: dict[int, BumpixUserWorker] = {}
+WORKERS_LOCK = RLock()
+
+
+def get_worker(uid: int) -> BumpixUserWorker:
+    with WORKERS_LOCK:
+        w = WORKERS.get(uid)
+        if not w:
+            w = BumpixUserWorker(uid)
+            WORKERS[uid] = w
+        return w
 
-    err = read_modal_errors(driver)
-    return AuthResult(False, err or "Не удалось определить результат регистрации.", verified_records=False)
 
+def shutdown_workers(timeout: float = SHUTDOWN_QUIT_TIMEOUT):
+    """Останавливает задачи всех WORKERS и параллельно закрывает их Chrome (и общие Chrome в режиме contexts)."""
+    with WORKERS_LOCK:
+        workers = list(WORKERS.values())
+    drivers = []
+    for w in workers:
+        with w.jobs_lock:
+            tokens = list(w.jobs.values())
+        for token in tokens:
+            token.cancel()
+        w._save_cookies()
+        if BROWSER_MODE == "contexts":
+            continue
+        if w.driver is not None:
+            drivers.append(w.driver)
+            w.driver = None
+            w.tabs.clear()
+            w.main_handle = None
+    if BROWSER_MODE == "contexts":
+        with SHARED_CHROMES_POOL.lock:
+            hosts = list(SHARED_CHROMES_POOL.hosts)
+        for host in hosts:
+            if host.driver is not None:
+                drivers.append(host.driver)
+                host.driver = None
+    quit_drivers(drivers + BOOKING_POOL.drain(), timeout)
+    if BROWSER_MODE != "contexts":
+        maintain_profiles()
+
+
+# callback_data -> вид задачи, которую новый запрос делает неактуальной
+SUPERSEDE_BY_CALLBACK = (
+    ("date:", "times"),
+    ("room:", "services"),
+    ("my_records", "records"),
+    ("reset_web", "services"),
+    ("reset_web", "times"),
+    ("reset_web", "records"),
+)
 
-# ---------------- FIX: proper records extraction (no junk lines, no duplicates) ----------------
-def js_extract_my_records(driver) -> list[str]:
-    return driver.execute_script(
-        r"""
-        function visible(el){
-          if(!el) return false;
-          const st = window.getComputedStyle(el);
-          if(st.display === 'none' || st.visibility === 'hidden' || st.opacity === '0') return false;
-          const r = el.getBoundingClientRect();
-          return r.width > 20 && r.height > 10;
-        }
 
-        const nodes = Array.from(document.querySelectorAll('div,li,article,section,main')).filter(visible);
-        const out = [];
-        const seen = new Set();
+def supersede_jobs_for_update(update: object):
+    """
+    Вызывается до постановки апдейта в очередь пользователя: если пришёл новый запрос того же вида,
+    текущая (уже ненужная) браузерная задача отменяется, и очередь освобождается быстро.
+    """
+    if not isinstance(update, Update) or not update.callback_query or not update.effective_user:
+        return
+    data = update.callback_query.data or ""
+    for prefix, kind in SUPERSEDE_BY_CALLBACK:
+        if data.startswith(prefix):
+            BACKEND.cancel_job(update.effective_user.id, kind)
 
-        const reDateWord = /\d{1,2}\s*[A-Za-zА-Яа-яёЁ]+\s*-?\s*\d{2,4}/;
-        const reDateNum  = /\d{1,2}[.\/-]\d{1,2}[.\/-]\d{2,4}/;
-        const reTime     = /\b\d{1,2}:\d{2}\b/;
 
-        const BAD_LINE_WORDS = [
-          'отзыв', 'отзывы', 'оставить отзыв', 'написать отзыв', 'review',
-          'новая запись', 'создать запись', 'записаться', 'new appointment',
-          'подробнее', 'детали'
-        ];
+# ---------------- browser backends ----------------
+class BrowserBackend(ABC):
+    """
+    Всё, что хендлерам нужно от браузера. Методы — корутины: реализация сама решает,
+    крутить ли браузер в пуле потоков (Selenium) или прямо в event loop (Playwright).
+    """
 
-        function normSpaces(s){
-          return (s||'').replace(/\u00a0/g,' ').replace(/\u202f/g,' ').replace(/\s+/g,' ').trim();
-        }
+    name = ""
 
-        function normKey(s){
-          return normSpaces(s).toLowerCase();
-        }
+    @abstractmethod
+    async def get_services(self, uid: int, url: str) -> list[ServiceItem]:
+        ...
 
-        function isBadLine(line){
-          const l = (line||'').trim().toLowerCase();
-          if(!l) return true;
-          for(const w of BAD_LINE_WORDS){
-            if(l === w) return true;
-          }
-          for(const w of BAD_LINE_WORDS){
-            if(l.includes(w) && l.length <= 40) return true;
-          }
-          if(l.includes('на главную') && l.length < 30) return true;
-          if(l.includes('политика') && l.length < 50) return true;
-          return false;
-        }
+    @abstractmethod
+    async def get_times(self, uid: int, url: str, sids, target_date: date) -> TimesResult:
+        ...
 
-        function looksLikeRealRecord(text){
-          const tx = text || '';
-          const low = tx.toLowerCase();
-          const hasDate = reDateWord.test(tx) || reDateNum.test(tx);
-          const hasTime = reTime.test(tx);
-          const hasMoney = low.includes('₽') || low.includes('руб') || low.includes('uah');
-          const hasStatus =
-            low.includes('подтверж') || low.includes('ожида') || low.includes('отмен') || low.includes('перенес') ||
-            low.includes('confirmed') || low.includes('pending') || low.includes('cancel');
-          return hasDate && hasTime && (hasMoney || hasStatus);
-        }
+    @abstractmethod
+    async def book_appointments(self, uid: int, url: str, sids, target_date: date, times: list[str], comment: str) -> list[BookingAttempt]:
+        ...
 
-        for(const el of nodes){
-          const raw = (el.innerText || '').trim();
-          if(!raw) continue;
-          if(raw.length < 50 || raw.length > 2000) continue;
+    @abstractmethod
+    async def cabinet_login(self, uid: int, url: str, phone: str, password: str) -> AuthResult:
+        ...
 
-          const lines = raw
-            .split('\n')
-            .map(s => (s||'').trim())
-            .map(normSpaces)
-            .filter(Boolean)
-            .filter(s => !isBadLine(s));
+    @abstractmethod
+    async def cabinet_register(self, uid: int, url: str, name: str, phone: str, password: str, password2: str) -> AuthResult:
+        ...
 
-          if(!lines.length) continue;
+    @abstractmethod
+    async def cabinet_logout(self, uid: int) -> LogoutResult:
+        ...
 
-          const joined = lines.slice(0, 18).join('\n').trim();
-          if(!joined) continue;
+    @abstractmethod
+    async def get_my_records(self, uid: int) -> RecordsResult:
+        ...
 
-          if(!looksLikeRealRecord(joined)) continue;
+    @abstractmethod
+    async def soft_reset(self, uid: int) -> ResetResult:
+        ...
 
-          const key = normKey(joined);
-          if(seen.has(key)) continue;
-          seen.add(key);
+    @abstractmethod
+    def cancel_job(self, uid: int, kind: str):
+        ...
 
-          out.push(joined);
-          if(out.length >= 40) break;
-        }
+    async def shutdown(self):
+        pass
 
-        return out;
+    async def precheck_times(self, uid: int, url: str, sids, target_date: date, times: list[str]) -> tuple[list[str], list[BookingAttempt]]:
         """
-    )
+        Сверяет выбранное время со свежими слотами до записи: (что записывать, отказы «слот занят» с альтернативами).
+        Если свежих данных получить не удалось — ничего не отсекаем, решит сама запись.
+        """
+        cached = SLOTS_CACHE.get(url, sids, target_date, max_age=SLOT_PRECHECK_MAX_AGE)
+        if cached:
+            available = cached[0]
+        else:
+            try:
+                res = await self.get_times(uid, url, sids, target_date)
+            except JobCancelled:
+                return list(times), []
+            if res.status == "ERROR" or res.cached_age_sec is not None:
+                return list(times), []
+            available = res.times
+
+        free = set(available)
+        others = [a for a in available if a not in times]
+        to_book, taken = [], []
+        for t in times:
+            if t in free:
+                to_book.append(t)
+                continue
+            alts = tuple(nearest_times(t, others))
+            msg = "Слот уже занят"
+            if alts:
+                msg += f" — ближайшие свободные: {', '.join(alts)}"
+            taken.append(BookingAttempt(time=t, ok=False, message=msg, alternatives=alts))
+        return to_book, taken
 
 
-def cabinet_open_my_records_with_driver(driver) -> RecordsResult:
-    last_url = None
-    for u in MY_RECORDS_URLS:
-        last_url = u
+class SeleniumBackend(BrowserBackend):
+    """Синхронные сценарии BumpixUserWorker в пуле потоков EXECUTOR."""
+
+    name = "selenium"
+
+    @staticmethod
+    async def _call(kind: str, fn):
+        t0 = time.monotonic()
         try:
-            open_page(driver, u)
-        except Exception:
-            continue
-        time.sleep(0.25)
-        if not looks_like_auth_required(driver):
-            break
+            return await asyncio.wrap_future(EXECUTOR_LOAD.submit(EXECUTOR, fn))
+        finally:
+            JOB_LATENCY.add(kind, time.monotonic() - t0)
 
-    if last_url is None:
-        return RecordsResult(False, [], "Не удалось открыть страницу «Мои записи» (URL не загрузились).")
+    async def get_services(self, uid, url):
+        worker = get_worker(uid)
+        return await self._call("services", lambda: worker.get_services(url))
 
-    if looks_like_auth_required(driver):
-        return RecordsResult(False, [], "Нужна авторизация. Страница записей просит вход.")
+    async def get_times(self, uid, url, sids, target_date):
+        worker = get_worker(uid)
+        return await self._call("times", lambda: worker.get_times(url, sids, target_date))
 
-    recs = js_extract_my_records(driver) or []
-    recs = dedupe_records(recs)
+    async def book_appointments(self, uid, url, sids, target_date, times, comment):
+        worker = get_worker(uid)
+        return await self._call("booking", lambda: worker.book_appointments(url, sids, target_date, list(times), comment))
 
-    if not recs:
-        return RecordsResult(True, [], "Записей не найдено (возможно, их нет).")
+    async def cabinet_login(self, uid, url, phone, password):
+        worker = get_worker(uid)
+        return await self._call("login", lambda: worker.cabinet_login(url, phone, password))
 
-    return RecordsResult(True, recs, f"Найдено записей: {len(recs)}")
+    async def cabinet_register(self, uid, url, name, phone, password, password2):
+        worker = get_worker(uid)
+        return await self._call("register", lambda: worker.cabinet_register(url, name, phone, password, password2))
 
+    async def cabinet_logout(self, uid):
+        return await self._call("logout", get_worker(uid).cabinet_logout)
 
-def cabinet_logout_flow(driver) -> LogoutResult:
-    try:
-        if not looks_like_logged_in(driver) and not verify_records_access(driver):
-            return LogoutResult(True, "Вы уже вышли из аккаунта.")
-    except Exception:
-        pass
+    async def get_my_records(self, uid):
+        return await self._call("records", get_worker(uid).get_my_records)
 
-    ok = False
-    try:
-        ok = cabinet_logout_with_driver(driver)
-    except Exception as e:
-        return LogoutResult(False, f"Ошибка logout: {e}")
+    async def soft_reset(self, uid):
+        return await self._call("reset", get_worker(uid).soft_reset)
 
-    if not ok:
-        return LogoutResult(False, "Не удалось подтвердить выход (кнопка 'Выйти/Logout' не найдена или сессия осталась активной).")
+    def cancel_job(self, uid, kind):
+        with WORKERS_LOCK:
+            w = WORKERS.get(uid)
+        if w:
+            w.cancel_job(kind)
 
-    return LogoutResult(True, "Вы вышли из аккаунта.")
+    async def shutdown(self):
+        # не через EXECUTOR: его потоки могут быть заняты задачами, которые мы как раз останавливаем
+        await asyncio.to_thread(shutdown_workers)
 
 
-# ---------------- Workers: per Telegram user ----------------
-class ServicesCache:
-    def __init__(self):
-        self.lock = RLock()
-        self.by_url: dict[str, list[ServiceItem]] = {}
-        self.ts_by_url: dict[str, float] = {}
-        self.ttl = 10 * 60
+class PlaywrightUserSession:
+    """Браузер пользователя на Playwright: persistent context в его профиле, одна страница, задачи по очереди."""
 
-    def get(self, url: str):
-        with self.lock:
-            now = time.time()
-            items = self.by_url.get(url)
-            ts = self.ts_by_url.get(url, 0.0)
-            if items and (now - ts) < self.ttl:
-                return list(items)
-            return None
+    def __init__(self, backend: "PlaywrightBackend", tg_user_id: int):
+        self.backend = backend
+        self.tg_user_id = tg_user_id
+        self.profile_dir = profile_dir_for(tg_user_id)
+        self.lock = asyncio.Lock()
+        self.context = None
+        self.page = None
+        self.state = PageState()
+        self.jobs: dict[str, tuple[asyncio.Task, CancelToken]] = {}
+
+    async def _ensure_page(self):
+        if self.page is not None and not self.page.is_closed():
+            return self.page
+        if self.context is None:
+            pw = await self.backend.playwright()
+            t0 = time.monotonic()
+            prepare_profile(self.profile_dir)
+            self.context = await pw.chromium.launch_persistent_context(
+                str(self.profile_dir),
+                channel="chrome",
+                headless=HEADLESS,
+                locale="ru-RU",
+                viewport={"width": 1400, "height": 1000},
+                args=[
+                    BOT_CHROME_FLAG,
+                    "--no-sandbox",
+                    "--disable-dev-shm-usage",
+                    "--disable-blink-features=AutomationControlled",
+                    "--blink-settings=imagesEnabled=false",
+                ],
+            )
+            if SUPPRESS_ANIMATIONS:
+                await self.context.add_init_script(JS_NO_ANIMATIONS)
+            if PROFILES_TMPFS_DIR is not None:
+                cookies = load_user_cookies(self.tg_user_id)
+                if cookies:
+                    await self.context.add_cookies([_cookie_param(c) for c in cookies])
+            DRIVER_START_STATS.add(time.monotonic() - t0)
+        self.page = self.context.pages[0] if self.context.pages else await self.context.new_page()
+        self.state.reset()
+        return self.page
+
+    async def save_cookies(self):
+        if PROFILES_TMPFS_DIR is None or self.context is None:
+            return
+        try:
+            cookies = await self.context.cookies()
+        except PlaywrightError as e:
+            logger.info("u_%s: cannot read cookies: %s", self.tg_user_id, e)
+            return
+        save_user_cookies(self.tg_user_id, [_cookie_param(c) for c in cookies])
 
-    def put(self, url: str, items: list[ServiceItem]):
-        with self.lock:
-            self.by_url[url] = list(items)
-            self.ts_by_url[url] = time.time()
+    async def close(self):
+        self.state.reset()
+        await self.save_cookies()
+        context, self.context, self.page = self.context, None, None
+        if context is not None:
+            try:
+                await context.close()
+            except PlaywrightError:
+                pass
+            await asyncio.to_thread(release_profile, self.profile_dir)
 
+    def cancel_job(self, kind: str):
+        if kind not in SUPERSEDABLE_JOBS:
+            return
+        job = self.jobs.get(kind)
+        if job is not None:
+            task, token = job
+            token.cancel()
+            task.cancel()
 
-SERVICES_CACHE = ServicesCache()
+    async def run_job(self, kind: str, fn, on_error=None, budget_sec: Optional[float] = None):
+        """
+        Как BumpixUserWorker._run_job, только fn(token, page) — корутина; бюджет — asyncio.wait_for.
+        Сценарий идёт в своей задаче: вытесняющий запрос отменяет только её, задачу хендлера не трогаем,
+        а у ожидающего это превращается в JobCancelled.
+        """
+        self.cancel_job(kind)
+        token = CancelToken()
+        job = asyncio.ensure_future(self._run_job(kind, fn, on_error, budget_sec, token))
+        self.jobs[kind] = (job, token)
+        t0 = time.monotonic()
+        try:
+            return await job
+        except asyncio.CancelledError:
+            # отменили сам хендлер (остановка приложения) — это не наша отмена, пропускаем дальше;
+            # job при этом отменён тем же await
+            if not token.cancelled:
+                raise
+            raise JobCancelled("Задача отменена более новым запросом.")
+        finally:
+            JOB_LATENCY.add(kind, time.monotonic() - t0)
+            if self.jobs.get(kind, (None,))[0] is job:
+                self.jobs.pop(kind, None)
+
+    async def _run_job(self, kind: str, fn, on_error, budget_sec: Optional[float], token: CancelToken):
+        async with self.lock:
+            token.check()
+            if budget_sec:
+                token.start_budget(budget_sec)
+            try:
+                with PROFILER.job(kind):
+                    return await self._attempt(fn, token)
+            except JobCancelled:
+                raise
+            except PlaywrightError as e:
+                token.check()
+                await self.close()
+                try:
+                    return await self._attempt(fn, token)
+                except JobCancelled:
+                    raise
+                except Exception as e2:
+                    self.state.reset()
+                    if on_error is None:
+                        raise
+                    return on_error(str(e2) or str(e))
+            except Exception:
+                self.state.reset()
+                raise
+            finally:
+                if kind in SESSION_CHANGING_JOBS:
+                    self.state.reset()
+                await self.save_cookies()
+
+    async def _attempt(self, fn, token: CancelToken):
+        page = await self._ensure_page()
+        rem = token.remaining()
+        if rem is None:
+            return await fn(token, page)
+        try:
+            return await asyncio.wait_for(fn(token, page), rem)
+        except asyncio.TimeoutError:
+            token.enter(token.stage)
+            raise DeadlineExceeded(token.stage, token.budget_sec, token.stage_times)
 
 
-class BumpixUserWorker:
-    def __init__(self, tg_user_id: int):
-        self.tg_user_id = tg_user_id
-        self.lock = RLock()
-        self.driver = None
-        self.profile_dir = PROFILES_DIR / f"u_{tg_user_id}"
+class PlaywrightBackend(BrowserBackend):
+    """async-сценарии на Playwright в event loop бота: без потоков и без переходов loop ↔ executor."""
 
-    def _ensure_driver(self):
-        if self.driver is None:
-            self.driver = make_driver(headless=HEADLESS, profile_dir=self.profile_dir)
+    name = "playwright"
 
-    def reset_driver(self):
+    def __init__(self):
+        self._pw = None
+        self._pw_lock = asyncio.Lock()
+        self._booking_browser = None
+        self.sessions: dict[int, PlaywrightUserSession] = {}
+
+    async def playwright(self):
+        async with self._pw_lock:
+            if self._pw is None:
+                self._pw = await async_playwright().start()
+            return self._pw
+
+    async def booking_browser(self):
+        """Общий браузер для клонов сессий при параллельной записи (в persistent context новый не создать)."""
+        pw = await self.playwright()
+        async with self._pw_lock:
+            if self._booking_browser is None or not self._booking_browser.is_connected():
+                self._booking_browser = await pw.chromium.launch(
+                    channel="chrome", headless=HEADLESS, args=[BOT_CHROME_FLAG, "--no-sandbox", "--disable-dev-shm-usage"]
+                )
+            return self._booking_browser
+
+    @staticmethod
+    async def _book_one(page, url, sids, target_date, t, comment, token: CancelToken, state: PageState) -> BookingAttempt:
+        # у каждого слота свой бюджет: проверка после его перезапуска ловит только отмену задачи
+        token.start_budget(BOOKING_DEADLINE_SEC)
+        token.check()
         try:
-            if self.driver:
-                self.driver.quit()
-        except Exception:
-            pass
-        self.driver = None
+            return await asyncio.wait_for(pw_book_appointment_flow(page, url, sids, target_date, t, comment, token, state), BOOKING_DEADLINE_SEC)
+        except asyncio.TimeoutError:
+            token.enter(token.stage)
+            return BookingAttempt(time=t, ok=False, message=str(DeadlineExceeded(token.stage, BOOKING_DEADLINE_SEC, token.stage_times)))
+        except DeadlineExceeded as e:
+            return BookingAttempt(time=t, ok=False, message=str(e))
+
+    async def _book_parallel(self, storage_state: dict, url, sids, target_date, times, comment, token: CancelToken) -> list[BookingAttempt]:
+        browser = await self.booking_browser()
+        slots = asyncio.Semaphore(BOOKING_CONTEXTS)
+
+        async def one(t):
+            async with slots:
+                ctx = await browser.new_context(storage_state=storage_state, locale="ru-RU", viewport={"width": 1400, "height": 1000})
+                try:
+                    if SUPPRESS_ANIMATIONS:
+                        await ctx.add_init_script(JS_NO_ANIMATIONS)
+                    return await self._book_one(await ctx.new_page(), url, sids, target_date, t, comment, token.child(), PageState())
+                finally:
+                    await ctx.close()
 
-    def get_services(self, url: str):
+        return list(await asyncio.gather(*(one(t) for t in times)))
+
+    def session(self, uid: int) -> PlaywrightUserSession:
+        s = self.sessions.get(uid)
+        if s is None:
+            s = self.sessions[uid] = PlaywrightUserSession(self, uid)
+        return s
+
+    async def get_services(self, uid, url):
         cached = SERVICES_CACHE.get(url)
         if cached:
             return cached
-        with self.lock:
-            self._ensure_driver()
-            try:
-                services = bumpix_get_services_with_driver(self.driver, url)
-            except (WebDriverException, StaleElementReferenceException):
-                self.reset_driver()
-                self._ensure_driver()
-                services = bumpix_get_services_with_driver(self.driver, url)
-            SERVICES_CACHE.put(url, services)
+
+        async def job(token, page):
+            s.state.reset()
+            services = await pw_get_services(page, url, token)
+            s.state.url = url
             return services
 
-    def get_times(self, url: str, sids, target_date: date) -> TimesResult:
-        with self.lock:
-            self._ensure_driver()
-            try:
-                return get_times_for_selection(self.driver, url, sids, target_date)
-            except (WebDriverException, StaleElementReferenceException) as e:
-                self.reset_driver()
-                self._ensure_driver()
-                try:
-                    return get_times_for_selection(self.driver, url, sids, target_date)
-                except Exception as e2:
-                    return TimesResult(status="ERROR", times=[], error=str(e2) or str(e))
+        s = self.session(uid)
+        services = await s.run_job("services", job)
+        SERVICES_CACHE.put(url, services)
+        return services
 
-    def book_appointments(self, url: str, sids, target_date: date, times: list[str], comment: str) -> list[BookingAttempt]:
-        with self.lock:
-            self._ensure_driver()
+    async def get_times(self, uid, url, sids, target_date):
+        breaker = BREAKERS.get(url)
+        fallback = breaker_fallback_times(breaker, url, sids, target_date)
+        if fallback is not None:
+            return fallback
+
+        s = self.session(uid)
+        try:
+            result = await s.run_job(
+                "times",
+                lambda token, page: pw_get_times_for_selection(page, url, sids, target_date, token, s.state),
+                lambda err: TimesResult(status="ERROR", times=[], error=err),
+                budget_sec=TIMES_DEADLINE_SEC,
+            )
+        except DeadlineExceeded as e:
+            return TimesResult(status="ERROR", times=[], error=e.describe())
+        finally:
+            breaker.release_probe()
+
+        if result.status in ("OK", "EMPTY"):
+            SLOTS_CACHE.put(url, sids, target_date, result.times)
+        return result
+
+    async def book_appointments(self, uid, url, sids, target_date, times, comment):
+        s = self.session(uid)
+
+        async def job(token, page):
+            if PARALLEL_BOOKING and len(times) > 1:
+                return await self._book_parallel(await s.context.storage_state(), url, sids, target_date, times, comment, token)
             out: list[BookingAttempt] = []
             for t in times:
-                try:
-                    out.append(book_appointment_flow(self.driver, url, sids, target_date, t, comment))
-                except (WebDriverException, StaleElementReferenceException) as e:
-                    self.reset_driver()
-                    self._ensure_driver()
-                    try:
-                        out.append(book_appointment_flow(self.driver, url, sids, target_date, t, comment))
-                    except Exception as e2:
-                        out.append(BookingAttempt(time=t, ok=False, message=str(e2) or str(e)))
+                out.append(await self._book_one(page, url, sids, target_date, t, comment, token, s.state))
             return out
 
-    def cabinet_login(self, url: str, phone: str, password: str) -> AuthResult:
-        with self.lock:
-            self._ensure_driver()
-            try:
-                return cabinet_login_with_driver(self.driver, url, phone, password)
-            except (WebDriverException, StaleElementReferenceException) as e:
-                self.reset_driver()
-                self._ensure_driver()
-                try:
-                    return cabinet_login_with_driver(self.driver, url, phone, password)
-                except Exception as e2:
-                    return AuthResult(False, str(e2) or str(e), verified_records=False)
-
-    def cabinet_register(self, url: str, name: str, phone: str, password: str, password2: str) -> AuthResult:
-        with self.lock:
-            self._ensure_driver()
-            try:
-                return cabinet_register_with_driver(self.driver, url, name, phone, password, password2)
-            except (WebDriverException, StaleElementReferenceException) as e:
-                self.reset_driver()
-                self._ensure_driver()
-                try:
-                    return cabinet_register_with_driver(self.driver, url, name, phone, password, password2)
-                except Exception as e2:
-                    return AuthResult(False, str(e2) or str(e), verified_records=False)
-
-    def get_my_records(self) -> RecordsResult:
-        with self.lock:
-            self._ensure_driver()
-            try:
-                return cabinet_open_my_records_with_driver(self.driver)
-            except (WebDriverException, StaleElementReferenceException) as e:
-                self.reset_driver()
-                self._ensure_driver()
-                try:
-                    return cabinet_open_my_records_with_driver(self.driver)
-                except Exception as e2:
-                    return RecordsResult(False, [], str(e2) or str(e))
+        return await s.run_job("booking", job)
 
-    def cabinet_logout(self) -> LogoutResult:
-        with self.lock:
-            self._ensure_driver()
-            try:
-                return cabinet_logout_flow(self.driver)
-            except (WebDriverException, StaleElementReferenceException) as e:
-                self.reset_driver()
-                self._ensure_driver()
-                try:
-                    return cabinet_logout_flow(self.driver)
-                except Exception as e2:
-                    return LogoutResult(False, str(e2) or str(e))
+    async def cabinet_login(self, uid, url, phone, password):
+        return await self.session(uid).run_job(
+            "login",
+            lambda token, page: pw_cabinet_login(page, url, phone, password),
+            lambda err: AuthResult(False, err, verified_records=False),
+        )
 
+    async def cabinet_register(self, uid, url, name, phone, password, password2):
+        return await self.session(uid).run_job(
+            "register",
+            lambda token, page: pw_cabinet_register(page, url, name, phone, password, password2),
+            lambda err: AuthResult(False, err, verified_records=False),
+        )
 
-WORKERS: dict[int, BumpixUserWorker] = {}
-WORKERS_LOCK = RLock()
+    async def cabinet_logout(self, uid):
+        s = self.session(uid)
+        return await s.run_job(
+            "logout",
+            lambda token, page: pw_cabinet_logout(s.context, page),
+            lambda err: LogoutResult(False, err),
+        )
 
+    async def get_my_records(self, uid):
+        return await self.session(uid).run_job(
+            "records",
+            lambda token, page: pw_open_my_records(page, token),
+            lambda err: RecordsResult(False, [], err),
+        )
 
-def get_worker_for_update(update: Update) -> BumpixUserWorker:
-    uid = update.effective_user.id
-    with WORKERS_LOCK:
-        w = WORKERS.get(uid)
-        if not w:
-            w = BumpixUserWorker(uid)
-            WORKERS[uid] = w
-        return w
+    async def soft_reset(self, uid):
+        s = self.session(uid)
+        t0 = time.monotonic()
+        async with s.lock:
+            if s.context is None:
+                return ResetResult(soft=True, elapsed_sec=0.0)
+            try:
+                for extra in s.context.pages[1:]:
+                    await extra.close()
+                page = await s._ensure_page()
+                await page.goto("about:blank")
+                await pw_clear_site_data(s.context, page, "all")
+            except PlaywrightError as e:
+                logger.info("soft reset u_%s failed, closing browser: %s", uid, e)
+                await s.close()
+                return ResetResult(soft=False, elapsed_sec=time.monotonic() - t0)
+            elapsed = time.monotonic() - t0
+            avg = DRIVER_START_STATS.avg()
+            return ResetResult(soft=True, elapsed_sec=elapsed, saved_sec=(avg - elapsed) if avg is not None else None)
+
+    def cancel_job(self, uid, kind):
+        s = self.sessions.get(uid)
+        if s:
+            s.cancel_job(kind)
+
+    async def shutdown(self):
+        for s in list(self.sessions.values()):
+            await s.close()
+        if self._booking_browser is not None:
+            await self._booking_browser.close()
+            self._booking_browser = None
+        if self._pw is not None:
+            await self._pw.stop()
+            self._pw = None
+
+
+def make_backend() -> BrowserBackend:
+    if BROWSER_BACKEND == "playwright":
+        if async_playwright is None:
+            raise RuntimeError("BROWSER_BACKEND = 'playwright', но пакет playwright не установлен (pip install playwright).")
+        return PlaywrightBackend()
+    return SeleniumBackend()
+
+
+BACKEND = make_backend()
 
 
 # ---------------- UI: rooms/services/calendar/times ----------------
@@ -1996,9 +5686,7 @@ async def cabinet_receive_text(update: Update, context: ContextTypes.DEFAULT_TYP
             phone = data.get("phone")
             password = data.get("password")
 
-            worker = get_worker_for_update(update)
-            loop = asyncio.get_running_loop()
-            result: AuthResult = await loop.run_in_executor(EXECUTOR, lambda: worker.cabinet_login(CABINET_URL, phone, password))
+            result: AuthResult = await BACKEND.cabinet_login(update.effective_user.id, CABINET_URL, phone, password)
 
             context.user_data.pop("cabinet", None)
             if result.ok:
@@ -2050,11 +5738,7 @@ async def cabinet_receive_text(update: Update, context: ContextTypes.DEFAULT_TYP
             password = data.get("password")
             password2 = data.get("password2")
 
-            worker = get_worker_for_update(update)
-            loop = asyncio.get_running_loop()
-            result: AuthResult = await loop.run_in_executor(
-                EXECUTOR, lambda: worker.cabinet_register(CABINET_URL, name, phone, password, password2)
-            )
+            result: AuthResult = await BACKEND.cabinet_register(update.effective_user.id, CABINET_URL, name, phone, password, password2)
 
             context.user_data.pop("cabinet", None)
             if result.ok:
@@ -2085,6 +5769,103 @@ async def cancel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Отменено. Выберите комнату:", reply_markup=room_keyboard(context))
 
 
+def is_admin(update: Update) -> bool:
+    return bool(ADMIN_CHAT_ID) and update.effective_chat is not None and update.effective_chat.id == ADMIN_CHAT_ID
+
+
+async def driverstats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        return
+    if context.args and context.args[0] == "reset":
+        DRIVER_PROFILER.reset()
+        await update.message.reply_text("Сводка WebDriver-команд сброшена.")
+        return
+    await update.message.reply_text(DRIVER_PROFILER.report()[:3900])
+
+
+def chrome_usage() -> Optional[tuple[int, int]]:
+    """(число процессов Chrome, суммарный RSS в байтах) среди потомков бота; None — без psutil."""
+    if psutil is None:
+        return None
+    count = rss = 0
+    for proc in psutil.Process().children(recursive=True):
+        try:
+            if "chrom" not in proc.name().lower():
+                continue
+            count += 1
+            rss += proc.memory_info().rss
+        except psutil.Error:
+            continue
+    return count, rss
+
+
+def _fmt_ratio(r: Optional[float]) -> str:
+    return "—" if r is None else f"{r * 100:.0f}%"
+
+
+def render_stats(app: Application) -> str:
+    lines = [f"Бэкенд: {BACKEND.name}, режим апдейтов: {UPDATE_MODE}"]
+    usage = chrome_usage()
+    if usage is None:
+        lines.append("Chrome: нет psutil")
+    else:
+        lines.append(f"Chrome: {usage[0]} процессов, RSS {usage[1] / 2**20:.0f} МБ")
+    with WORKERS_LOCK:
+        lines.append(f"WORKERS: {len(WORKERS)}")
+    proc = app.update_processor
+    queued = proc.queued() if isinstance(proc, PerUserUpdateProcessor) else 0
+    lines.append(
+        f"Очереди: executor {EXECUTOR_LOAD.queued()} ждут / {EXECUTOR_LOAD.running()} в работе, "
+        f"update_queue {app.update_queue.qsize()}, "
+        f"ждут своей очереди у пользователя {queued}"
+    )
+    lines.append(f"Кэш: услуги {_fmt_ratio(SERVICES_CACHE.stats.ratio())}, слоты {_fmt_ratio(SLOTS_CACHE.stats.ratio())}")
+    lines.append("")
+    lines.append("За последний час (p50 / p95 / p99):")
+    for kind, title in (("times", "слоты"), ("booking", "запись"), ("login", "вход"), ("records", "мои записи")):
+        n, ps = JOB_LATENCY.percentiles(kind)
+        if n:
+            covered = JOB_LATENCY.covered_sec(kind)
+            window = f", за {covered / 60:.0f} мин" if covered < JOB_LATENCY.window_sec else ""
+            lines.append(f"- {title}: {ps[0]:.1f} / {ps[1]:.1f} / {ps[2]:.1f} с (n={n}{window})")
+        else:
+            lines.append(f"- {title}: нет данных")
+    return "\n".join(lines)
+
+
+PROFILE_USAGE = "/profile cb N | /profile job <services|times|booking|login|records|...> N | /profile off"
+
+
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        return
+    args = context.args or []
+    if args[:1] == ["off"]:
+        PROFILER.disarm()
+        await update.message.reply_text("Профилирование выключено.")
+        return
+    try:
+        if args[:1] == ["cb"]:
+            target, kind, n = "cb", None, int(args[1]) if len(args) > 1 else 1
+        elif args[:1] == ["job"] and len(args) >= 2:
+            target, kind, n = "job", args[1], int(args[2]) if len(args) > 2 else 1
+        else:
+            raise ValueError
+    except ValueError:
+        state = f"взведено: {PROFILER.target}, осталось {PROFILER.left}" if PROFILER.left else "выключено"
+        await update.message.reply_text(f"{PROFILE_USAGE}\nСейчас: {state}")
+        return
+    PROFILER.arm(target, kind, max(1, min(n, 50)), context.bot)
+    what = "cb" if target == "cb" else f"задачи «{kind}»"
+    await update.message.reply_text(f"Профилирую следующие {max(1, min(n, 50))} вызова(ов) {what}; отчёты придут файлами.")
+
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        return
+    await update.message.reply_text(render_stats(context.application))
+
+
 # ---------------- callback handler ----------------
 async def cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
@@ -2132,9 +5913,7 @@ async def cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         await q.edit_message_text("⏳ Выполняю выход из аккаунта...")
 
-        worker = get_worker_for_update(update)
-        loop = asyncio.get_running_loop()
-        res: LogoutResult = await loop.run_in_executor(EXECUTOR, lambda: worker.cabinet_logout())
+        res: LogoutResult = await BACKEND.cabinet_logout(update.effective_user.id)
 
         if res.ok:
             set_logged_out(context)
@@ -2145,10 +5924,15 @@ async def cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "reset_web":
-        worker = get_worker_for_update(update)
-        worker.reset_driver()
+        res: ResetResult = await BACKEND.soft_reset(update.effective_user.id)
         set_logged_out(context)
-        await q.edit_message_text("✅ Веб-сессия сброшена (Chrome перезапущен).", reply_markup=room_keyboard(context))
+        if not res.soft:
+            text = "✅ Веб-сессия сброшена (Chrome перезапущен)."
+        elif res.saved_sec is not None and res.saved_sec > 0:
+            text = f"✅ Веб-сессия сброшена без перезапуска Chrome за {res.elapsed_sec:.1f} с (быстрее на ~{res.saved_sec:.1f} с)."
+        else:
+            text = f"✅ Веб-сессия сброшена без перезапуска Chrome за {res.elapsed_sec:.1f} с."
+        await q.edit_message_text(text, reply_markup=room_keyboard(context))
         return
 
     if data == "rooms":
@@ -2169,9 +5953,10 @@ async def cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         await q.edit_message_text("⏳ Загружаю ваши записи...")
 
-        worker = get_worker_for_update(update)
-        loop = asyncio.get_running_loop()
-        res: RecordsResult = await loop.run_in_executor(EXECUTOR, lambda: worker.get_my_records())
+        try:
+            res: RecordsResult = await BACKEND.get_my_records(update.effective_user.id)
+        except JobCancelled:
+            return
 
         if not res.ok:
             if ("авторизац" in (res.message or "").lower()) or ("auth" in (res.message or "").lower()):
@@ -2224,9 +6009,10 @@ async def cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         await q.edit_message_text("Загружаю услуги…")
 
-        worker = get_worker_for_update(update)
-        loop = asyncio.get_running_loop()
-        services = await loop.run_in_executor(EXECUTOR, lambda: worker.get_services(url))
+        try:
+            services = await BACKEND.get_services(update.effective_user.id, url)
+        except JobCancelled:
+            return
 
         context.user_data["services"] = services
         context.user_data["sel"] = set()
@@ -2376,14 +6162,22 @@ async def cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         await q.edit_message_text("Ищу свободные слоты…")
 
-        worker = get_worker_for_update(update)
-        loop = asyncio.get_running_loop()
-        result: TimesResult = await loop.run_in_executor(EXECUTOR, lambda: worker.get_times(url, sids, target))
+        try:
+            result: TimesResult = await BACKEND.get_times(update.effective_user.id, url, sids, target)
+        except JobCancelled:
+            # пользователь уже выбрал другую дату — результат никому не нужен
+            return
 
         header = " + ".join(titles[:2])
         if len(titles) > 2:
             header += f" (+{len(titles)-2} ещё)"
         pretty_date = target.strftime("%d.%m.%Y")
+        stale_note = ""
+        if result.cached_age_sec is not None:
+            stale_note = (
+                "⚠️ Bumpix сейчас отвечает ошибкой, показаны слоты из кэша "
+                f"(обновлены ~{max(1, round(result.cached_age_sec / 60))} мин назад).\n\n"
+            )
 
         if result.status == "OK" and result.times:
             context.user_data["last_times"] = result.times
@@ -2400,13 +6194,14 @@ async def cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             text = (
                 f"{ROOMS[room_key]['title']}\n{header}\n\n"
                 f"Дата: {pretty_date}\n\n"
+                f"{stale_note}"
                 "Выберите время:"
             )
             await q.edit_message_text(text, reply_markup=times_keyboard(result.times, iso, room_key, context, selected_times=chosen_sorted))
             return
 
         if result.status == "EMPTY":
-            text = f"{ROOMS[room_key]['title']}\n{header}\n\nДата: {pretty_date}\n\nНет свободных слотов."
+            text = f"{ROOMS[room_key]['title']}\n{header}\n\nДата: {pretty_date}\n\n{stale_note}Нет свободных слотов."
         else:
             msg = result.error or "Не удалось получить актуальные слоты. Попробуйте ещё раз."
             text = f"{ROOMS[room_key]['title']}\n{header}\n\nДата: {pretty_date}\n\n{msg}"
@@ -2599,11 +6394,14 @@ async def any_message_router(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return
 
         await msg.reply_text("⏳ Пытаюсь записать...")
-        worker = get_worker_for_update(update)
-        loop = asyncio.get_running_loop()
-        attempts: list[BookingAttempt] = await loop.run_in_executor(
-            EXECUTOR, lambda: worker.book_appointments(url, sids, target, list(times), comment)
-        )
+        uid = update.effective_user.id
+        to_book, attempts = await BACKEND.precheck_times(uid, url, sids, target, list(times))
+        if to_book:
+            attempts += await BACKEND.book_appointments(uid, url, sids, target, to_book, comment)
+        attempts.sort(key=lambda a: times.index(a.time) if a.time in times else len(times))
+        if to_book:
+            # неподтверждённая запись тоже могла пройти — кэш слотов больше не верен
+            SLOTS_CACHE.invalidate(url, sids, target)
 
         ok_list = [a for a in attempts if a.ok]
         bad_list = [a for a in attempts if not a.ok]
@@ -2628,22 +6426,153 @@ async def any_message_router(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
 
+# ---------------- concurrent updates (per-user ordering) ----------------
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Апдейты разных пользователей обрабатываются параллельно (не больше max_concurrent_updates),
+    апдейты одного пользователя — строго в порядке поступления, чтобы context.user_data не ломался.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._pending: dict[int, int] = {}
+
+    @staticmethod
+    def _user_key(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        # очередь пользователя — до глобального семафора (его берёт super().process_update): апдейт, ждущий
+        # предыдущий апдейт того же пользователя, не занимает слот, и частые нажатия одного не тормозят остальных
+        key = self._user_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        supersede_jobs_for_update(update)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        self._pending[key] = self._pending.get(key, 0) + 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self._pending[key] -= 1
+            if self._pending[key] <= 0:
+                self._pending.pop(key, None)
+                self._locks.pop(key, None)
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    def queued(self) -> int:
+        """Апдейты, ждущие завершения предыдущего апдейта того же пользователя."""
+        return sum(max(0, n - 1) for n in self._pending.values())
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
 # ---------------- errors ----------------
 async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
     logger.exception("Unhandled error: %s", context.error)
 
 
+# ---------------- health route ----------------
+if tornado is not None:
+
+    class HealthHandler(tornado.web.RequestHandler):
+        def initialize(self, app: Application):
+            self.app = app
+
+        def get(self):
+            with WORKERS_LOCK:
+                workers = len(WORKERS)
+            self.set_header("Cache-Control", "no-store")
+            self.write(
+                {
+                    "ok": bool(self.app.running),
+                    "mode": UPDATE_MODE,
+                    "backend": BACKEND.name,
+                    "workers": workers,
+                    "update_queue": self.app.update_queue.qsize(),
+                }
+            )
+
+
+def start_health_server(app: Application):
+    if HEALTH_PORT is None:
+        return None
+    if tornado is None:
+        logger.warning("tornado is not installed, /healthz is disabled (pip install 'python-telegram-bot[webhooks]')")
+        return None
+    web = tornado.web.Application([(r"/healthz", HealthHandler, {"app": app})])
+    server = web.listen(HEALTH_PORT, address=HEALTH_LISTEN)
+    logger.info("health route: http://%s:%s/healthz", HEALTH_LISTEN, HEALTH_PORT)
+    return server
+
+
 # ---------------- main ----------------
+async def post_init(app: Application):
+    app.bot_data["health_server"] = start_health_server(app)
+
+
+async def post_shutdown(app: Application):
+    server = app.bot_data.pop("health_server", None)
+    if server is not None:
+        server.stop()
+    await BACKEND.shutdown()
+
+
+def run_webhook(app: Application):
+    # апдейты без этого заголовка (не от Telegram) PTB отбивает с 403 ещё до очереди
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    app.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        secret_token=secret,
+        cert=WEBHOOK_CERT,
+        key=WEBHOOK_KEY,
+        allowed_updates=Update.ALL_TYPES,
+    )
+
+
 def main():
-    app = Application.builder().token("TOKEN").build()
+    reap_orphaned_chrome()
+    maintain_profiles()
+    refresh_asset_cache_async()
+    app = (
+        Application.builder()
+        .token("TOKEN")
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start_cmd))
     app.add_handler(CommandHandler("feedback", feedback_start))
     app.add_handler(CommandHandler("cabinet", cabinet_start))
     app.add_handler(CommandHandler("cancel", cancel_cmd))
-    app.add_handler(CallbackQueryHandler(cb))
+    app.add_handler(CommandHandler("driverstats", driverstats_cmd))
+    app.add_handler(CommandHandler("stats", stats_cmd))
+    app.add_handler(CommandHandler("profile", profile_cmd))
+    app.add_handler(CallbackQueryHandler(profiled_handler(cb)))
     app.add_handler(MessageHandler((filters.TEXT | filters.PHOTO | filters.Document.ALL) & (~filters.COMMAND), any_message_router))
     app.add_error_handler(on_error)
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    if UPDATE_MODE == "webhook":
+        run_webhook(app)
+    else:
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,74 @@
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(scope="session")
+def bot(tmp_path_factory):
+    """Модуль botfile без сети: chromedriver берём из PATH/CHROMEDRIVER, профили — во временном каталоге."""
+    pytest.importorskip("telegram")
+    pytest.importorskip("selenium")
+    wdm = pytest.importorskip("webdriver_manager.chrome")
+    mp = pytest.MonkeyPatch()
+    # botfile при импорте качает chromedriver через webdriver_manager
+    mp.setattr(wdm.ChromeDriverManager, "install", lambda self: os.environ.get("CHROMEDRIVER", "chromedriver"))
+    # PROFILES_DIR = ./chrome_profiles считается при импорте
+    mp.chdir(tmp_path_factory.mktemp("bot"))
+    mp.syspath_prepend(str(ROOT))
+    import botfile
+
+    yield botfile
+    mp.undo()
+    sys.modules.pop("botfile", None)
+
+
+@pytest.fixture(scope="session")
+def site():
+    """Локальный стенд комнаты Bumpix (tests/fixture_site.py)."""
+    from fixture_site import FixtureSite
+
+    s = FixtureSite().start()
+    yield s
+    s.stop()
+
+
+@pytest.fixture(scope="session")
+def chrome(bot):
+    """Нужен настоящий Chrome и chromedriver — без них браузерные тесты пропускаются."""
+    if not shutil.which(bot.CHROMEDRIVER_PATH):
+        pytest.skip("chromedriver не найден (PATH или CHROMEDRIVER)")
+    return bot
+
+
+@pytest.fixture
+def fresh_bot(chrome, site, monkeypatch):
+    """botfile с чистыми воркерами и кэшами; комнаты стенда вместо живых, без фоновой сборки кэша статики."""
+    bot = chrome
+    site.reset()
+    monkeypatch.setattr(bot, "ASSET_CACHE", False)
+    monkeypatch.setattr(bot, "ROOMS", {"blue": {"title": "Стенд", "url": site.room_url()}})
+    monkeypatch.setattr(bot, "WORKERS", {})
+    monkeypatch.setattr(bot, "SHARED_CHROMES_POOL", bot.SharedChromePool())
+    monkeypatch.setattr(bot, "SERVICES_CACHE", bot.ServicesCache())
+    monkeypatch.setattr(bot, "SLOTS_CACHE", bot.SlotsCache())
+    monkeypatch.setattr(bot, "BREAKERS", bot.BreakerRegistry())
+    yield bot
+    bot.shutdown_workers()
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "bench: замер на стенде с настоящим Chrome; запускается с BUMPIX_BENCH=1")
+
+
+def pytest_collection_modifyitems(config, items):
+    if os.environ.get("BUMPIX_BENCH") == "1":
+        return
+    skip = pytest.mark.skip(reason="замеры запускаются с BUMPIX_BENCH=1")
+    for item in items:
+        if "bench" in item.keywords:
+            item.add_marker(skip)
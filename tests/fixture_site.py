@@ -0,0 +1,266 @@
+"""
+Локальный стенд Bumpix для тестов и замеров: комната с услугами, календарь, #timeBlocks из XHR, запись.
+Разметка и селекторы — те, на которые опираются сценарии botfile (Selenium и Playwright).
+Хост bumpix.localhost: Chrome сам резолвит *.localhost в 127.0.0.1, а "bumpix" в URL нужен is_slots_xhr/is_booking_post.
+"""
+
+import json
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SERVICES = [
+    ("101", "Репетиция", "1 ч", "500 ₽"),
+    ("102", "Запись вокала", "2 ч", "1500 ₽"),
+    ("103", "Сведение", "1 ч", "1000 ₽"),
+]
+SLOT_TIMES = ["10:00", "11:30", "13:00", "15:30"]
+
+ROOM_HTML = """<!doctype html>
+<html lang="ru"><head><meta charset="utf-8"><title>Стенд комнаты</title>
+<link rel="stylesheet" href="/static/app.css?v=1">
+<script src="/static/app.js?v=1" defer></script>
+</head><body>
+<div id="services">{services}</div>
+<button type="button" class="btn btn-orange" id="chooseTime" disabled>Выбрать время</button>
+<div class="picker_calendar"><div class="datepicker-days"><table>
+<thead><tr><th class="prev">&lsaquo;</th><th class="switch" colspan="5"></th><th class="next">&rsaquo;</th></tr></thead>
+<tbody></tbody></table></div></div>
+<div id="timeBlocks"></div>
+<div id="appointmentControls">
+<textarea name="comment" placeholder="Комментарий"></textarea>
+<button type="button" class="btn btn-purple mar_top_10" id="appointmentButton">Записаться</button>
+</div>
+<div id="result"></div>
+</body></html>
+"""
+
+SERVICE_HTML = (
+    '<div class="masterServiceItem"><label class="btn"><input type="checkbox" data-service-id="{sid}">'
+    '<span class="msnBody">{name}</span></label><span class="sDuration">{duration}</span>'
+    '<span class="sCost">{cost}</span></div>'
+)
+
+# анимации как у живого сайта: появление календаря, слотов и панели записи, плавная прокрутка
+APP_CSS = """
+html { scroll-behavior: smooth; }
+.picker_calendar, #appointmentControls { display: none; opacity: 0; transition: opacity .4s ease; }
+.picker_calendar.open, #appointmentControls.open { display: block; }
+.picker_calendar.shown, #appointmentControls.shown { opacity: 1; }
+td.day { padding: 4px 8px; cursor: pointer; }
+td.day.old, td.day.new, td.day.disabled { color: #bbb; }
+#timeBlocks label { display: inline-block; margin: 4px; padding: 6px 10px; border: 1px solid #ccc;
+  opacity: 0; transform: translateY(8px); transition: opacity .35s ease, transform .35s ease; }
+#timeBlocks label.shown { opacity: 1; transform: none; }
+#timeBlocks label.slot-hidden { display: none; }
+#appointmentControls textarea { width: 300px; height: 60px; }
+"""
+
+APP_JS = r"""
+(() => {
+  const $ = (s) => document.querySelector(s);
+  const state = {y: 0, m: 0, date: null, time: null};
+  const today = new Date();
+  const todayUtc = Date.UTC(today.getFullYear(), today.getMonth(), today.getDate());
+  state.y = today.getFullYear(); state.m = today.getMonth();
+
+  const show = (el) => {
+    el.classList.add('open');
+    requestAnimationFrame(() => requestAnimationFrame(() => el.classList.add('shown')));
+  };
+  const selectedServices = () => Array.from(document.querySelectorAll('input[data-service-id]'))
+    .filter((i) => i.checked).map((i) => i.getAttribute('data-service-id'));
+
+  document.addEventListener('change', (e) => {
+    if (e.target.matches('input[data-service-id]')) $('#chooseTime').disabled = selectedServices().length === 0;
+  });
+
+  function renderMonth() {
+    const first = new Date(Date.UTC(state.y, state.m, 1));
+    const start = Date.UTC(state.y, state.m, 1 - ((first.getUTCDay() + 6) % 7));
+    $('.picker_calendar th.switch').textContent = `${state.m + 1}.${state.y}`;
+    const rows = [];
+    for (let w = 0; w < 6; w++) {
+      const cells = [];
+      for (let d = 0; d < 7; d++) {
+        const ms = start + (w * 7 + d) * 86400000;
+        const dt = new Date(ms);
+        const cls = ['day'];
+        if (dt.getUTCMonth() !== state.m) cls.push(dt < first ? 'old' : 'new');
+        else if (ms < todayUtc) cls.push('disabled');
+        if (state.date === ms) cls.push('active');
+        cells.push(`<td class="${cls.join(' ')}" data-date="${ms}">${dt.getUTCDate()}</td>`);
+      }
+      rows.push(`<tr>${cells.join('')}</tr>`);
+    }
+    $('.picker_calendar tbody').innerHTML = rows.join('');
+  }
+
+  $('#chooseTime').addEventListener('click', () => { renderMonth(); show($('.picker_calendar')); });
+  $('.picker_calendar').addEventListener('click', (e) => {
+    const th = e.target.closest('th.prev, th.next');
+    if (th) {
+      state.m += th.classList.contains('next') ? 1 : -1;
+      if (state.m > 11) { state.m = 0; state.y++; }
+      if (state.m < 0) { state.m = 11; state.y--; }
+      renderMonth();
+      return;
+    }
+    const td = e.target.closest('td.day');
+    if (!td || /old|new|disabled/.test(td.className)) return;
+    state.date = Number(td.getAttribute('data-date'));
+    renderMonth();
+    loadSlots();
+  });
+
+  async function loadSlots() {
+    const tb = $('#timeBlocks');
+    tb.innerHTML = '<div class="placeholder">...</div>';
+    const iso = new Date(state.date).toISOString().slice(0, 10);
+    const res = await fetch(`/api/timeblocks?date=${iso}&services=${selectedServices().join(',')}`);
+    const data = await res.json();
+    tb.innerHTML = data.html;
+    requestAnimationFrame(() => requestAnimationFrame(() =>
+      tb.querySelectorAll('label').forEach((l) => l.classList.add('shown'))));
+  }
+
+  $('#timeBlocks').addEventListener('click', (e) => {
+    const label = e.target.closest('label');
+    if (!label || label.classList.contains('disabled')) return;
+    state.time = label.textContent.trim();
+    show($('#appointmentControls'));
+  });
+
+  $('#appointmentButton').addEventListener('click', async () => {
+    const res = await fetch('/api/appointment', {
+      method: 'POST',
+      headers: {'Content-Type': 'application/json'},
+      body: JSON.stringify({
+        date: new Date(state.date).toISOString().slice(0, 10), time: state.time,
+        services: selectedServices(), comment: $('#appointmentControls textarea').value,
+      }),
+    });
+    const data = await res.json();
+    const ok = !!data.success;
+    $('#result').innerHTML = `<div class="alert ${ok ? 'alert-success' : 'alert-danger'}">${ok ? data.message : data.error}</div>`;
+  });
+})();
+"""
+
+
+class FixtureSite:
+    """
+    Стенд в фоновом потоке. Слоты: SLOT_TIMES минус уже записанные; по воскресеньям — пусто.
+    В каждом ответе есть скрытый стилем страницы слот (09:00) и занятый (09:30) — разбор их пропускать должен.
+    asset_delay — задержка отдачи /static/* (как у CDN на холодную), xhr_delay — у XHR.
+    """
+
+    def __init__(self, asset_delay: float = 0.3, xhr_delay: float = 0.2, bundle_kb: int = 400):
+        self.asset_delay = asset_delay
+        self.xhr_delay = xhr_delay
+        # «бандл» нужного размера: как у живого сайта, холодная загрузка заметно дороже кэшированной
+        self.app_js = APP_JS + "\n/*" + "x" * (bundle_kb * 1024) + "*/\n"
+        self.lock = threading.Lock()
+        self.booked: set[tuple[str, str]] = set()
+        self.hits: dict[str, int] = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fixture-site", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://bumpix.localhost:{self.server.server_address[1]}"
+
+    def room_url(self, room: str = "500141") -> str:
+        return f"{self.base_url}/{room}"
+
+    def start(self) -> "FixtureSite":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.booked.clear()
+            self.hits.clear()
+
+    def free_times(self, iso: str) -> list[str]:
+        if date.fromisoformat(iso).weekday() == 6:
+            return []
+        with self.lock:
+            return [t for t in SLOT_TIMES if (iso, t) not in self.booked]
+
+    def _slots_html(self, iso: str) -> str:
+        times = self.free_times(iso)
+        if not times:
+            return '<div class="empty">Нет свободного времени</div>'
+        labels = ['<label class="btn btn-time slot-hidden"><input type="radio" name="time" value="09:00"> 09:00</label>']
+        labels.append('<label class="btn btn-time disabled"><input type="radio" name="time" value="09:30" disabled> 09:30</label>')
+        labels += [f'<label class="btn btn-time"><input type="radio" name="time" value="{t}"> {t}</label>' for t in times]
+        return "".join(labels)
+
+    def _book(self, payload: dict) -> tuple[int, dict]:
+        key = (str(payload.get("date")), str(payload.get("time")))
+        with self.lock:
+            if key in self.booked or key[1] not in SLOT_TIMES:
+                return 409, {"success": False, "error": "Это время уже занято"}
+            self.booked.add(key)
+        return 200, {"success": True, "message": f"Вы записаны на {key[0]} {key[1]}"}
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: str, ctype: str, headers: dict = None):
+                raw = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(raw)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_GET(self):
+                u = urlparse(self.path)
+                with site.lock:
+                    site.hits[u.path] = site.hits.get(u.path, 0) + 1
+                if u.path.startswith("/static/"):
+                    time.sleep(site.asset_delay)
+                    immutable = {"Cache-Control": "public, max-age=31536000, immutable"}
+                    if u.path == "/static/app.js":
+                        return self._send(200, site.app_js, "application/javascript", immutable)
+                    if u.path == "/static/app.css":
+                        return self._send(200, APP_CSS, "text/css", immutable)
+                    return self._send(404, "", "text/plain")
+                if u.path == "/api/timeblocks":
+                    time.sleep(site.xhr_delay)
+                    iso = (parse_qs(u.query).get("date") or [""])[0]
+                    body = json.dumps({"html": site._slots_html(iso)}, ensure_ascii=False)
+                    return self._send(200, body, "application/json")
+                if u.path == "/favicon.ico":
+                    return self._send(404, "", "text/plain")
+                services = "".join(SERVICE_HTML.format(sid=s, name=n, duration=d, cost=c) for s, n, d, c in SERVICES)
+                return self._send(200, ROOM_HTML.format(services=services), "text/html; charset=utf-8")
+
+            def do_POST(self):
+                u = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    payload = {}
+                if u.path != "/api/appointment":
+                    return self._send(404, "{}", "application/json")
+                time.sleep(site.xhr_delay)
+                status, data = site._book(payload)
+                return self._send(status, json.dumps(data, ensure_ascii=False), "application/json")
+
+        return Handler
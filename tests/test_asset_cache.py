@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+
+def wait_idle(task, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while task.running and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_failed_build_is_not_retried_on_every_start(bot, tmp_path, monkeypatch):
+    builds = []
+
+    def failing_build():
+        builds.append(time.monotonic())
+        raise RuntimeError("bumpix unreachable")
+
+    task = bot.BackgroundTask("asset-cache", failing_build)
+    monkeypatch.setattr(bot, "ASSET_CACHE", True)
+    monkeypatch.setattr(bot, "ASSET_CACHE_DIR", tmp_path / "asset_cache")
+    monkeypatch.setattr(bot, "ASSET_CACHE_TASK", task)
+
+    for _ in range(5):  # пять стартов Chrome подряд
+        bot.refresh_asset_cache_async()
+        wait_idle(task)
+    assert len(builds) == 1
+
+    monkeypatch.setattr(bot, "ASSET_CACHE_RETRY_MIN", 0)
+    bot.refresh_asset_cache_async()
+    wait_idle(task)
+    assert len(builds) == 2
+
+
+def cold_open(bot, url: str, uid: int) -> float:
+    """Новый пользователь: свежий профиль, первый open_page до полной загрузки (с бандлами)."""
+    drv = bot.make_driver(headless=True, profile_dir=bot.profile_dir_for(uid))
+    try:
+        t0 = time.monotonic()
+        bot.open_page(drv, url)
+        bot.WebDriverWait(drv, 30, poll_frequency=bot.WAIT_POLL).until(
+            lambda d: d.execute_script("return document.readyState") == "complete"
+        )
+        return time.monotonic() - t0
+    finally:
+        drv.quit()
+
+
+@pytest.mark.bench
+def test_cold_open_page_with_seeded_cache(fresh_bot, site, tmp_path, monkeypatch):
+    bot = fresh_bot
+    url = site.room_url()
+    monkeypatch.setattr(bot, "ASSET_CACHE_DIR", tmp_path / "asset_cache")
+
+    cold = [cold_open(bot, url, 9000 + i) for i in range(3)]
+    bundle_hits_cold = site.hits.get("/static/app.js", 0)
+
+    monkeypatch.setattr(bot, "ASSET_CACHE", True)
+    bot.build_asset_cache()
+    assert bot.asset_cache_fresh()
+    site.hits.clear()
+    seeded = [cold_open(bot, url, 9100 + i) for i in range(3)]
+    bundle_hits_seeded = site.hits.get("/static/app.js", 0)
+
+    print(
+        f"\ncold open_page: without cache {min(cold):.2f}s (bundle fetched {bundle_hits_cold}x), "
+        f"seeded {min(seeded):.2f}s (bundle fetched {bundle_hits_seeded}x), asset delay {site.asset_delay:.2f}s"
+    )
+    assert bundle_hits_seeded < bundle_hits_cold
+    assert min(seeded) < min(cold)
@@ -0,0 +1,77 @@
+"""Один и тот же набор сценариев на стенде (tests/fixture_site.py) для SeleniumBackend и PlaywrightBackend."""
+
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+
+from fixture_site import SLOT_TIMES
+
+UID = 1001
+
+
+def workday(days_ahead: int) -> date:
+    d = date.today() + timedelta(days=days_ahead)
+    return d + timedelta(days=1) if d.weekday() == 6 else d
+
+
+def sunday(days_ahead: int) -> date:
+    d = date.today() + timedelta(days=days_ahead)
+    return d + timedelta(days=(6 - d.weekday()) % 7)
+
+
+@pytest.fixture(scope="module")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(params=["selenium", "playwright"])
+def backend(request, fresh_bot, loop):
+    bot = fresh_bot
+    if request.param == "playwright":
+        pytest.importorskip("playwright.async_api")
+        b = bot.PlaywrightBackend()
+    else:
+        b = bot.SeleniumBackend()
+    yield b
+    loop.run_until_complete(b.shutdown())
+
+
+def test_get_services(backend, site, loop):
+    items = loop.run_until_complete(backend.get_services(UID, site.room_url()))
+    assert [i.sid for i in items] == ["101", "102", "103"]
+    assert items[0].title.startswith("Репетиция")
+
+
+@pytest.mark.parametrize("days_ahead", [2, 40], ids=["this-month", "next-months"])
+def test_get_times_skips_hidden_and_disabled(backend, site, loop, days_ahead):
+    res = loop.run_until_complete(backend.get_times(UID, site.room_url(), ["101"], workday(days_ahead)))
+    assert res.status == "OK", res.error
+    assert res.times == SLOT_TIMES
+
+
+def test_get_times_empty_day(backend, site, loop):
+    res = loop.run_until_complete(backend.get_times(UID, site.room_url(), ["101"], sunday(3)))
+    assert (res.status, res.times) == ("EMPTY", [])
+
+
+def test_book_one_then_taken(backend, site, loop):
+    d = workday(3)
+    first = loop.run_until_complete(backend.book_appointments(UID, site.room_url(), ["101"], d, ["11:30"], "тест"))
+    assert [a.ok for a in first] == [True], first
+    assert (d.isoformat(), "11:30") in site.booked
+
+    # слот занят, но на странице его уже нет — запись должна честно сообщить о неудаче
+    again = loop.run_until_complete(backend.book_appointments(UID, site.room_url(), ["101"], d, ["11:30"], ""))
+    assert [a.ok for a in again] == [False], again
+
+
+def test_book_parallel(backend, fresh_bot, site, loop, monkeypatch):
+    monkeypatch.setattr(fresh_bot, "PARALLEL_BOOKING", True)
+    d = workday(4)
+    res = loop.run_until_complete(backend.book_appointments(UID, site.room_url(), ["101", "102"], d, ["10:00", "15:30"], ""))
+    assert sorted(a.time for a in res) == ["10:00", "15:30"]
+    assert all(a.ok for a in res), res
+    assert {(d.isoformat(), "10:00"), (d.isoformat(), "15:30")} <= site.booked
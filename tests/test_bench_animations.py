@@ -0,0 +1,55 @@
+"""
+Замер: слоты и запись на стенде (у него CSS-переходы календаря, слотов и панели записи)
+с SUPPRESS_ANIMATIONS и без. Запуск: BUMPIX_BENCH=1 pytest -s -k animations
+"""
+
+import time
+from datetime import date, timedelta
+
+import pytest
+
+ROUNDS = 4
+
+
+def workdays(n: int) -> list[date]:
+    out, d = [], date.today() + timedelta(days=2)
+    while len(out) < n:
+        if d.weekday() != 6:
+            out.append(d)
+        d += timedelta(days=1)
+    return out
+
+
+def run_flows(bot, site, uid: int) -> float:
+    worker = bot.get_worker(uid)
+    url = site.room_url()
+    t0 = time.monotonic()
+    for d in workdays(ROUNDS):
+        bot.SLOTS_CACHE.invalidate(url, ["101"], d)
+        res = worker.get_times(url, ["101"], d)
+        assert res.status == "OK", res.error
+        [attempt] = worker.book_appointments(url, ["101"], d, [res.times[0]], "")
+        assert attempt.ok, attempt.message
+    return time.monotonic() - t0
+
+
+@pytest.mark.bench
+def test_animation_suppression_speedup(fresh_bot, site, monkeypatch):
+    bot = fresh_bot
+    monkeypatch.setattr(bot, "PARALLEL_BOOKING", False)
+    # прогрев тем же пользователем: холодный профиль и кэш статики не должны достаться первому режиму
+    run_flows(bot, site, 2)
+    bot.shutdown_workers()
+
+    results = {}
+    for mode, suppress, scroll, nav in (("animations", False, 0.03, 0.12), ("suppressed", True, 0.0, 0.03)):
+        site.reset()
+        monkeypatch.setattr(bot, "SUPPRESS_ANIMATIONS", suppress)
+        monkeypatch.setattr(bot, "SCROLL_SETTLE_SEC", scroll)
+        monkeypatch.setattr(bot, "CALENDAR_NAV_SETTLE_SEC", nav)
+        monkeypatch.setattr(bot, "WORKERS", {})
+        results[mode] = run_flows(bot, site, 2)
+        bot.shutdown_workers()
+    for mode, sec in results.items():
+        print(f"\n{mode:>10}: {ROUNDS} × (slots + booking) in {sec:.2f}s ({sec / ROUNDS:.2f}s per round)")
+    assert results["suppressed"] <= results["animations"] * 1.05
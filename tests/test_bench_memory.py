@@ -0,0 +1,36 @@
+"""
+Замер памяти: 50 пользователей открывают комнату стенда — свой Chrome на каждого (process)
+против общих Chrome с контекстом на пользователя (contexts). Запуск: BUMPIX_BENCH=1 pytest -s -k memory
+"""
+
+import os
+
+import pytest
+
+USERS = int(os.environ.get("BUMPIX_BENCH_USERS", "50"))
+
+
+def open_rooms(bot, url: str) -> tuple[int, int]:
+    for uid in range(1, USERS + 1):
+        # кэш услуг общий — без очистки страницу открыл бы только первый пользователь
+        bot.SERVICES_CACHE.by_url.clear()
+        assert bot.get_worker(uid).get_services(url)
+    usage = bot.chrome_usage()
+    bot.shutdown_workers()
+    return usage
+
+
+@pytest.mark.bench
+def test_memory_process_vs_contexts(fresh_bot, site, monkeypatch):
+    pytest.importorskip("psutil")
+    bot = fresh_bot
+    url = site.room_url()
+    results = {}
+    for mode in ("process", "contexts"):
+        monkeypatch.setattr(bot, "BROWSER_MODE", mode)
+        monkeypatch.setattr(bot, "WORKERS", {})
+        monkeypatch.setattr(bot, "SHARED_CHROMES_POOL", bot.SharedChromePool())
+        results[mode] = open_rooms(bot, url)
+    for mode, (count, rss) in results.items():
+        print(f"\n{mode:>8}: {USERS} users, {count} Chrome processes, RSS {rss / 2**20:.0f} MB ({rss / USERS / 2**20:.1f} MB/user)")
+    assert results["contexts"][1] < results["process"][1]
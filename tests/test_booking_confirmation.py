@@ -0,0 +1,29 @@
+import pytest
+
+
+@pytest.mark.parametrize(
+    "method, rtype, url, expected",
+    [
+        ("POST", "XHR", "https://bumpix.net/api/appointment/create", True),
+        ("post", "fetch", "https://bumpix.net/booking", True),
+        ("POST", "XHR", "https://bumpix.net/api/stats/collect", False),
+        ("POST", "XHR", "https://mc.yandex.ru/watch/appointment", False),
+        ("GET", "XHR", "https://bumpix.net/api/appointment", False),
+        ("POST", "Document", "https://bumpix.net/appointment", False),
+    ],
+)
+def test_is_booking_post(bot, method, rtype, url, expected):
+    assert bot.is_booking_post(method, rtype, url) is expected
+
+
+def test_no_confirmation_is_not_success(bot):
+    a = bot.booking_attempt_from_confirmation("10:00", None)
+    assert not a.ok
+    assert "не подтверждена" in a.message
+
+
+def test_confirmation_verdicts(bot):
+    ok = bot.booking_attempt_from_confirmation("10:00", bot.BookingConfirmation(True, "Вы записаны", "network"))
+    bad = bot.booking_attempt_from_confirmation("10:00", bot.BookingConfirmation(False, "Время занято", "dom"))
+    assert ok.ok and "Вы записаны" in ok.message
+    assert not bad.ok and "Время занято" in bad.message
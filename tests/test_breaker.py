@@ -0,0 +1,26 @@
+def test_booking_skips_room_with_open_breaker(bot, monkeypatch):
+    monkeypatch.setattr(bot, "BREAKERS", bot.BreakerRegistry())
+    url = "https://bumpix.net/500141"
+    breaker = bot.BREAKERS.get(url)
+    for _ in range(bot.BREAKER_FAIL_THRESHOLD):
+        breaker.record_failure()
+    assert breaker.state == "open"
+
+    # драйвер не нужен: до сайта дело не доходит
+    attempt = bot.book_appointment_flow(None, url, ["101"], bot.date.today(), "10:00", "")
+    assert not attempt.ok
+    assert "ошибкой сервера" in attempt.message
+    assert breaker.server_errors_total == bot.BREAKER_FAIL_THRESHOLD
+
+
+def test_booking_server_error_trips_breaker(bot, monkeypatch):
+    monkeypatch.setattr(bot, "BREAKERS", bot.BreakerRegistry())
+    monkeypatch.setattr(bot, "ensure_calendar_ready", lambda *a, **k: 3)
+    monkeypatch.setattr(bot, "select_date_tracked", lambda *a, **k: "")
+    monkeypatch.setattr(bot, "is_server_error_timeblocks", lambda driver: True)
+    url = "https://bumpix.net/517424"
+
+    messages = [bot.book_appointment_flow(object(), url, ["101"], bot.date.today(), "10:00", "").message for _ in range(bot.BREAKER_FAIL_THRESHOLD + 1)]
+    assert messages[0] == "Серверная ошибка в timeBlocks"
+    assert all("ошибкой сервера" in m for m in messages[bot.BREAKER_FAIL_THRESHOLD - 1:])
+    assert bot.BREAKERS.get(url).server_errors_total == bot.BREAKER_FAIL_THRESHOLD
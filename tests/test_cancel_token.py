@@ -0,0 +1,29 @@
+import time
+
+import pytest
+
+
+def test_child_shares_cancel_but_not_budget(bot):
+    parent = bot.CancelToken()
+    parent.start_budget(0.01)
+    child = parent.child()
+    child.start_budget(60)
+    time.sleep(0.02)
+    child.check()  # бюджет родителя исчерпан, у клона свой
+    with pytest.raises(bot.DeadlineExceeded):
+        parent.check()
+
+    parent.cancel()
+    assert child.cancelled
+    with pytest.raises(bot.JobCancelled):
+        child.check()
+
+
+def test_child_sleep_wakes_on_parent_cancel(bot):
+    parent = bot.CancelToken()
+    child = parent.child()
+    parent.cancel()
+    t0 = time.monotonic()
+    with pytest.raises(bot.JobCancelled):
+        child.sleep(5)
+    assert time.monotonic() - t0 < 1
@@ -0,0 +1,27 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_queued_and_running_counts(bot):
+    load = bot.ExecutorLoad()
+    gate = threading.Event()
+    started = threading.Barrier(3)
+
+    def job():
+        started.wait()
+        gate.wait()
+
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        futures = [load.submit(ex, job) for _ in range(2)]
+        started.wait()  # оба потока заняты
+        waiting = [load.submit(ex, lambda: None) for _ in range(3)]
+        assert (load.queued(), load.running()) == (3, 2)
+
+        assert waiting[0].cancel()  # отменённая до старта не висит в очереди навсегда
+        assert (load.queued(), load.running()) == (2, 2)
+
+        gate.set()
+        for f in futures + waiting[1:]:
+            f.result()
+    assert (load.queued(), load.running()) == (0, 0)
+    assert (load.submitted, load.finished, load.dropped) == (5, 4, 1)
@@ -0,0 +1,22 @@
+def test_old_samples_are_pruned(bot, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(bot.time, "monotonic", lambda: now[0])
+    ring = bot.LatencyRing(size=100, window_sec=60)
+    ring.add("times", 5.0)
+    now[0] += 61
+    ring.add("times", 1.0)
+    assert len(ring.rings["times"]) == 1
+    assert ring.percentiles("times") == (1, [1.0, 1.0, 1.0])
+    assert ring.covered_sec("times") == 60
+
+
+def test_full_ring_reports_shorter_window(bot, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(bot.time, "monotonic", lambda: now[0])
+    ring = bot.LatencyRing(size=10, window_sec=3600)
+    for _ in range(20):
+        ring.add("booking", 2.0)
+        now[0] += 30
+    # в буфере 10 последних задач — это 300 с из часа
+    assert ring.percentiles("booking")[0] == 10
+    assert ring.covered_sec("booking") == 300
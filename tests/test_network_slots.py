@@ -0,0 +1,23 @@
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    "body, expected",
+    [
+        (json.dumps({"html": '<label class="btn-time">10:00</label>'}), (False, '<label class="btn-time">10:00</label>')),
+        # пустой день: разметка без слотов — это ответ «слотов нет», а не «ответа не было»
+        (json.dumps({"status": "ok", "html": '<div class="empty">Нет свободного времени</div>'}), (False, '<div class="empty">Нет свободного времени</div>')),
+        ('<div id="timeBlocks"></div>', (False, '<div id="timeBlocks"></div>')),
+        (json.dumps({"ok": True}), (False, None)),
+        ("serverError", (True, None)),
+    ],
+)
+def test_slots_html_from_payload(bot, body, expected):
+    assert bot.slots_html_from_payload(body) == expected
+
+
+def test_times_html_preferred_over_other_markup(bot):
+    body = json.dumps({"hint": "<b>Выберите время</b>", "html": "<label>11:30</label>"})
+    assert bot.slots_html_from_payload(body) == (False, "<label>11:30</label>")
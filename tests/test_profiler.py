@@ -0,0 +1,33 @@
+import threading
+
+
+def test_one_profile_per_process(bot):
+    prof = bot.OnDemandProfiler()
+    prof.target, prof.left = ("job", None), 3
+
+    first = prof.start("job", "times")
+    assert first is not None
+    other: list = []
+    t = threading.Thread(target=lambda: other.append(prof.start("job", "booking")))
+    t.start()
+    t.join()
+    # второй поток не трогает cProfile, пока идёт первый профиль (на 3.12+ там был бы ValueError)
+    assert other == [None]
+    prof.stop(first, "job times", 0.01)
+
+    again = prof.start("job", "booking")
+    assert again is not None
+    prof.stop(again, "job booking", 0.01)
+    assert prof.left == 1
+
+
+def test_enable_failure_is_not_counted(bot, monkeypatch):
+    prof = bot.OnDemandProfiler()
+    prof.target, prof.left = ("cb", None), 1
+
+    def busy(self):
+        raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(bot.cProfile.Profile, "enable", busy)
+    assert prof.start("cb") is None
+    assert (prof.active, prof.left) == (False, 1)
@@ -0,0 +1,45 @@
+import os
+import threading
+import time
+
+
+def make_profile(root, name: str, mb: int, mtime: float):
+    d = root / name
+    (d / "Default").mkdir(parents=True)
+    (d / "Default" / "Cookies").write_bytes(b"\0" * (mb * 2**20))
+    os.utime(d, (mtime, mtime))
+    return d
+
+
+def test_budget_removes_least_recently_used(bot, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "PROFILES_DIR", tmp_path)
+    monkeypatch.setattr(bot, "PROFILES_TMPFS_DIR", None)
+    monkeypatch.setattr(bot, "PROFILES_BUDGET_MB", 3)
+    now = time.time()
+    old = make_profile(tmp_path, "u_1", 2, now - 300)
+    mid = make_profile(tmp_path, "u_2", 2, now - 200)
+    new = make_profile(tmp_path, "u_3", 1, now - 100)
+
+    assert bot.enforce_profiles_budget() == 1
+    assert not old.exists() and mid.exists() and new.exists()
+    assert not list(tmp_path.glob(".trash-*"))
+
+
+def test_background_task_runs_once_per_interval(bot):
+    release = threading.Event()
+    runs = []
+
+    def work():
+        runs.append(time.monotonic())
+        release.wait(5)
+
+    task = bot.BackgroundTask("test-task", work)
+    assert task.kick(0)
+    assert not task.kick(0)  # ещё идёт — второй поток не запускаем
+    release.set()
+    deadline = time.monotonic() + 5
+    while task.running and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not task.kick(60)  # прошлый запуск был только что
+    assert task.kick(0)
+    assert len(runs) >= 1
@@ -0,0 +1,23 @@
+class FakeProc:
+    def __init__(self, name: str, *args: str):
+        self._name = name
+        self._args = [name, *args]
+
+    def name(self):
+        return self._name
+
+    def cmdline(self):
+        return self._args
+
+
+def test_only_own_chrome_is_reaped(bot, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "PROFILES_DIR", tmp_path)
+    monkeypatch.setattr(bot, "PROFILES_TMPFS_DIR", None)
+    monkeypatch.setattr(bot, "BOT_CHROME_FLAG", f"--bumpix-bot={tmp_path}")
+
+    assert bot._is_bot_chrome(FakeProc("chrome", "--headless=new", f"--bumpix-bot={tmp_path}"))
+    assert bot._is_bot_chrome(FakeProc("chrome", f"--user-data-dir={tmp_path / 'u_1'}"))
+    # чужая автоматизация того же пользователя ОС, в том числе осиротевшая, — не наша
+    assert not bot._is_bot_chrome(FakeProc("chrome", "--enable-automation", "--user-data-dir=/tmp/.org.chromium.Chromium.x"))
+    assert not bot._is_bot_chrome(FakeProc("chromedriver", "--port=9515"))
+    assert not bot._is_bot_chrome(FakeProc("chrome", "--bumpix-bot=/srv/other/chrome_profiles"))
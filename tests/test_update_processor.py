@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+import pytest
+
+
+def make_update(bot, update_id: int, uid: int, data: str = "noop"):
+    from telegram import CallbackQuery, Update, User
+
+    user = User(id=uid, first_name=f"u{uid}", is_bot=False)
+    query = CallbackQuery(id=str(update_id), from_user=user, chat_instance="c", data=data)
+    return Update(update_id=update_id, callback_query=query)
+
+
+async def feed(proc, updates):
+    """Как Application: каждый апдейт — отдельная задача, в порядке поступления."""
+    await asyncio.gather(*(proc.process_update(u, coro) for u, coro in updates))
+
+
+@pytest.mark.parametrize("limit", [4, 32])
+def test_busy_user_does_not_delay_others(bot, limit):
+    proc = bot.PerUserUpdateProcessor(limit)
+    t0 = time.monotonic()
+    done_at: dict[int, float] = {}
+
+    async def handler(uid: int, sec: float):
+        await asyncio.sleep(sec)
+        done_at[uid] = time.monotonic() - t0
+
+    # один пользователь жмёт 20 раз подряд (20 × 0.2 с по очереди = 4 с), следом 49 пользователей по одному апдейту
+    updates = [(make_update(bot, i, 1), handler(1, 0.2)) for i in range(20)]
+    updates += [(make_update(bot, 100 + uid, uid), handler(uid, 0.02)) for uid in range(2, 51)]
+    asyncio.run(feed(proc, updates))
+
+    others = [done_at[uid] for uid in range(2, 51)]
+    assert max(others) < 1.0, f"other users waited {max(others):.2f}s behind the busy one"
+    assert done_at[1] >= 20 * 0.2
+    assert proc.queued() == 0
+
+
+def test_per_user_order_kept(bot):
+    proc = bot.PerUserUpdateProcessor(8)
+    seen: dict[int, list[int]] = {}
+    running: set[int] = set()
+
+    async def handler(uid: int, seq: int):
+        assert uid not in running, "two updates of one user ran concurrently"
+        running.add(uid)
+        await asyncio.sleep(0.01)
+        seen.setdefault(uid, []).append(seq)
+        running.discard(uid)
+
+    updates = [(make_update(bot, uid * 10 + seq, uid), handler(uid, seq)) for seq in range(5) for uid in range(1, 51)]
+    asyncio.run(feed(proc, updates))
+    assert all(seq == list(range(5)) for seq in seen.values())
+    assert len(seen) == 50
+
+
+def test_throughput_50_users(bot):
+    """Нагрузочный прогон: 50 пользователей × 4 апдейта по 50 мс при лимите CONCURRENT_UPDATES."""
+    proc = bot.PerUserUpdateProcessor(bot.CONCURRENT_UPDATES)
+    n_users, per_user, sec = 50, 4, 0.05
+
+    async def handler():
+        await asyncio.sleep(sec)
+
+    updates = [(make_update(bot, uid * 10 + seq, uid), handler()) for seq in range(per_user) for uid in range(1, n_users + 1)]
+    t0 = time.monotonic()
+    asyncio.run(feed(proc, updates))
+    elapsed = time.monotonic() - t0
+    total = n_users * per_user
+    print(f"\n{total} updates from {n_users} users in {elapsed:.2f}s ({total / elapsed:.0f} updates/s, serial: {total * sec:.1f}s)")
+    # нижняя граница — per_user × sec (очередь одного пользователя) и total × sec / лимит
+    assert elapsed < 3 * max(per_user * sec, total * sec / bot.CONCURRENT_UPDATES)
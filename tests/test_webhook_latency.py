@@ -0,0 +1,208 @@
+"""
+Время от появления апдейта «на стороне Telegram» до хендлера: webhook против long polling.
+Сеть моделируется задержкой в одну сторону ONE_WAY; Bot API подменён через BaseRequest, без обращений наружу.
+"""
+
+import asyncio
+import json
+import socket
+import statistics
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+ONE_WAY = 0.05
+N_UPDATES = 40
+ARRIVAL_GAP = 0.02
+SECRET = "test-secret"
+
+
+def update_json(update_id: int) -> dict:
+    uid = 1 + update_id % 10
+    user = {"id": uid, "is_bot": False, "first_name": f"u{uid}"}
+    return {"update_id": update_id, "callback_query": {"id": str(update_id), "from": user, "chat_instance": "c", "data": "noop"}}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_fake_telegram():
+    from telegram.request import BaseRequest
+
+    class FakeTelegram(BaseRequest):
+        """Bot API в памяти: getUpdates — long poll по очереди апдейтов, с задержкой сети в обе стороны."""
+
+        def __init__(self):
+            self.queue: asyncio.Queue = asyncio.Queue()
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        @property
+        def read_timeout(self):
+            # абстрактное свойство BaseRequest с PTB 22
+            return None
+
+        async def do_request(self, url, method, request_data=None, *args, **kwargs):
+            name = url.rsplit("/", 1)[-1]
+            if name == "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "bot", "username": "bot"}
+            elif name == "getUpdates":
+                result = await self._get_updates(float((request_data.parameters if request_data else {}).get("timeout") or 0))
+            else:
+                result = True
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+        async def _get_updates(self, timeout: float) -> list[dict]:
+            await asyncio.sleep(ONE_WAY)  # запрос доходит до Telegram
+            batch = []
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                pass
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            await asyncio.sleep(ONE_WAY)  # ответ доходит до бота
+            return batch
+
+    return FakeTelegram()
+
+
+async def measure(bot, mode: str) -> list[float]:
+    from telegram import Update
+    from telegram.ext import Application, TypeHandler
+
+    tg = make_fake_telegram()
+    app = (
+        Application.builder()
+        .token("1:TEST")
+        .request(tg)
+        .get_updates_request(tg)
+        .concurrent_updates(bot.PerUserUpdateProcessor(bot.CONCURRENT_UPDATES))
+        .build()
+    )
+    arrived: dict[int, float] = {}
+    latency: dict[int, float] = {}
+    done = asyncio.Event()
+
+    async def record(update: Update, context):
+        latency[update.update_id] = time.monotonic() - arrived[update.update_id]
+        if len(latency) == N_UPDATES:
+            done.set()
+
+    app.add_handler(TypeHandler(Update, record))
+    await app.initialize()
+    port = free_port()
+    if mode == "webhook":
+        await app.updater.start_webhook(
+            listen="127.0.0.1", port=port, url_path="telegram", secret_token=SECRET, webhook_url=f"http://127.0.0.1:{port}/telegram"
+        )
+    else:
+        await app.updater.start_polling(poll_interval=0, timeout=10)
+    await app.start()
+
+    loop = asyncio.get_running_loop()
+
+    def post(payload: dict):
+        req = urllib.request.Request(
+            f"http://127.0.0.1:{port}/telegram",
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": SECRET},
+        )
+        urllib.request.urlopen(req, timeout=5).read()
+
+    async def deliver(update_id: int):
+        await asyncio.sleep(update_id * ARRIVAL_GAP)
+        arrived[update_id] = time.monotonic()
+        if mode == "webhook":
+            await asyncio.sleep(ONE_WAY)  # Telegram → бот
+            await loop.run_in_executor(None, post, update_json(update_id))
+        else:
+            tg.queue.put_nowait(update_json(update_id))
+
+    try:
+        await asyncio.gather(*(deliver(i) for i in range(N_UPDATES)))
+        await asyncio.wait_for(done.wait(), 10)
+    finally:
+        await app.updater.stop()
+        await app.stop()
+        await app.shutdown()
+    return [latency[i] for i in range(N_UPDATES)]
+
+
+def p95(xs: list[float]) -> float:
+    return sorted(xs)[int(len(xs) * 0.95) - 1]
+
+
+def test_webhook_beats_polling(bot):
+    pytest.importorskip("tornado")
+    results = {mode: asyncio.run(measure(bot, mode)) for mode in ("polling", "webhook")}
+    for mode, xs in results.items():
+        print(f"\n{mode:>8}: median {statistics.median(xs) * 1000:.0f} ms, p95 {p95(xs) * 1000:.0f} ms (one-way {ONE_WAY * 1000:.0f} ms)")
+    # webhook: одна доставка; polling: апдейт, пришедший пока getUpdates «в пути», ждёт следующего запроса
+    assert statistics.median(results["webhook"]) < statistics.median(results["polling"])
+    assert p95(results["webhook"]) < 2 * ONE_WAY
+
+
+def test_webhook_rejects_wrong_secret(bot):
+    pytest.importorskip("tornado")
+    from telegram.ext import Application
+
+    async def run() -> int:
+        tg = make_fake_telegram()
+        app = Application.builder().token("1:TEST").request(tg).get_updates_request(tg).build()
+        await app.initialize()
+        port = free_port()
+        await app.updater.start_webhook(listen="127.0.0.1", port=port, url_path="telegram", secret_token=SECRET)
+        req = urllib.request.Request(
+            f"http://127.0.0.1:{port}/telegram",
+            data=json.dumps(update_json(1)).encode(),
+            headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": "wrong"},
+        )
+        try:
+            await asyncio.to_thread(urllib.request.urlopen, req, None, 5)
+            status = 200
+        except urllib.error.HTTPError as e:
+            status = e.code
+        await app.updater.stop()
+        await app.shutdown()
+        return status
+
+    assert asyncio.run(run()) == 403
+
+
+def test_health_route(bot, monkeypatch):
+    pytest.importorskip("tornado")
+    from telegram.ext import Application
+
+    port = free_port()
+    monkeypatch.setattr(bot, "HEALTH_LISTEN", "127.0.0.1")
+    monkeypatch.setattr(bot, "HEALTH_PORT", port)
+
+    async def run() -> tuple[int, dict]:
+        tg = make_fake_telegram()
+        app = Application.builder().token("1:TEST").request(tg).get_updates_request(tg).build()
+        await app.initialize()
+        await app.start()
+        server = bot.start_health_server(app)
+        try:
+            resp = await asyncio.to_thread(urllib.request.urlopen, f"http://127.0.0.1:{port}/healthz", None, 5)
+            return resp.status, json.loads(resp.read())
+        finally:
+            server.stop()
+            await app.stop()
+            await app.shutdown()
+
+    status, body = asyncio.run(run())
+    assert status == 200
+    assert body["ok"] is True
+    assert body["mode"] == bot.UPDATE_MODE
+    assert body["update_queue"] == 0